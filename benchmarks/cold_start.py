@@ -0,0 +1,103 @@
+"""
+Import-time and cold-start benchmark for the pipeline Lambdas.
+
+Every measurement runs in a fresh interpreter, like a Lambda cold start:
+- import: wall time to import the handler module, plus the slowest packages reported by
+  ``python -X importtime``.
+- first clients: wall time to import the handler and create the clients it uses.
+
+Usage (from the repo root):
+    python -m benchmarks.cold_start [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+HANDLERS = {
+    "daily_scheduler": ["get_dynamodb_resource", "get_stepfunctions_client"],
+    "fetch_images_with_metadata": ["get_dynamodb_resource"],
+    "generate_memories_and_diary": ["get_dynamodb_resource", "get_rekognition_client",
+                                    "get_s3_client", "get_openai_client"],
+    "embed_memories_to_pinecone": ["get_dynamodb_resource", "get_s3_client",
+                                   "get_openai_client", "get_pinecone_client"],
+    "retrieve_memories": ["get_s3_client", "get_openai_client", "get_pinecone_client"],
+}
+
+# Dummy configuration so modules import and clients construct without touching AWS
+BENCH_ENV = {
+    "AWS_LAMBDA_FUNCTION_NAME": "cold-start-benchmark",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "DDB_TABLE_NAME": "PipelineTransactionLog",
+    "SIMULATED_DATES_TABLE": "SimulatedDates",
+    "STEP_FUNCTION_ARN": "arn:aws:states:us-east-1:000000000000:stateMachine:benchmark",
+    "OPENAI_API_KEY": "benchmark",
+    "PINECONE_API_KEY": "benchmark",
+    "NASA_API_KEY": "benchmark",
+}
+
+SNIPPET = """
+import json, time
+start = time.perf_counter()
+import functions.{handler}.app
+imported = time.perf_counter()
+from utils import clients
+for factory in {factories!r}:
+    getattr(clients, factory)()
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000,
+                  "clients_ms": (done - start) * 1000}}))
+"""
+
+
+def _run(code, importtime=False):
+    env = {**os.environ, **BENCH_ENV}
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return result.stdout, result.stderr
+
+
+def slowest_imports(handler, top=5):
+    """
+    Return the packages with the largest total import time (summed over their modules), in ms.
+    """
+    _, stderr = _run(f"import functions.{handler}.app", importtime=True)
+    totals = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        root = name.strip().split(".")[0]
+        totals[root] = totals.get(root, 0) + int(self_us) / 1000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per handler")
+    args = parser.parse_args()
+
+    for handler, factories in HANDLERS.items():
+        samples = []
+        for _ in range(args.runs):
+            stdout, _ = _run(SNIPPET.format(handler=handler, factories=factories))
+            samples.append(json.loads(stdout.strip().splitlines()[-1]))
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        clients_ms = statistics.median(s["clients_ms"] for s in samples)
+        print(f"{handler}: import {import_ms:.0f} ms, import + first clients "
+              f"{clients_ms:.0f} ms (median of {args.runs})")
+        for name, ms in slowest_imports(handler):
+            print(f"    {name:<24}{ms:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Search latency benchmark for the local vector index (functions/utils/local_index.py).
+
+Builds an index of random unit vectors with a few years of dates and two memory types in
+a temporary directory, then times exact top-k queries with and without filters.
+
+Usage (from the repo root):
+    python -m benchmarks.local_index [--vectors 10000 50000] [--dims 1536] [--queries 50]
+                                     [--pure-python]
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "functions")))
+
+from benchmarks.pipeline import percentile  # noqa: E402
+from utils.local_index import LocalVectorIndex  # noqa: E402
+
+FIRST_DATE = date(2012, 8, 6)
+UPSERT_BATCH_SIZE = 1000
+
+
+def build_index(directory, count, dims, rng, use_numpy=True):
+    index = LocalVectorIndex(directory, use_numpy=use_numpy)
+    for start in range(0, count, UPSERT_BATCH_SIZE):
+        index.upsert([
+            {"id": f"memory-{i}", "values": [rng.gauss(0, 1) for _ in range(dims)],
+             "metadata": {"date": (FIRST_DATE + timedelta(days=i % 4000)).isoformat(),
+                          "type": "diary" if i % 10 == 0 else "memory",
+                          "s3_url": f"s3://curiosity-data-1205/memories/{i}.txt"}}
+            for i in range(start, min(count, start + UPSERT_BATCH_SIZE))
+        ])
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--pure-python", action="store_true",
+                        help="time the search without numpy")
+    args = parser.parse_args()
+    use_numpy = not args.pure_python
+    if use_numpy and importlib.util.find_spec("numpy") is None:
+        parser.error("numpy is not installed; install it (see the layer requirements) "
+                     "or pass --pure-python")
+    print("Search path: " + ("numpy" if use_numpy else "pure Python"))
+
+    rng = random.Random(0)
+    filters = {
+        "none": {},
+        "one year": {"start_date": "2014-01-01", "end_date": "2014-12-31"},
+        "diary only": {"types": ["diary"]},
+    }
+    for count in args.vectors:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            index = build_index(directory, count, args.dims, rng, use_numpy)
+            print(f"\n{count} vectors x {args.dims} dims: built in "
+                  f"{time.perf_counter() - start:.1f} s")
+            queries = [[rng.gauss(0, 1) for _ in range(args.dims)] for _ in range(args.queries)]
+            index.search(queries[0], args.top_k)  # Map the vectors and import numpy first
+            for name, kwargs in filters.items():
+                samples = []
+                for query in queries:
+                    start = time.perf_counter()
+                    index.search(query, args.top_k, **kwargs)
+                    samples.append((time.perf_counter() - start) * 1000)
+                print(f"    filter {name:<12} p50 {percentile(samples, 0.5):8.2f} ms   "
+                      f"p99 {percentile(samples, 0.99):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+End-to-end throughput benchmark for the fetch, generate and embed Lambdas.
+
+The handlers run in-process against the fakes in tests/fakes.py, one date after another as
+the state machine would, so nothing touches the network. For each number of dates it reports:
+- per-stage latency percentiles (p50, p90, p99 and max over dates) and failures,
+- calls made to each backend,
+- peak traced Python memory (tracemalloc) over the whole run, including what the fakes
+  store (S3 objects and float32 vectors).
+
+With --streaming the dates go through runner/pipeline.py instead, which streams each photo
+through the stages on its own; the report then has one row of per-photo latencies.
+
+Latencies of the fakes are typical production latencies multiplied by --latency-scale, so the
+default run finishes quickly while keeping the relative cost of each backend.
+
+Usage (from the repo root):
+    python -m benchmarks.pipeline [--dates 1 10 100 1000] [--latency-scale 0.001]
+                                  [--error-rate 0.0] [--stage-manifests] [--streaming]
+                                  [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.cold_start import BENCH_ENV
+
+STAGES = ["fetch", "generate", "embed"]
+
+
+def percentile(samples, fraction):
+    """
+    Return the nearest-rank percentile of samples.
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def benchmark_dates(count, mission):
+    """
+    Return count Earth dates spread evenly across the fixture mission.
+    """
+    step = max(1, mission.max_sol // count)
+    return [mission.earth_date(sol) for sol in range(1, mission.max_sol + 1, step)][:count]
+
+
+def reset_caches(cache_dir):
+    """
+    Point the pipeline's caches at a fresh directory and drop the in-memory copies.
+    """
+    from functions.embed_memories_to_pinecone import app as embed_app
+    from functions.fetch_images_with_metadata import app as fetch_app
+    from functions.generate_memories_and_diary import app as generate_app
+    from utils import mission_manifest
+
+    os.environ["NASA_CACHE_DIR"] = os.path.join(cache_dir, "nasa_cache")
+    os.environ["MANIFEST_CACHE_DIR"] = os.path.join(cache_dir, "nasa_cache")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(cache_dir, "embedding_cache.sqlite")
+    os.environ["LABEL_CACHE_DIR"] = os.path.join(cache_dir, "label_cache")
+    fetch_app._photo_cache = None
+    generate_app._label_cache = None
+    embed_app._embedding_cache = None
+    mission_manifest._manifest = None
+
+
+def run_date(earth_date, timings, failures):
+    """
+    Run the three stages for one date, recording each stage's wall time in ms.
+    """
+    from functions.embed_memories_to_pinecone import app as embed_app
+    from functions.fetch_images_with_metadata import app as fetch_app
+    from functions.generate_memories_and_diary import app as generate_app
+
+    stages = [
+        ("fetch", lambda _: fetch_app.lambda_handler({"earth_date": earth_date}, None)),
+        ("generate", lambda result: generate_app.lambda_handler(
+            {"earth_date": earth_date, "fetch_result": result}, None)),
+        ("embed", lambda result: embed_app.lambda_handler(
+            {"earth_date": earth_date, "process_result": result}, None)),
+    ]
+    result = None
+    for stage, handler in stages:
+        start = time.perf_counter()
+        try:
+            result = handler(result)
+        except Exception:
+            result = {"statusCode": 500}
+        timings[stage].append((time.perf_counter() - start) * 1000)
+        if result.get("statusCode") != 200:
+            failures[stage] += 1
+            return
+
+
+def run(count, args):
+    from tests.fakes import FixtureMission, install_fakes
+
+    mission = FixtureMission()
+    backends = install_fakes(latency_scale=args.latency_scale, error_rate=args.error_rate,
+                             seed=args.seed, mission=mission)
+    timings = {stage: [] for stage in STAGES}
+    failures = {stage: 0 for stage in STAGES}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        reset_caches(cache_dir)
+        tracemalloc.start()
+        start = time.perf_counter()
+        if args.streaming:
+            from runner.pipeline import PipelineRunner
+
+            runner = PipelineRunner()
+            summary = asyncio.run(runner.run(benchmark_dates(count, mission)))
+            timings = {"photo": runner.photo_latencies_ms}
+            failures = {"photo": summary["failed"]}
+        else:
+            for earth_date in benchmark_dates(count, mission):
+                run_date(earth_date, timings, failures)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "dates": count,
+        "elapsed_s": elapsed,
+        "dates_per_s": count / elapsed,
+        "peak_memory_mb": peak / (1024 * 1024),
+        "stages": {
+            stage: {
+                "runs": len(samples),
+                "failures": failures[stage],
+                "p50_ms": percentile(samples, 0.5) if samples else None,
+                "p90_ms": percentile(samples, 0.9) if samples else None,
+                "p99_ms": percentile(samples, 0.99) if samples else None,
+                "max_ms": max(samples) if samples else None,
+                "mean_ms": statistics.mean(samples) if samples else None,
+            }
+            for stage, samples in timings.items()
+        },
+        "calls": dict(sorted(backends.stats.counts.items())),
+    }
+
+
+def print_report(report):
+    print(f"\n{report['dates']} dates: {report['elapsed_s']:.2f} s "
+          f"({report['dates_per_s']:.1f} dates/s), peak memory {report['peak_memory_mb']:.1f} MB")
+    print(f"    {'stage':<10}{'runs':>6}{'failed':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, row in report["stages"].items():
+        if not row["runs"]:
+            continue
+        print(f"    {stage:<10}{row['runs']:>6}{row['failures']:>8}"
+              + "".join(f"{row[key]:>8.1f}ms" for key in ["p50_ms", "p90_ms", "p99_ms", "max_ms"]))
+    print("    calls: " + ", ".join(f"{name}={count}" for name, count in report["calls"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dates", type=int, nargs="+", default=[1, 10, 100, 1000],
+                        help="numbers of dates to run")
+    parser.add_argument("--latency-scale", type=float, default=0.001,
+                        help="multiplier on typical backend latencies (1 = production-like)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of backend calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stage-manifests", action="store_true",
+                        help="hand records between stages as S3 manifests")
+    parser.add_argument("--streaming", action="store_true",
+                        help="stream photos through the stages with runner/pipeline.py")
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args()
+
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+    os.environ["STAGE_MANIFESTS"] = "true" if args.stage_manifests else "false"
+    os.environ["EMIT_METRICS"] = "false"
+    logging.disable(logging.ERROR)  # Failures are counted in the report
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "functions")))
+
+    reports = []
+    for count in args.dates:
+        report = run(count, args)
+        print_report(report)
+        reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
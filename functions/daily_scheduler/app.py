@@ -1,13 +1,16 @@
 import json
 import logging
 import os
+import re
 import sys
-import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file when running outside Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Add the parent directory to sys.path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,7 +22,12 @@ if repo_root not in sys.path or functions_dir not in sys.path:
     sys.path.append(repo_root)  # Ensure repo root is in sys.path
     sys.path.append(functions_dir)  # Ensure functions directory is in sys.path
 
-from utils.ddb_utility import update_pipeline_log
+from utils.clients import get_dynamodb_resource, get_dynamodb_table, get_stepfunctions_client
+from utils.ddb_utility import (INCOMPLETE_STATUSES, PipelineLogWriter, iter_incomplete_dates,
+                               update_pipeline_log, wait_for_pipeline_log)
+from utils.mission_manifest import get_mission_manifest
+from utils.rate_limiter import MAX_RETRIES, backoff_seconds
+from utils.tracing import finish_trace, span, start_trace
 
 # Define logger
 logger = logging.getLogger()
@@ -32,30 +40,106 @@ logger.setLevel(logging.INFO)  # Set logging level
 
 # Constants
 LAMBDA_NAME = "Lambda0: Daily Scheduler"
+BACKFILL_PREFIX = "backfill#"  # Backfill progress items share the SimulatedDates table
+BACKFILL_POLL_SECONDS = 20  # Wait between waves while executions are still running
+BACKFILL_DEADLINE_MARGIN_MS = 30000  # Stop starting waves this long before the timeout
+BACKFILL_STARTS_PER_SECOND = float(os.getenv("BACKFILL_STARTS_PER_SECOND", 2))
+DEFAULT_START_DATE = "2012-08-06"  # Starting date for new simulations
+TEST_SIMULATION_ID = "test"  # Stays on its date, so it is never part of a fan-out
+BATCH_GET_MAX_KEYS = 100  # BatchGetItem reads at most 100 items per request
+SIMULATION_MAX_CONCURRENCY = int(os.getenv("SIMULATION_MAX_CONCURRENCY", 10))
 
-# Initialize clients
-dynamodb = boto3.resource("dynamodb")
-stepfunctions = boto3.client("stepfunctions")
+
+def date_has_photos(earth_date, camera="NAVCAM"):
+    """
+    False only when the mission manifest shows camera took no photos on earth_date.
+    Dates past the manifest, or a manifest that cannot be loaded, count as having photos.
+    """
+    nasa_api_key = os.getenv("NASA_API_KEY")
+    if not nasa_api_key:
+        return True
+    try:
+        has_photos = get_mission_manifest(nasa_api_key).has_camera_on(earth_date, camera)
+    except Exception as e:
+        logger.warning(f"Mission manifest unavailable, not skipping {earth_date}: {e}")
+        return True
+    return has_photos is not False
+
+
+def next_date(earth_date):
+    return (datetime.strptime(earth_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def advance_simulation(table, simulation_id, current_date):
+    """
+    Move a simulation from current_date to the next day in one conditional update.
+    Returns False, without changing anything, if the simulation is no longer on
+    current_date because an overlapping invocation advanced it first.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        with span("dynamodb.update_simulation"):
+            table.update_item(
+                Key={"simulation_id": simulation_id},
+                UpdateExpression="SET earth_date = :next_date",
+                ConditionExpression="earth_date = :current_date",
+                ExpressionAttributeValues={":next_date": next_date(current_date),
+                                           ":current_date": current_date}
+            )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        logger.warning(f"Simulation '{simulation_id}' is no longer on {current_date}; "
+                       "another invocation advanced it.")
+        return False
+    return True
 
 
 def lambda_handler(event, context):
+    """
+    Lambda function to start the pipeline for the current date of a simulation and advance
+    the simulation to the next date.
+
+    Input: {"simulation_id": "mvp"} for one simulation, or {"simulation_ids": "all"} (or a
+    list of ids) to run many simulations in one invocation (see schedule_simulations).
+    """
     # Get environment variables
     SIMULATED_DATES_TABLE = os.environ["SIMULATED_DATES_TABLE"]
     STEP_FUNCTION_ARN = os.environ["STEP_FUNCTION_ARN"]
     if not SIMULATED_DATES_TABLE or not STEP_FUNCTION_ARN:
         raise ValueError("Environment variables not set.")
 
+    if "simulation_ids" in event:
+        simulation_ids = event["simulation_ids"]
+        start_trace("schedule")
+        try:
+            results = schedule_simulations(
+                SIMULATED_DATES_TABLE, STEP_FUNCTION_ARN,
+                simulation_ids=None if simulation_ids == "all" else simulation_ids,
+                max_concurrency=int(event.get("max_concurrency", SIMULATION_MAX_CONCURRENCY)))
+        finally:
+            finish_trace()
+        statuses = [result["status"] for result in results]
+        return {
+            "statusCode": 200,
+            "body": {"simulations": results,
+                     **{status.lower(): statuses.count(status) for status in set(statuses)}}
+        }
+
     # Get simulation_id from the EventBridge input
-    simulation_id = event.get("simulation_id", "test") # Default to test
-        
+    simulation_id = event.get("simulation_id", TEST_SIMULATION_ID)  # Default to test
+    start_trace("schedule")
+
     # Fetch current earth_date for the given simulation_id
-    table = dynamodb.Table(SIMULATED_DATES_TABLE)
-    response = table.get_item(Key={"simulation_id": simulation_id})
+    table = get_dynamodb_table(SIMULATED_DATES_TABLE)
+    with span("dynamodb.get_simulation"):
+        response = table.get_item(Key={"simulation_id": simulation_id})
 
     # Handle missing simulation_id by seeding a new simulation
     if "Item" not in response:
         logger.warning(f"Simulation ID '{simulation_id}' not found. Creating a new entry.")
-        default_date = "2012-08-06"  # Default starting date for new simulations
+        default_date = DEFAULT_START_DATE
         table.put_item(
             Item={
                 "simulation_id": simulation_id,
@@ -70,34 +154,57 @@ def lambda_handler(event, context):
     
     try:
         # Determine if date should increment
-        if simulation_id != "test":
-            # Increment date for non-test simulations
-            current_date = datetime.strptime(current_date_str, "%Y-%m-%d")
-            next_date = current_date + timedelta(days=1)
-            next_date_str = next_date.strftime("%Y-%m-%d")
-
-            # Update the SimulatedDates table with the incremented date
-            table.update_item(
-                Key={"simulation_id": simulation_id},
-                UpdateExpression="SET earth_date = :next_date",
-                ExpressionAttributeValues={":next_date": next_date_str}
-            )
-            logger.info(f"Updated date for simulation '{simulation_id}' to: {next_date_str}")
+        if simulation_id != TEST_SIMULATION_ID:
+            # Increment date for non-test simulations; if an overlapping trigger already
+            # did, it also started the pipeline for this date
+            if not advance_simulation(table, simulation_id, current_date_str):
+                finish_trace()
+                return {
+                    "statusCode": 200,
+                    "body": {"earth_date": current_date_str, "skipped": True}
+                }
+            logger.info(f"Updated date for simulation '{simulation_id}' to: "
+                        f"{next_date(current_date_str)}")
         else:
             logger.info(f"No date increment for simulation '{simulation_id}' (test mode).")
         
-        # Start the Step Function with the current date
+        # Skip dates without NAVCAM photos (the test simulation always runs the pipeline)
+        if simulation_id != TEST_SIMULATION_ID and not date_has_photos(current_date_str):
+            logger.info(f"No NAVCAM photos on {current_date_str}, not starting the pipeline.")
+            update_pipeline_log(earth_date=current_date_str, lambda_name=LAMBDA_NAME,
+                                lambda_status="SKIPPED", lambda_output="No NAVCAM photos.",
+                                timings=finish_trace(current_date_str))
+            wait_for_pipeline_log()
+            return {
+                "statusCode": 200,
+                "body": {"earth_date": current_date_str, "skipped": True}
+            }
+
+        # Start the Step Function with the current date. Named like the fan-out's
+        # executions, so a retried invocation finds the execution instead of starting
+        # another; the test simulation reruns its date, so its executions stay unnamed.
         step_function_input = {
             "earth_date": current_date_str
         }
-        response = stepfunctions.start_execution(
-            stateMachineArn=STEP_FUNCTION_ARN,
-            input=json.dumps(step_function_input)
-        )
-        step_function_run_id = response["executionArn"]
+        stepfunctions = get_stepfunctions_client()
+        name_kwargs = {}
+        if simulation_id != TEST_SIMULATION_ID:
+            name_kwargs["name"] = execution_name(simulation_id, current_date_str)
+        try:
+            with span("stepfunctions.start_execution"):
+                response = stepfunctions.start_execution(
+                    stateMachineArn=STEP_FUNCTION_ARN,
+                    input=json.dumps(step_function_input),
+                    **name_kwargs
+                )
+            step_function_run_id = response["executionArn"]
+        except stepfunctions.exceptions.ExecutionAlreadyExists:
+            step_function_run_id = _execution_arn(STEP_FUNCTION_ARN, name_kwargs["name"])
         logger.info(f"Triggered Step Function with Earth date {current_date_str}.")
         update_pipeline_log(earth_date=current_date_str, lambda_name=LAMBDA_NAME,
-                            lambda_status="SUCCESS", lambda_output=step_function_run_id)
+                            lambda_status="SUCCESS", lambda_output=step_function_run_id,
+                            timings=finish_trace(current_date_str))
+        wait_for_pipeline_log()
         return {
             "statusCode": 200,
             "body": {"earth_date": current_date_str, "step_function_arn": STEP_FUNCTION_ARN,
@@ -107,13 +214,351 @@ def lambda_handler(event, context):
     except Exception as e:
         logger.error(f"An internal error occurred: {e}")
         update_pipeline_log(earth_date=current_date_str, lambda_name=LAMBDA_NAME,
-                            lambda_status="ERROR", lambda_output=str(e))
+                            lambda_status="ERROR", lambda_output=str(e),
+                            timings=finish_trace(current_date_str))
+        wait_for_pipeline_log()
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
         }
 
 
+def _execution_arn(state_machine_arn, name):
+    return state_machine_arn.replace(":stateMachine:", ":execution:") + f":{name}"
+
+
+def execution_name(simulation_id, earth_date):
+    """
+    Name of a simulation's execution for earth_date; names may use letters, digits, "-" and
+    "_" and be up to 80 characters long.
+    """
+    return re.sub(r"[^A-Za-z0-9_-]", "-", f"{simulation_id}-{earth_date}")[-80:]
+
+
+def _is_scheduled(item):
+    simulation_id = item["simulation_id"]
+    return (not simulation_id.startswith(BACKFILL_PREFIX) and simulation_id != TEST_SIMULATION_ID
+            and "earth_date" in item and item.get("active", True) is not False)
+
+
+def list_simulations(table):
+    """
+    Scan for every simulation to schedule, skipping backfill progress items, the test
+    simulation and simulations with "active" set to false. Returns {simulation_id: date}.
+    """
+    simulations = {}
+    kwargs = {"ConsistentRead": True}
+    while True:
+        with span("dynamodb.scan_simulations"):
+            response = table.scan(**kwargs)
+        for item in response["Items"]:
+            if _is_scheduled(item):
+                simulations[item["simulation_id"]] = item["earth_date"]
+        if "LastEvaluatedKey" not in response:
+            return simulations
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_simulations(table, simulation_ids, sleep=time.sleep):
+    """
+    Read simulations with BatchGetItem, retrying unprocessed keys with backoff up to
+    RATE_LIMIT_MAX_RETRIES times. Simulations still unread after that are logged and left
+    for the next run; those that do not exist yet are created at DEFAULT_START_DATE.
+    Returns {simulation_id: date} for those to schedule (see list_simulations).
+    """
+    from botocore.exceptions import ClientError
+
+    resource = get_dynamodb_resource()
+    simulation_ids = list(dict.fromkeys(simulation_ids))
+    items = {}
+    unread = set()
+    for start in range(0, len(simulation_ids), BATCH_GET_MAX_KEYS):
+        request = {table.name: {
+            "Keys": [{"simulation_id": simulation_id}
+                     for simulation_id in simulation_ids[start:start + BATCH_GET_MAX_KEYS]],
+            "ConsistentRead": True}}
+        attempt = 0
+        while request:
+            with span("dynamodb.batch_get_simulations"):
+                response = resource.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(table.name, []):
+                items[item["simulation_id"]] = item
+            request = response.get("UnprocessedKeys")
+            if request and attempt >= MAX_RETRIES:
+                unread.update(key["simulation_id"] for key in request[table.name]["Keys"])
+                logger.error(f"Could not read {len(request[table.name]['Keys'])} simulations "
+                             f"after {attempt} retries; skipping them this run.")
+                break
+            if request:
+                sleep(backoff_seconds(attempt))
+                attempt += 1
+
+    for simulation_id in simulation_ids:
+        if simulation_id not in items and simulation_id not in unread:
+            logger.warning(f"Simulation ID '{simulation_id}' not found. Creating a new entry.")
+            item = {"simulation_id": simulation_id, "earth_date": DEFAULT_START_DATE}
+            try:
+                table.put_item(Item=item, ConditionExpression="attribute_not_exists(simulation_id)")
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                continue  # Created by an overlapping invocation, which also schedules it
+            items[simulation_id] = item
+    return {simulation_id: item["earth_date"] for simulation_id, item in items.items()
+            if _is_scheduled(item)}
+
+
+def start_simulation(table, state_machine_arn, simulation_id, earth_date, log_writer):
+    """
+    Advance one simulation past earth_date and start the pipeline for earth_date.
+    Returns {"simulation_id", "earth_date", "status"} with status STARTED, SKIPPED (no
+    NAVCAM photos), CONFLICT (advanced by another invocation) or ERROR.
+    """
+    result = {"simulation_id": simulation_id, "earth_date": earth_date}
+    try:
+        if not advance_simulation(table, simulation_id, earth_date):
+            return {**result, "status": "CONFLICT"}
+        if not date_has_photos(earth_date):
+            log_writer.record(earth_date, lambda_name=LAMBDA_NAME, lambda_status="SKIPPED",
+                              lambda_output="No NAVCAM photos.")
+            return {**result, "status": "SKIPPED"}
+
+        # The name makes a retried start find the execution instead of starting another
+        stepfunctions = get_stepfunctions_client()
+        name = execution_name(simulation_id, earth_date)
+        try:
+            with span("stepfunctions.start_execution"):
+                execution_arn = stepfunctions.start_execution(
+                    stateMachineArn=state_machine_arn, name=name,
+                    input=json.dumps({"earth_date": earth_date}))["executionArn"]
+        except stepfunctions.exceptions.ExecutionAlreadyExists:
+            execution_arn = _execution_arn(state_machine_arn, name)
+        log_writer.record(earth_date, lambda_name=LAMBDA_NAME, lambda_status="SUCCESS",
+                          lambda_output=execution_arn)
+        return {**result, "status": "STARTED", "execution_arn": execution_arn}
+    except Exception as e:
+        logger.error(f"Failed to schedule simulation '{simulation_id}': {e}")
+        log_writer.record(earth_date, lambda_name=LAMBDA_NAME, lambda_status="ERROR",
+                          lambda_output=str(e))
+        return {**result, "status": "ERROR", "error": str(e)}
+
+
+def schedule_simulations(table_name, state_machine_arn, simulation_ids=None,
+                         max_concurrency=SIMULATION_MAX_CONCURRENCY):
+    """
+    Run one scheduler step for many simulations in a single invocation.
+
+    Simulations are found with one scan (or read with BatchGetItem when simulation_ids is
+    given), each is advanced with a conditional update, and the executions are started
+    concurrently, at most max_concurrency at a time. Executions are named
+    "<simulation_id>-<earth_date>", so overlapping invocations cannot start a date twice.
+    Returns one result per simulation (see start_simulation).
+    """
+    table = get_dynamodb_table(table_name)
+    if simulation_ids is None:
+        simulations = list_simulations(table)
+    else:
+        simulations = get_simulations(table, simulation_ids)
+    logger.info(f"Scheduling {len(simulations)} simulations.")
+    if not simulations:
+        return []
+
+    log_writer = PipelineLogWriter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(simulations)))) \
+            as executor:
+        futures = [executor.submit(start_simulation, table, state_machine_arn, simulation_id,
+                                   earth_date, log_writer)
+                   for simulation_id, earth_date in sorted(simulations.items())]
+        results = [future.result() for future in futures]
+    log_writer.flush()
+    return results
+
+
+def _next_dates(cursor, end_date, count):
+    """
+    Return up to count dates with NAVCAM photos from cursor to end_date, and the cursor to
+    continue from afterwards (None once end_date has been passed).
+    """
+    dates = []
+    current = datetime.strptime(cursor, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    while current <= end and len(dates) < count:
+        current_str = current.strftime("%Y-%m-%d")
+        if date_has_photos(current_str):
+            dates.append(current_str)
+        current += timedelta(days=1)
+    return dates, (current.strftime("%Y-%m-%d") if current <= end else None)
+
+
+def run_backfill_wave(state, state_machine_arn, sleep=time.sleep):
+    """
+    Advance a backfill by one wave: collect the executions that have finished, then start
+    new ones until max_concurrency are running. Returns the updated state.
+    """
+    stepfunctions = get_stepfunctions_client()
+
+    # Check on the executions started by earlier waves
+    still_running = []
+    for execution in state["running"]:
+        with span("stepfunctions.describe_execution"):
+            status = stepfunctions.describe_execution(
+                executionArn=execution["execution_arn"])["status"]
+        if status == "RUNNING":
+            still_running.append(execution)
+        elif status == "SUCCEEDED":
+            state["succeeded"] += 1
+        else:
+            logger.warning(f"Backfill execution for {execution['date']} ended with {status}.")
+            state["failed"].append(execution["date"])
+    state["running"] = still_running
+
+    # Start the next wave, paced to stay under the StartExecution rate limit
+    free_slots = state["max_concurrency"] - len(still_running)
+    if state["next_date"] and free_slots > 0:
+        if "dates" in state:  # Rerun of listed dates
+            dates, state["dates"] = state["dates"][:free_slots], state["dates"][free_slots:]
+            state["next_date"] = state["dates"][0] if state["dates"] else None
+        else:
+            dates, state["next_date"] = _next_dates(state["next_date"], state["end_date"],
+                                                    free_slots)
+        for earth_date in dates:
+            # Execution names are unique per state machine, so a wave repeated after an
+            # interruption finds the execution it already started instead of a duplicate
+            name = execution_name(f"backfill-{state['backfill_id']}", earth_date)
+            try:
+                with span("stepfunctions.start_execution"):
+                    response = stepfunctions.start_execution(
+                        stateMachineArn=state_machine_arn, name=name,
+                        input=json.dumps({"earth_date": earth_date}))
+                execution_arn = response["executionArn"]
+            except stepfunctions.exceptions.ExecutionAlreadyExists:
+                execution_arn = _execution_arn(state_machine_arn, name)
+            state["running"].append({"date": earth_date, "execution_arn": execution_arn})
+            sleep(1 / BACKFILL_STARTS_PER_SECOND)
+        logger.info(f"Backfill '{state['backfill_id']}' started {len(dates)} executions.")
+
+    if not state["next_date"] and not state["running"]:
+        state["status"] = "COMPLETE"
+    return state
+
+
+def _save_backfill_state(table, state):
+    """
+    Save the backfill state, failing if another invocation saved it since it was read.
+    """
+    version = state.get("version", 0)
+    state["version"] = version + 1
+    state["updated_at"] = datetime.utcnow().isoformat()
+    table.put_item(
+        Item={"simulation_id": BACKFILL_PREFIX + state["backfill_id"], **state},
+        ConditionExpression="attribute_not_exists(version) OR version = :version",
+        ExpressionAttributeValues={":version": version},
+    )
+
+
+def backfill_handler(event, context, sleep=time.sleep):
+    """
+    Lambda function to process a range of dates with bounded concurrency.
+
+    Input: {"backfill_id": "rebuild", "start_date": "2012-08-06", "end_date": "2013-08-06",
+            "max_concurrency": 10}
+    With "rerun_incomplete": true, only the dates in the range whose pipeline_status in the
+    pipeline log is FAILED or IN_PROGRESS (or one of "statuses", if given) are run again,
+    found with the StatusDateIndex instead of checking every date for photos.
+    Progress is stored in the SimulatedDates table under "backfill#<backfill_id>", so an
+    interrupted backfill resumes when invoked again with just {"backfill_id": ...}; a
+    different range or rerun_incomplete for an existing backfill_id is rejected.
+    Each invocation runs waves until the backfill completes or its time is nearly up.
+    """
+    SIMULATED_DATES_TABLE = os.environ["SIMULATED_DATES_TABLE"]
+    STEP_FUNCTION_ARN = os.environ["STEP_FUNCTION_ARN"]
+    if not SIMULATED_DATES_TABLE or not STEP_FUNCTION_ARN:
+        raise ValueError("Environment variables not set.")
+
+    backfill_id = event.get("backfill_id")
+    if not backfill_id:
+        raise ValueError("Missing 'backfill_id' in the input event.")
+
+    start_trace("backfill")
+    table = get_dynamodb_table(SIMULATED_DATES_TABLE)
+    response = table.get_item(Key={"simulation_id": BACKFILL_PREFIX + backfill_id},
+                              ConsistentRead=True)
+    if "Item" in response:
+        item = response["Item"]
+        # Resuming may change max_concurrency, but not what the backfill covers
+        conflicts = [field for field in ["start_date", "end_date"]
+                     if event.get(field) and event[field] != item.get(field)]
+        if "rerun_incomplete" in event and bool(event["rerun_incomplete"]) != ("dates" in item):
+            conflicts.append("rerun_incomplete")
+        if conflicts:
+            raise ValueError(f"Backfill '{backfill_id}' already exists with different "
+                             f"{', '.join(conflicts)}; use a new backfill_id.")
+        state = {
+            "backfill_id": backfill_id,
+            "start_date": item["start_date"],
+            "end_date": item["end_date"],
+            "next_date": item.get("next_date"),
+            "max_concurrency": int(event.get("max_concurrency", item["max_concurrency"])),
+            "running": item.get("running", []),
+            "succeeded": int(item.get("succeeded", 0)),
+            "failed": item.get("failed", []),
+            "status": item.get("status", "RUNNING"),
+            "version": int(item.get("version", 0)),
+        }
+        if "dates" in item:
+            state["dates"] = item["dates"]
+        logger.info(f"Resuming backfill '{backfill_id}' at {state['next_date']}.")
+    else:
+        for field in ["start_date", "end_date"]:
+            try:
+                datetime.strptime(event.get(field) or "", "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Invalid '{field}' for new backfill '{backfill_id}'. "
+                                 "Expected YYYY-MM-DD.")
+        state = {
+            "backfill_id": backfill_id,
+            "start_date": event["start_date"],
+            "end_date": event["end_date"],
+            "next_date": event["start_date"],
+            "max_concurrency": int(event.get("max_concurrency", 5)),
+            "running": [],
+            "succeeded": 0,
+            "failed": [],
+            "status": "RUNNING",
+        }
+        if event.get("rerun_incomplete"):
+            with span("dynamodb.query_incomplete_dates"):
+                state["dates"] = list(iter_incomplete_dates(
+                    state["start_date"], state["end_date"],
+                    statuses=event.get("statuses") or INCOMPLETE_STATUSES))
+            state["next_date"] = state["dates"][0] if state["dates"] else None
+            logger.info(f"Rerunning {len(state['dates'])} incomplete dates.")
+        logger.info(f"Starting backfill '{backfill_id}' from {state['start_date']} "
+                    f"to {state['end_date']}.")
+
+    while state["status"] != "COMPLETE":
+        state = run_backfill_wave(state, STEP_FUNCTION_ARN, sleep)
+        with span("dynamodb.save_backfill"):
+            _save_backfill_state(table, state)
+        remaining_ms = (context.get_remaining_time_in_millis()
+                        if hasattr(context, "get_remaining_time_in_millis") else 0)
+        if state["status"] == "COMPLETE":
+            break
+        if remaining_ms < BACKFILL_DEADLINE_MARGIN_MS + BACKFILL_POLL_SECONDS * 1000:
+            break
+        sleep(BACKFILL_POLL_SECONDS)
+
+    logger.info(f"Backfill '{backfill_id}': {state['succeeded']} succeeded, "
+                f"{len(state['failed'])} failed, {len(state['running'])} running, "
+                f"next date {state['next_date']}.")
+    finish_trace()
+    return {
+        "statusCode": 200,
+        "body": {key: state[key] for key in ["backfill_id", "status", "next_date", "succeeded",
+                                             "failed", "running"]}
+    }
+
+
 if __name__ == "__main__":
     logger.info("Testing locally...")
     test_event = {"simulation_id": "test"}
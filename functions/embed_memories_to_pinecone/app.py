@@ -1,16 +1,15 @@
-from pinecone import Pinecone
-from openai import OpenAI
-from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from uuid import NAMESPACE_URL, uuid5
 import json
 import logging
 import os
 import sys
-import boto3
-from dotenv import load_dotenv
 from urllib.parse import urlparse
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file when running outside Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Add the parent directory to sys.path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,7 +21,14 @@ if repo_root not in sys.path or functions_dir not in sys.path:
     sys.path.append(repo_root)  # Ensure repo root is in sys.path
     sys.path.append(functions_dir)  # Ensure functions directory is in sys.path
 
-from utils.ddb_utility import update_pipeline_log
+from utils.clients import get_openai_client, get_pinecone_index, get_s3_client
+from utils.ddb_utility import update_pipeline_log, wait_for_pipeline_log
+from utils.embedding_cache import EmbeddingCache, content_hash
+from utils.embeddings import EMBEDDING_MODEL, INDEX_NAME, date_number
+from utils.local_index import LocalVectorIndex
+from utils.rate_limiter import rate_limited_call
+from utils.stage_manifest import iter_stage_records, stage_result
+from utils.tracing import finish_trace, span, start_trace
 
 # Define logger
 logger = logging.getLogger()
@@ -35,17 +41,72 @@ logger.setLevel(logging.INFO)  # Set logging level
 
 # Constants
 LAMBDA_NAME = "Lambda3: EmbedToPinecone"
+# OpenAI accepts at most 2048 inputs per embeddings request; the character budget keeps
+# a chunk comfortably below the per-request token limit (~4 characters per token).
+MAX_EMBED_BATCH_SIZE = 2048
+MAX_EMBED_BATCH_CHARS = 600000
+MAX_FETCH_BATCH_SIZE = 1000  # Pinecone fetches at most 1000 ids per request
+S3_READ_MAX_WORKERS = 16  # Concurrent reads of memories not handed over inline
 
+# Embedding cache and local index mirror kept across warm invocations
+_embedding_cache = None
+_local_index = None
 
-def get_text_from_s3(url):
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite"))
+    return _embedding_cache
+
+
+def get_local_index():
+    """
+    Return the local index mirroring upserts to Pinecone, or None unless LOCAL_INDEX_DIR is
+    set. Meant for local runs: under Lambda the directory would only last as long as the
+    container.
+    """
+    global _local_index
+    directory = os.getenv("LOCAL_INDEX_DIR")
+    if not directory:
+        return None
+    if _local_index is None or _local_index.directory != directory:
+        _local_index = LocalVectorIndex(directory)
+    return _local_index
+
+
+def memory_id_for_url(url):
+    """
+    Return the vector id of the memory stored at url, the same on every run.
+    """
+    return str(uuid5(NAMESPACE_URL, url))
+
+
+def memory_record(url, text):
+    """
+    Build the record upsert_memories expects for the memory stored at url.
+    """
+    return {
+        "id": memory_id_for_url(url),
+        # Newlines are replaced with spaces before embedding
+        "text": text.replace("\n", " "),
+        "date": url.split("/")[-2],
+        "type": url.split("/")[-1].split("_")[1].replace(".txt", ""),
+        "s3_url": url,
+    }
+
+
+def get_text_from_s3(url, s3_client=None):
     # Get text from S3
-    s3_client = boto3.client("s3")
+    s3_client = s3_client or get_s3_client()
     parsed_url = urlparse(url)
     bucket = parsed_url.netloc.split(".")[0]
     logger.info(f"Getting text from S3: {url}")
     key = parsed_url.path.lstrip("/")
-    response = s3_client.get_object(Bucket=bucket, Key=key)
-    text = response["Body"].read().decode("utf-8")
+    with span("s3.get_memory"):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        text = response["Body"].read().decode("utf-8")
 
     # Replace newline with space
     text = text.replace("\n", " ")
@@ -53,26 +114,192 @@ def get_text_from_s3(url):
     return text
 
 
-def get_embedding(text, client, model="text-embedding-3-small"):
-    return client.embeddings.create(input=[text], model=model).data[0].embedding
+def load_memories(records, max_workers=S3_READ_MAX_WORKERS):
+    """
+    Build the memory records for the generate step's output: memory URLs, or
+    {"s3_url", "text"} records whose text may be missing when it was too large to inline.
+    Missing texts are read from S3 concurrently through the shared client.
+    """
+    records = [{"s3_url": record} if isinstance(record, str) else record for record in records]
+    missing = [record["s3_url"] for record in records if record.get("text") is None]
+    texts = {}
+    if missing:
+        logger.info(f"Reading {len(missing)} of {len(records)} memories from S3...")
+        s3_client = get_s3_client()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+            texts = dict(zip(missing, executor.map(
+                lambda url: get_text_from_s3(url, s3_client), missing)))
+    return [memory_record(record["s3_url"], record["text"] if record.get("text") is not None
+                          else texts[record["s3_url"]])
+            for record in records]
 
 
-# Function to Embed Text and Upsert Data
-def upsert_memory(client, index, memory_id, text, date, memory_type, s3_url):
-    # Generate embedding for the text
-    embedding = get_embedding(text, client)
+def chunk_texts(texts, batch_size, max_chars=MAX_EMBED_BATCH_CHARS):
+    """
+    Split texts into consecutive chunks of at most batch_size items and max_chars characters.
+    A single text longer than max_chars is sent in a chunk of its own.
+    """
+    chunk, chunk_chars = [], 0
+    for text in texts:
+        if chunk and (len(chunk) >= batch_size or chunk_chars + len(text) > max_chars):
+            yield chunk
+            chunk, chunk_chars = [], 0
+        chunk.append(text)
+        chunk_chars += len(text)
+    if chunk:
+        yield chunk
+
 
-    # Prepare the upsert payload
-    metadata = {"date": date, "type": memory_type, "s3_url": s3_url, "text": text}
-    index.upsert([{"id": memory_id, "values": embedding, "metadata": metadata}])
-    logger.info(f"Memory '{memory_id}' upserted successfully!")
+def get_embeddings(texts, client, model=EMBEDDING_MODEL, batch_size=MAX_EMBED_BATCH_SIZE):
+    """
+    Embed a list of texts with one embeddings request per chunk.
+    Returns the embeddings in the same order as texts.
+    """
+    batch_size = max(1, min(batch_size, MAX_EMBED_BATCH_SIZE))
+    embeddings = []
+    for chunk in chunk_texts(texts, batch_size):
+        with span("openai.embeddings"):
+            response = rate_limited_call("openai", client.embeddings.create, input=chunk,
+                                         model=model)
+        # The API tags each embedding with the position of its input
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return embeddings
+
+
+def fetch_stored_metadata(index, ids):
+    """
+    Return a dict of vector id to the metadata stored with it, for ids in the index.
+    """
+    stored = {}
+    for start in range(0, len(ids), MAX_FETCH_BATCH_SIZE):
+        with span("pinecone.fetch"):
+            response = rate_limited_call("pinecone", index.fetch,
+                                         ids=ids[start:start + MAX_FETCH_BATCH_SIZE])
+        for vector_id, vector in response.vectors.items():
+            stored[vector_id] = vector.metadata or {}
+    return stored
+
+
+def migrate_legacy_vectors(index=None):
+    """
+    Move vectors stored under the random ids used before ids were derived from the URL to
+    their URL ids, adding "date_num", and delete the random ids. Where the URL id already
+    exists (the date was embedded again since) the old vector is only deleted. Run once
+    after upgrading; until then the old vectors are duplicates that date filters skip.
+    Returns the number of vectors migrated.
+    """
+    index = index or get_pinecone_index(INDEX_NAME)
+    migrated = 0
+    for ids in index.list():
+        with span("pinecone.fetch"):
+            response = rate_limited_call("pinecone", index.fetch, ids=list(ids))
+        legacy = {vector_id: vector for vector_id, vector in response.vectors.items()
+                  if (vector.metadata or {}).get("s3_url")
+                  and vector_id != memory_id_for_url(vector.metadata["s3_url"])}
+        if not legacy:
+            continue
+        current = fetch_stored_metadata(index, list({memory_id_for_url(v.metadata["s3_url"])
+                                                     for v in legacy.values()}))
+        vectors = []
+        for vector in legacy.values():
+            metadata = dict(vector.metadata)
+            new_id = memory_id_for_url(metadata["s3_url"])
+            if new_id in current:
+                continue
+            date = metadata.setdefault("date", metadata["s3_url"].split("/")[-2])
+            metadata.setdefault("date_num", date_number(date))
+            vectors.append({"id": new_id, "values": list(vector.values), "metadata": metadata})
+            current[new_id] = metadata  # Several old copies of a memory move only once
+        if vectors:
+            with span("pinecone.upsert"):
+                rate_limited_call("pinecone", index.upsert, vectors=vectors)
+        with span("pinecone.delete"):
+            rate_limited_call("pinecone", index.delete, ids=list(legacy))
+        migrated += len(legacy)
+        logger.info(f"Migrated {len(legacy)} vectors to URL ids ({len(vectors)} moved).")
+    return migrated
+
+
+def upsert_memories(client, index, memories, embed_batch_size=MAX_EMBED_BATCH_SIZE,
+                    upsert_batch_size=100, cache=None, mirror=None):
+    """
+    Embed and upsert many memories with batched requests to OpenAI and Pinecone.
+    Each memory is a dict with id, text, date, type and s3_url keys.
+
+    Memories whose vector is already stored with the same content hash are skipped (their
+    metadata only gains "date_num" if it was stored without), and embeddings found in cache
+    are not requested again. Upserted vectors are also written to mirror, a
+    LocalVectorIndex, if given.
+    Returns the set of ids that were upserted.
+    """
+    if not memories:
+        return set()
+
+    hashes = [content_hash(memory["text"], EMBEDDING_MODEL) for memory in memories]
+    stored = fetch_stored_metadata(index, list({memory["id"] for memory in memories}))
+    pending = [(memory, key) for memory, key in zip(memories, hashes)
+               if stored.get(memory["id"], {}).get("content_hash") != key]
+    logger.info(f"{len(memories) - len(pending)} of {len(memories)} memories are unchanged.")
+    # Vectors stored before date filters existed get their date_num without re-embedding
+    pending_ids = {memory["id"] for memory, _ in pending}
+    for memory in memories:
+        metadata = stored.get(memory["id"])
+        if memory["id"] not in pending_ids and metadata and "date_num" not in metadata:
+            with span("pinecone.update"):
+                rate_limited_call("pinecone", index.update, id=memory["id"],
+                                  set_metadata={"date_num": date_number(memory["date"])})
+            metadata["date_num"] = date_number(memory["date"])
+    if not pending:
+        return set()
+
+    embeddings = cache.get_many(key for _, key in pending) if cache else {}
+    missing = list({key: memory["text"] for memory, key in pending
+                    if key not in embeddings}.items())
+    if missing:
+        new_embeddings = get_embeddings([text for _, text in missing], client,
+                                        batch_size=embed_batch_size)
+        new_embeddings = {key: embedding for (key, _), embedding in zip(missing, new_embeddings)}
+        if cache:
+            cache.put_many(new_embeddings)
+        embeddings.update(new_embeddings)
+    logger.info(f"Embedded {len(missing)} texts, {len(pending) - len(missing)} from cache.")
+
+    vectors = [
+        {
+            "id": memory["id"],
+            "values": embeddings[key],
+            "metadata": {"date": memory["date"], "date_num": date_number(memory["date"]),
+                         "type": memory["type"], "s3_url": memory["s3_url"],
+                         "text": memory["text"], "content_hash": key},
+        }
+        for memory, key in pending
+    ]
+    for start in range(0, len(vectors), upsert_batch_size):
+        batch = vectors[start:start + upsert_batch_size]
+        with span("pinecone.upsert"):
+            rate_limited_call("pinecone", index.upsert, vectors=batch)
+        if mirror is not None:
+            with span("local_index.upsert"):
+                mirror.upsert(batch)
+        logger.info(f"Upserted {len(batch)} memories ({start + len(batch)}/{len(vectors)}).")
+
+    return {memory["id"] for memory, _ in pending}
 
 
 def lambda_handler(event, context):
     """
     Lambda function to generate embeddings for memories and upsert them to Pinecone index.
-    Input: {'urls': ['https://curiosity-data-1205.s3.amazonaws.com/"
-                      memories/2012-08-07/image2674_memory.txt']}
+    Input: {"earth_date": "2012-08-07", "process_result": <generate step result>}, whose
+    records are {"s3_url": "https://curiosity-data-1205.s3.amazonaws.com/"
+                           "memories/2012-08-07/image2674_memory.txt", "text": "..."}
+    or plain URLs. Texts not handed over inline are read from S3 concurrently.
+
+    URLs may span several dates (e.g. a backfill window); each memory keeps the date from
+    its own URL. Embeddings are requested EMBED_BATCH_SIZE texts at a time and vectors are
+    upserted UPSERT_BATCH_SIZE at a time.
+
+    Vector ids are derived from the URL, so reruns overwrite rather than duplicate vectors,
+    and memories whose text has not changed since the last run are not embedded again.
     """
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
@@ -83,40 +310,38 @@ def lambda_handler(event, context):
 
     earth_date = event["earth_date"]
     process_result = event["process_result"]
-    body = process_result.get("body", "[]")
-    urls = json.loads(body)
     results = []
+    embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", MAX_EMBED_BATCH_SIZE))
+    upsert_batch_size = int(os.getenv("UPSERT_BATCH_SIZE", 100))
 
+    start_trace("embed")
     try:
-        # Initialize Pinecone and OpenAI clients
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
-        # Index Configuration
-        INDEX_NAME = "rover-memories"
-        index = pc.Index(INDEX_NAME)
-
-        # Iterate through urls, get text from S3, embed the text and upsert to Pinecone
-        for url in urls:
-            text = get_text_from_s3(url)
-            memory_id = str(uuid4())
-            date = url.split("/")[-2]
-            memory_type = url.split("/")[-1].split("_")[1].replace(".txt", "")
-
-            # Embed the text and upsert to Pinecone
-            upsert_memory(client, index, memory_id, text, date, memory_type, url)
-            results.append(
-                {"id": memory_id, "date": date, "type": memory_type, "s3_url": url}
-            )
+        # Pinecone and OpenAI clients are reused across warm invocations
+        client = get_openai_client()
+        index = get_pinecone_index(INDEX_NAME)
+
+        # Get the text for every memory, then embed and upsert them in batches
+        memories = load_memories(iter_stage_records(process_result))
+        upserted = upsert_memories(client, index, memories, embed_batch_size=embed_batch_size,
+                                   upsert_batch_size=upsert_batch_size,
+                                   cache=get_embedding_cache(), mirror=get_local_index())
+        results = [
+            {"id": m["id"], "date": m["date"], "type": m["type"], "s3_url": m["s3_url"],
+             "upserted": m["id"] in upserted}
+            for m in memories
+        ]
 
+        # Return the image metadata for the next step
+        result = stage_result(results, earth_date, "embed")
         update_pipeline_log(
             earth_date,
             lambda_name=LAMBDA_NAME,
             lambda_status="Success",
             lambda_output=results,
+            timings=finish_trace(earth_date),
         )
-        # Return the image metadata for the next step
-        return {"statusCode": 200, "body": json.dumps(results)}
+        wait_for_pipeline_log()
+        return result
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
@@ -125,7 +350,9 @@ def lambda_handler(event, context):
             lambda_name=LAMBDA_NAME,
             lambda_status="Failed",
             lambda_output=str(e),
+            timings=finish_trace(earth_date),
         )
+        wait_for_pipeline_log()
         raise e
 
 
@@ -1,15 +1,15 @@
-import requests
 import json
 import os
 import math
 from datetime import datetime
-from dotenv import load_dotenv
 import logging
 import random
 import sys
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file when running outside Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Add the parent directory to sys.path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,7 +19,15 @@ if repo_root not in sys.path or functions_dir not in sys.path:
     sys.path.append(repo_root)  # Ensure repo root is in sys.path
     sys.path.append(functions_dir)  # Ensure functions directory is in sys.path
 
-from utils.ddb_utility import update_pipeline_log
+from utils.clients import get_json, get_s3_client
+from utils.ddb_utility import update_pipeline_log, wait_for_pipeline_log
+from utils.dedup import sequence_key
+from utils.mission_manifest import get_mission_manifest
+from utils.rate_limiter import rate_limited_call
+from utils.response_cache import ResponseCache
+from utils.ttl_cache import TTLCache
+from utils.stage_manifest import stage_result
+from utils.tracing import finish_trace, span, start_trace
 
 # Define logger
 logger = logging.getLogger()
@@ -34,6 +42,35 @@ logger.setLevel(logging.INFO)  # Set logging level
 LAMBDA_NAME = "Lambda1: FetchImages"
 LANDING_DATE = datetime(2012, 8, 6)  # Curiosity landing date
 SOL_LENGTH_IN_DAYS = 1.027491252  # Length of a sol in Earth days
+NASA_PHOTOS_URL = "https://api.nasa.gov/mars-photos/api/v1/rovers/curiosity/photos"
+NASA_PAGE_SIZE = 25  # Photos per page returned by the API
+PHOTO_FIELDS = ["id", "earth_date", "sol", "img_src"]  # Fields passed on to the next step
+
+# Cache of NASA photo lists, kept across warm invocations
+_photo_cache = None
+# A short page is the last of its sol, and NASA may still be adding photos to it, so it is
+# only kept for a while and only in memory
+NASA_SHORT_PAGE_TTL_SECONDS = int(os.getenv("NASA_SHORT_PAGE_TTL_SECONDS", 3600))
+_short_page_cache = TTLCache(max_entries=256, ttl_seconds=NASA_SHORT_PAGE_TTL_SECONDS)
+
+
+def get_photo_cache():
+    """
+    Return the NASA response cache: in memory, under NASA_CACHE_DIR on disk and, when
+    NASA_CACHE_BUCKET is set, in S3 so that every container shares it.
+    """
+    global _photo_cache
+    if _photo_cache is None:
+        bucket = os.getenv("NASA_CACHE_BUCKET")
+        _photo_cache = ResponseCache(
+            "nasa-photos",
+            memory_max_bytes=int(os.getenv("NASA_CACHE_MEMORY_BYTES", 16 * 1024 * 1024)),
+            disk_dir=os.getenv("NASA_CACHE_DIR", "/tmp/nasa_cache"),
+            disk_max_bytes=int(os.getenv("NASA_CACHE_DISK_BYTES", 256 * 1024 * 1024)),
+            s3_client=get_s3_client() if bucket else None,
+            s3_bucket=bucket,
+        )
+    return _photo_cache
 
 
 def earth_date_to_sol(earth_date):
@@ -47,30 +84,150 @@ def earth_date_to_sol(earth_date):
     return sol
 
 
-def fetch_images_by_sol(sol, NASA_API_KEY):
+def resolve_sol(earth_date, NASA_API_KEY, camera="NAVCAM"):
     """
-    Fetch images from NASA's Mars Rover API for a specific sol.
-    Returns NAVCAM photos only.
+    Map an Earth date to its sol using the mission manifest.
+    Returns (sol, has_photos); has_photos is False when the manifest shows that camera took
+    no photos that day. Dates past the manifest, or a manifest that cannot be loaded, fall
+    back to the estimate from the landing date.
     """
-    base_url = "https://api.nasa.gov/mars-photos/api/v1/rovers/curiosity/photos"
+    try:
+        manifest = get_mission_manifest(NASA_API_KEY)
+    except Exception as e:
+        logger.warning(f"Mission manifest unavailable, estimating the sol instead: {e}")
+        manifest = None
+    if manifest is not None and manifest.covers(earth_date):
+        sol = manifest.sol_for_earth_date(earth_date)
+        logger.info(f"The day is {earth_date} and the sol is {sol} (mission manifest).")
+        return sol, manifest.has_camera_on(earth_date, camera)
+    return earth_date_to_sol(earth_date), True
+
+
+def fetch_photo_page(sol, NASA_API_KEY, camera="NAVCAM", page=1):
+    """
+    Fetch one page of a sol's photos, filtered by camera on the API side.
+    Full pages do not change once published, so they are cached for good; the short last
+    page of a sol is cached for NASA_SHORT_PAGE_TTL_SECONDS only.
+    """
+    cache = get_photo_cache()
+    cache_key = f"curiosity/sol-{sol}/{camera.lower()}/page-{page}"
+    photos = cache.get(cache_key)
+    if photos is None:
+        photos = _short_page_cache.get(cache_key)
+    if photos is not None:
+        logger.info(f"Using cached page {page} of {camera} photos for Sol {sol}.")
+        return photos
+
     params = {
         "sol": sol,
+        "camera": camera.lower(),
+        "page": page,
         "api_key": NASA_API_KEY
     }
-    response = requests.get(base_url, params=params)
-    response.raise_for_status()
-    data = response.json()
-    photos = data.get("photos", [])
-    
-    # Filter for NAVCAM photos
-    navcam_photos = [photo for photo in photos if photo["camera"]["name"] == "NAVCAM"]
-    return navcam_photos
+    with span("nasa.photos"):
+        data = rate_limited_call("nasa", get_json, NASA_PHOTOS_URL, params=params,
+                                 retries=False)
+    photos = [{k: v for k, v in photo.items() if k in PHOTO_FIELDS}
+              for photo in data.get("photos", [])]
+    if len(photos) >= NASA_PAGE_SIZE:
+        cache.put(cache_key, photos)
+    elif photos:
+        # Empty pages are not cached at all: their photos may not have been published yet
+        _short_page_cache.put(cache_key, photos)
+    return photos
+
+
+def iter_photos_by_sol(sol, NASA_API_KEY, camera="NAVCAM", max_pages=None):
+    """
+    Yield a sol's photos for one camera, walking the API's pages until a short page
+    signals the end (or max_pages pages have been read).
+    """
+    page = 1
+    while max_pages is None or page <= max_pages:
+        photos = fetch_photo_page(sol, NASA_API_KEY, camera, page)
+        yield from photos
+        if len(photos) < NASA_PAGE_SIZE:
+            return
+        page += 1
+
+
+def fetch_images_by_sol(sol, NASA_API_KEY):
+    """
+    Fetch images from NASA's Mars Rover API for a specific sol.
+    Returns NAVCAM photos only.
+    """
+    return list(iter_photos_by_sol(sol, NASA_API_KEY))
+
+
+def unique_sequences(photos):
+    """
+    Yield the first photo of each stereo sequence, so left and right frames of the same
+    scene are not both sampled.
+    """
+    seen = set()
+    for photo in photos:
+        key = sequence_key(photo["img_src"])
+        if key not in seen:
+            seen.add(key)
+            yield photo
+
+
+def reservoir_sample(items, k, rng=random):
+    """
+    Draw a uniform random sample of k items from an iterable of unknown length in one pass.
+    Returns (sample, number of items seen); the sample is in random order.
+    """
+    sample = []
+    seen = 0
+    for seen, item in enumerate(items, start=1):
+        if len(sample) < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(seen)
+            if j < k:
+                sample[j] = item
+    rng.shuffle(sample)
+    return sample, seen
+
+
+def sample_photos(earth_date, NASA_API_KEY):
+    """
+    Sample NUM_IMAGES NAVCAM photos of distinct scenes for earth_date, plus up to
+    NUM_ALTERNATES more marked "alternate". Returns (sol, photos).
+    """
+    num_images = int(os.getenv("NUM_IMAGES", 5))
+    # Extra photos the generate step can use in place of near-duplicates
+    num_alternates = int(os.getenv("NUM_ALTERNATES", num_images))
+    sol, has_photos = resolve_sol(earth_date, NASA_API_KEY)
+
+    # Optional cap on pages read per sol; the sample is then drawn from those pages only
+    max_pages = int(os.getenv("NASA_MAX_PAGES", 0)) or None
+    if has_photos:
+        logger.info(f"Fetching images for Sol {sol}...")
+        navcam_photos, total = reservoir_sample(
+            unique_sequences(iter_photos_by_sol(sol, NASA_API_KEY, max_pages=max_pages)),
+            num_images + num_alternates)
+        for photo in navcam_photos[num_images:]:
+            photo["alternate"] = True
+    else:
+        logger.info(f"Mission manifest lists no NAVCAM photos for {earth_date}, skipping.")
+        navcam_photos = []
+    if navcam_photos:
+        logger.info(f"Randomly sampled {len(navcam_photos)} of {total} NAVCAM scenes "
+                    f"({max(0, len(navcam_photos) - num_images)} as alternates).")
+    else:
+        logger.info("No NAVCAM photos found.")
+    return sol, navcam_photos
 
 
 def lambda_handler(event, context):
     """
     Lambda function to fetch 1-5 random images from Curiosity on the specified date.
     Input: earth_date (str) - The Earth date for which to fetch images (YYYY-MM-DD)
+
+    Each image is from a different stereo sequence. Up to NUM_ALTERNATES extra images,
+    marked "alternate", let the generate step replace images that turn out to be
+    near-duplicates.
     """
     earth_date = event.get("earth_date")
     if not earth_date:
@@ -84,31 +241,20 @@ def lambda_handler(event, context):
     if not nasa_api_key:
         raise ValueError("NASA_API_KEY is not set in the environment variables.")
 
+    start_trace("fetch")
     try:
-        num_images = int(os.getenv("NUM_IMAGES", 5))
-        sol = earth_date_to_sol(earth_date)
-        
-        logger.info(f"Fetching images for Sol {sol}...")
-        navcam_photos = fetch_images_by_sol(sol, nasa_api_key) or []
-        if navcam_photos:
-            logger.info(f"Found {len(navcam_photos)} NAVCAM photos.")
-            logger.info(f"Randomly sampling {num_images} photos...")
-            random.shuffle(navcam_photos)
-            sampled_photos = navcam_photos[:num_images]
-            navcam_photos = [{k: v for k, v in photo.items() if k in
-                            ["id", "earth_date", "sol", "img_src"]} for photo in sampled_photos]
-        else:
-            logger.info("No NAVCAM photos found.")
+        sol, navcam_photos = sample_photos(earth_date, nasa_api_key)
+        result = stage_result(navcam_photos, earth_date, "fetch")
         update_pipeline_log(earth_date, sol=sol, lambda_name=LAMBDA_NAME,
-                            lambda_status="Success", lambda_output=navcam_photos)
-        return {
-                "statusCode": 200,
-                "body": json.dumps(navcam_photos)
-            }
+                            lambda_status="Success", lambda_output=navcam_photos,
+                            timings=finish_trace(earth_date))
+        wait_for_pipeline_log()
+        return result
     except Exception as e:
         logger.error(f"An internal error occurred: {e}")
         update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME, lambda_status="Error",
-                            lambda_output=str(e))
+                            lambda_output=str(e), timings=finish_trace(earth_date))
+        wait_for_pipeline_log()
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
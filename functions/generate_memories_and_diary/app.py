@@ -1,14 +1,16 @@
+import base64
+import hashlib
+import io
 import json
 import os
 import sys
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 import logging
-import requests
-import boto3
-from openai import OpenAI
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file when running outside Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Add the parent directory to sys.path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,7 +20,15 @@ if repo_root not in sys.path or functions_dir not in sys.path:
     sys.path.append(repo_root)  # Ensure repo root is in sys.path
     sys.path.append(functions_dir)  # Ensure functions directory is in sys.path
 
-from utils.ddb_utility import update_pipeline_log
+from utils.clients import (get_http_session, get_openai_client, get_rekognition_client,
+                           get_s3_client)
+from utils.ddb_utility import update_pipeline_log, wait_for_pipeline_log
+from utils.deadline import WorkBudget, get_cost_model
+from utils.dedup import dhash, hamming_distance, sequence_key
+from utils.rate_limiter import rate_limited_call
+from utils.response_cache import ResponseCache
+from utils.stage_manifest import iter_stage_records, stage_result
+from utils.tracing import finish_trace, span, start_trace
 
 # Define logger
 logger = logging.getLogger()
@@ -31,30 +41,590 @@ logger.setLevel(logging.INFO)  # Set logging level
 
 # Constants
 LAMBDA_NAME = "Lambda2: GenerateMemories"
+BUCKET = "curiosity-data-1205"
+REKOGNITION_MAX_IMAGE_BYTES = 5 * 1024 * 1024  # Limit for images passed as raw bytes
+REKOGNITION_MAX_S3_IMAGE_BYTES = 15 * 1024 * 1024  # Limit for images read from S3
+# Have Rekognition read each image from S3, uploaded once per content hash, instead of
+# sending the bytes with every call
+REKOGNITION_S3_IMAGES = os.getenv("REKOGNITION_S3_IMAGES", "false").lower() == "true"
+REKOGNITION_IMAGE_PREFIX = "rekognition-images"
+# Labels above this confidence are passed to the memory prompt
+LABEL_MIN_CONFIDENCE = float(os.getenv("LABEL_MIN_CONFIDENCE", 95))
+# Rekognition returns, and the label cache keeps, every label from this confidence up, so
+# LABEL_MIN_CONFIDENCE can be changed later without analysing the images again
+DETECT_MIN_CONFIDENCE = 50
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+MEMORY_MODEL = "gpt-4"
+# Photos whose 64-bit difference hashes differ in at most this many bits are near-duplicates
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", 10))
+# Memories up to this size are also handed to the embed step inline, saving an S3 read
+INLINE_TEXT_MAX_BYTES = int(os.getenv("INLINE_TEXT_MAX_BYTES", 8192))
+# Skip photos whose memory an earlier attempt already uploaded (see find_checkpoint)
+CHECKPOINT_MEMORIES = os.getenv("CHECKPOINT_MEMORIES", "true").lower() == "true"
+# Guess of one photo's processing time until this Lambda instance has timed some
+PHOTO_COST_MS = int(os.getenv("PHOTO_COST_MS", 20000))
+# Marks a photo not started because the invocation was running out of time
+DEFERRED = object()
 
+_label_cache = None
 
-def analyze_image(input_img):
 
-    rek_client = boto3.client("rekognition")
+def get_label_cache():
+    """
+    Return the Rekognition label cache: in memory, under LABEL_CACHE_DIR on disk and, when
+    LABEL_CACHE_BUCKET is set, in S3 so that every container and simulation shares it.
+    """
+    global _label_cache
+    if _label_cache is None:
+        bucket = os.getenv("LABEL_CACHE_BUCKET")
+        _label_cache = ResponseCache(
+            "rekognition-labels",
+            memory_max_bytes=int(os.getenv("LABEL_CACHE_MEMORY_BYTES", 4 * 1024 * 1024)),
+            disk_dir=os.getenv("LABEL_CACHE_DIR", "/tmp/label_cache"),
+            disk_max_bytes=int(os.getenv("LABEL_CACHE_DISK_BYTES", 64 * 1024 * 1024)),
+            s3_client=get_s3_client() if bucket else None,
+            s3_bucket=bucket,
+        )
+    return _label_cache
+
+
+def download_image(img_src):
+    """
+    Stream an image into a single in-memory buffer.
+    """
+    with span("image.download"), \
+            get_http_session().get(img_src, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            buffer += chunk
+    logger.info(f"Downloaded {len(buffer)} bytes from {img_src}")
+    return buffer
+
+
+def fit_image_for_rekognition(image_bytes, max_bytes=REKOGNITION_MAX_IMAGE_BYTES):
+    """
+    Return the image unchanged if it is within Rekognition's byte limit, otherwise a
+    downscaled JPEG re-encoding of it that fits.
+    """
+    if len(image_bytes) <= max_bytes:
+        return image_bytes
+
+    # Pillow is only needed for the rare oversized image
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    scale = (max_bytes / len(image_bytes)) ** 0.5
+    while True:
+        width, height = max(1, int(image.width * scale)), max(1, int(image.height * scale))
+        output = io.BytesIO()
+        image.resize((width, height)).save(output, format="JPEG", quality=85)
+        if output.tell() <= max_bytes or width == 1 or height == 1:
+            break
+        scale *= 0.8
+    logger.info(f"Downscaled image from {len(image_bytes)} to {output.tell()} bytes.")
+    return output.getvalue()
+
+
+def stage_image_in_s3(image_bytes, digest, s3_client=None):
+    """
+    Store an image under its content hash for Rekognition to read, unless it is already
+    there, and return its S3Object reference.
+    """
+    s3_client = s3_client or get_s3_client()
+    key = f"{REKOGNITION_IMAGE_PREFIX}/{digest}.jpg"
+    try:
+        with span("s3.head_image"):
+            s3_client.head_object(Bucket=BUCKET, Key=key)
+    except Exception as e:
+        if getattr(e, "response", {}).get("Error", {}).get("Code") not in ("404", "NotFound"):
+            raise
+        image_bytes = fit_image_for_rekognition(image_bytes, REKOGNITION_MAX_S3_IMAGE_BYTES)
+        with span("s3.put_image"):
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=bytes(image_bytes),
+                                 ContentType="image/jpeg")
+    return {"Bucket": BUCKET, "Name": key}
+
+
+def detect_labels(image_bytes, digest, rek_client, s3_client=None):
+    """
+    Return [name, confidence] for every label Rekognition finds in the image with at least
+    DETECT_MIN_CONFIDENCE, confidences rounded to two decimals.
+    """
+    if REKOGNITION_S3_IMAGES:
+        image = {"S3Object": stage_image_in_s3(image_bytes, digest, s3_client)}
+    else:
+        image = {"Bytes": fit_image_for_rekognition(image_bytes)}
+    with span("rekognition.detect_labels"):
+        response = rate_limited_call("rekognition", rek_client.detect_labels, Image=image,
+                                     MinConfidence=DETECT_MIN_CONFIDENCE)
+    return [[label["Name"], round(label["Confidence"], 2)] for label in response["Labels"]]
+
+
+def label_names(labels, min_confidence=LABEL_MIN_CONFIDENCE):
+    """
+    Join the names of the labels above min_confidence with commas.
+    """
+    return ",".join(name for name, confidence in labels if confidence > min_confidence)
+
+
+def analyze_image(image_bytes, rek_client=None, photo_id=None, min_confidence=None):
+    """
+    Return the comma-separated labels of an image above min_confidence (default
+    LABEL_MIN_CONFIDENCE). Labels are cached by photo id and content hash with their
+    confidences, so reruns and other simulations of the same photo do not call Rekognition.
+    """
+    rek_client = rek_client or get_rekognition_client()
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    cache = get_label_cache()
+    cache_key = f"{photo_id if photo_id is not None else 'image'}/{digest}"
+    labels = cache.get(cache_key)
+    if labels is None:
+        labels = detect_labels(image_bytes, digest, rek_client)
+        cache.put(cache_key, labels)
+    else:
+        logger.info(f"Using cached labels for photo {photo_id}.")
+    return label_names(labels, LABEL_MIN_CONFIDENCE if min_confidence is None
+                       else min_confidence)
 
-    with open(input_img, "rb") as image:
-        response = rek_client.detect_labels(Image={"Bytes": image.read()})
 
-    labels = response["Labels"]
-    label_names = ""
-    for label in labels:
-        name = label["Name"]
-        confidence = label["Confidence"]
-        if confidence > 95:
-            label_names = label_names + name + ","
-    label_names = label_names[:-1]  # Remove the last comma
+MEMORY_INSTRUCTIONS = """You are Curiosity, NASA's Mars rover, exploring the Red Planet.
+                Your mission is to observe, analyze, and document the Martian landscape
+                in detail. Every day, you observe the world around you through photos
+                and store a memory entry in the following format:
 
-    return label_names
+                Memory Entry:
+                - Data:
+                - Date: [Earth date]
+                - Sol: [Martian sol]
+                - URL: [URL of the image]
+                - Features: [List of features identified in the image]
+                - Interpretation:
+                - Description: [Detailed description of the scene based on the image,
+                                including colors, shapes, textures, and key geological
+                                features.]
+                - Speculation: [Educated guesses about the location, possible
+                                geological processes, or historical context of
+                                the features in the image.]
+                - Reflection: [Reflect on how this image contributes to your journey as
+                                Curiosity. What does it make you think about as an
+                                explorer? How do you imagine humans will react when they
+                                see these findings?]
+"""
+
+BATCH_INSTRUCTIONS = """
+                You will be given several of today's images as a JSON list. Write one memory
+                entry per image and reply with only a JSON object of the form
+                {"memories": [{"id": <image id>, "memory": "<memory entry>"}]}, with exactly
+                one item for each image id."""
+
+
+def build_memory_messages(photo, labels):
+    """
+    Build the chat messages prompting a memory entry for a single photo.
+    """
+    return [
+        {
+            "role": "system",
+            "content": MEMORY_INSTRUCTIONS + f"""
+                Here is today's image and context:
+                - Date: {photo['earth_date']}
+                - Sol: {photo['sol']}
+                - URL: {photo['img_src']}
+                - Features:{labels}
+
+                Write the memory entry.""",
+        }
+    ]
+
+
+def build_batch_memory_messages(photos):
+    """
+    Build the chat messages prompting memory entries for several photos in one completion,
+    so the instructions are sent once rather than once per photo.
+    """
+    images = [
+        {"id": photo["id"], "date": photo["earth_date"], "sol": photo["sol"],
+         "url": photo["img_src"], "features": photo.get("labels", "")}
+        for photo in photos
+    ]
+    return [
+        {"role": "system", "content": MEMORY_INSTRUCTIONS + BATCH_INSTRUCTIONS},
+        {"role": "user", "content": json.dumps(images)},
+    ]
+
+
+def parse_batch_memories(content, photos):
+    """
+    Parse a batched completion into one memory per photo, in the order of photos.
+    Raises ValueError unless there is exactly one non-empty memory for every photo.
+    """
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No JSON object in the batched completion.")
+    memories = json.loads(content[start:end + 1]).get("memories")
+    if not isinstance(memories, list):
+        raise ValueError("Batched completion has no list of memories.")
+
+    by_id = {}
+    for item in memories:
+        if not isinstance(item, dict) or not isinstance(item.get("memory"), str):
+            raise ValueError("Malformed memory in the batched completion.")
+        by_id[str(item.get("id"))] = item["memory"].strip()
+    expected = [str(photo["id"]) for photo in photos]
+    if sorted(by_id) != sorted(expected) or not all(by_id.values()):
+        raise ValueError("Batched completion does not have one memory per image.")
+    return [by_id[photo_id] for photo_id in expected]
+
+
+def select_distinct_photos(executor, photos, max_distance=DEDUP_MAX_DISTANCE):
+    """
+    Download photos and drop near-duplicates before they are analyzed.
+
+    Photos marked "alternate" by the fetch step are only used to replace dropped ones, so
+    the number of photos selected is at most the number of other photos. A photo is dropped
+    if it shares a stereo sequence with a selected photo, or if its perceptual hash is
+    within max_distance bits of one. Returns (photos, downloads), where each download is
+    the completed future holding the photo's image bytes or download error.
+    """
+    candidates = [photo for photo in photos if not photo.get("alternate")]
+    alternates = [photo for photo in photos if photo.get("alternate")]
+    target = len(candidates)
+    selected, downloads, sequences, hashes = [], [], set(), []
+
+    while candidates:
+        # Stereo partners are skipped without downloading them
+        round_keys, unique = set(sequences), []
+        for photo in candidates:
+            key = sequence_key(photo["img_src"])
+            if key in round_keys:
+                logger.info(f"Skipping photo {photo.get('id')}: other frame of a stereo pair.")
+            else:
+                round_keys.add(key)
+                unique.append((photo, key))
+        futures = [executor.submit(download_image, photo["img_src"]) for photo, _ in unique]
+        for (photo, key), future in zip(unique, futures):
+            photo_hash = dhash(future.result()) if not future.exception() else None
+            if photo_hash is not None and any(hamming_distance(photo_hash, h) <= max_distance
+                                              for h in hashes):
+                logger.info(f"Skipping photo {photo.get('id')}: near-duplicate image.")
+                continue
+            sequences.add(key)
+            if photo_hash is not None:
+                hashes.append(photo_hash)
+            selected.append(photo)
+            downloads.append(future)
+        # Refill from the alternates, one round per batch of duplicates
+        needed = target - len(selected)
+        candidates, alternates = alternates[:needed], alternates[needed:]
+
+    if len(selected) < len(photos):
+        logger.info(f"Selected {len(selected)} distinct photos of {len(photos)} candidates.")
+    return selected, downloads
+
+
+def prepare_photo(photo, rek_client, download=None):
+    """
+    Download and analyze a photo, storing its labels on the photo.
+    download is an optional future already holding the image bytes.
+    """
+    logger.info(photo)
+
+    # Download the image into memory
+    image_bytes = download.result() if download else download_image(photo["img_src"])
+
+    # Analyze the image
+    labels = analyze_image(image_bytes, rek_client, photo.get("id"))
+    photo["labels"] = labels
+    logger.info(f"Labels: {labels}")
+    return photo
+
+
+def generate_memory(openai_client, photo):
+    """
+    Prompt a memory for a single analyzed photo.
+    """
+    messages = build_memory_messages(photo, photo["labels"])
+    with span("openai.chat"):
+        response = rate_limited_call("openai", openai_client.chat.completions.create,
+                                     model=MEMORY_MODEL, messages=messages)
+    generated_text = response.choices[0].message.content.strip()
+    logger.info("Successfully generated memory.")
+    return generated_text
+
+
+def generate_memories(openai_client, photos):
+    """
+    Prompt memories for several analyzed photos in one completion, falling back to one
+    completion per photo if the batched reply cannot be used.
+    Returns one memory text or exception per photo.
+    """
+    if len(photos) > 1:
+        try:
+            messages = build_batch_memory_messages(photos)
+            with span("openai.chat_batch"):
+                response = rate_limited_call("openai", openai_client.chat.completions.create,
+                                             model=MEMORY_MODEL, messages=messages)
+            memories = parse_batch_memories(response.choices[0].message.content, photos)
+            logger.info(f"Successfully generated {len(memories)} memories in one completion.")
+            return memories
+        except Exception as e:
+            logger.warning(f"Batched generation failed, generating one by one: {e}")
+
+    texts = []
+    for photo in photos:
+        try:
+            texts.append(generate_memory(openai_client, photo))
+        except Exception as e:
+            texts.append(e)
+    return texts
+
+
+def memory_key(photo):
+    return f"memories/{photo['earth_date']}/image{photo['id']}_memory.txt"
+
+
+def memory_url(photo):
+    return f"https://{BUCKET}.s3.amazonaws.com/{memory_key(photo)}"
+
+
+def _sha256_base64(body):
+    # The encoding S3 uses for ChecksumSHA256
+    return base64.b64encode(hashlib.sha256(body).digest()).decode("ascii")
+
+
+def upload_memory(s3_client, photo, generated_text):
+    """
+    Upload a memory to S3 and return its URL.
+
+    The memory's SHA-256 is stored in its metadata and S3 verifies it on upload, so the
+    object doubles as the photo's checkpoint (see find_checkpoint).
+    """
+    logger.info("Uploading memory to S3...")
+    body = generated_text.encode("utf-8")
+    checksum = _sha256_base64(body)
+    with span("s3.put_memory"):
+        s3_client.put_object(
+            Bucket=BUCKET, Key=memory_key(photo), Body=body, ChecksumSHA256=checksum,
+            Metadata={"photo-id": str(photo["id"]), "sha256": checksum},
+        )
+    url = memory_url(photo)
+    logger.info(f"Memory uploaded to S3: {url}")
+    return url
+
+
+def find_checkpoint(s3_client, photo):
+    """
+    Return the URL of photo's memory if an earlier attempt already uploaded it, else None.
+
+    The memory counts as done only if it exists, was written for this photo, and the
+    checksum S3 holds for it matches the one recorded in its metadata. Anything else,
+    including a failed lookup, means the photo is processed again.
+    """
+    try:
+        with span("s3.head_memory"):
+            head = s3_client.head_object(Bucket=BUCKET, Key=memory_key(photo),
+                                         ChecksumMode="ENABLED")
+    except Exception as e:
+        code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if code not in ("404", "NoSuchKey", "NotFound"):
+            logger.warning(f"Could not check for a memory of photo {photo.get('id')}: {e}")
+        return None
+    metadata = head.get("Metadata", {})
+    checksum = head.get("ChecksumSHA256")
+    if metadata.get("photo-id") != str(photo["id"]) or not checksum \
+            or metadata.get("sha256") != checksum:
+        return None
+    return memory_url(photo)
+
+
+def memory_result(url, text):
+    """
+    Build the record handed to the embed step for a memory uploaded to url:
+    {"s3_url": url, "text": text}, without "text" if it is over INLINE_TEXT_MAX_BYTES.
+    """
+    result = {"s3_url": url}
+    if len(text.encode("utf-8")) <= INLINE_TEXT_MAX_BYTES:
+        result["text"] = text
+    return result
+
+
+def process_photo(photo, openai_client, rek_client, s3_client, download=None):
+    """
+    Download, analyze and write a memory for a single photo, then upload it to S3.
+    Returns the memory's record for the embed step (see memory_result).
+    """
+    prepare_photo(photo, rek_client, download)
+    generated_text = generate_memory(openai_client, photo)
+    return memory_result(upload_memory(s3_client, photo, generated_text), generated_text)
+
+
+def _within_budget(budget, fn, *args):
+    """
+    Run fn(*args) if budget admits another photo and return its result, else DEFERRED.
+    """
+    if budget is None:
+        return fn(*args)
+    token = budget.start()
+    if token is None:
+        return DEFERRED
+    try:
+        return fn(*args)
+    finally:
+        # Failed photos count too, or a run of failures would leave the estimate stale
+        budget.finish(token)
+
+
+def _process_photos_batched(executor, photos, downloads, openai_client, rek_client, s3_client,
+                            batch_size, budget=None):
+    """
+    Analyze all photos, write their memories batch_size photos per completion, then upload
+    them. Returns one memory record, exception or DEFERRED per photo.
+    """
+    outcomes = [None] * len(photos)
+    tokens = {}
+
+    def finish(i):
+        # A photo's cost is its time from analysis to upload or failure, batch wait included
+        if budget:
+            budget.finish(tokens[i])
+
+    def start_and_prepare(i, photo, download):
+        token = budget.start() if budget else None
+        if budget and token is None:
+            return DEFERRED
+        tokens[i] = token
+        try:
+            prepare_photo(photo, rek_client, download)
+        except Exception:
+            finish(i)
+            raise
+
+    futures = [executor.submit(start_and_prepare, i, photo, download)
+               for i, (photo, download) in enumerate(zip(photos, downloads))]
+    prepared = []
+    for i, future in enumerate(futures):
+        try:
+            if future.result() is DEFERRED:
+                outcomes[i] = DEFERRED
+            else:
+                prepared.append(i)
+        except Exception as e:
+            outcomes[i] = e
+
+    batches = [prepared[k:k + batch_size] for k in range(0, len(prepared), batch_size)]
+    futures = [executor.submit(generate_memories, openai_client, [photos[i] for i in batch])
+               for batch in batches]
+    upload_futures = {}
+    for batch, future in zip(batches, futures):
+        for i, text in zip(batch, future.result()):
+            if isinstance(text, Exception):
+                outcomes[i] = text
+                finish(i)
+            else:
+                upload_futures[i] = (executor.submit(upload_memory, s3_client, photos[i], text),
+                                     text)
+
+    for i, (future, text) in upload_futures.items():
+        try:
+            outcomes[i] = memory_result(future.result(), text)
+        except Exception as e:
+            outcomes[i] = e
+        finish(i)
+    return outcomes
+
+
+def process_photos(photos, openai_client, rek_client, s3_client, max_workers=5, batch_size=1,
+                   max_distance=DEDUP_MAX_DISTANCE, checkpoint=False, budget=None, select=True):
+    """
+    Process photos concurrently with at most max_workers in flight.
+    Near-duplicate photos are dropped first and replaced by alternates where available
+    (see select_distinct_photos), unless select is False because photos were selected by
+    an earlier invocation.
+    With batch_size > 1, memories are written for up to batch_size photos per completion.
+    With checkpoint, photos whose memory is already in S3 (see find_checkpoint) are not
+    analysed or written again; their memories are returned without the text.
+    With a budget (utils.deadline.WorkBudget), photos are only started while the
+    invocation has time to finish them.
+    A failure only affects its own photo. Returns (results, errors, deferred), all in
+    input order, where deferred lists the photos that were not started.
+    """
+    results, errors, deferred = [], [], []
+    if not photos:
+        return results, errors, deferred
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(photos)))) as executor:
+        if select:
+            # Select before looking for checkpoints, so every attempt picks the same photos
+            photos, downloads = select_distinct_photos(executor, photos, max_distance)
+        else:
+            downloads = [None] * len(photos)  # Downloaded once a photo is started
+        outcomes = [None] * len(photos)
+        if checkpoint:
+            urls = executor.map(lambda photo: find_checkpoint(s3_client, photo), photos)
+            for i, url in enumerate(urls):
+                if url:
+                    outcomes[i] = {"s3_url": url}
+            done = len(photos) - outcomes.count(None)
+            if done:
+                logger.info(f"Resuming: {done} of {len(photos)} memories are already in S3.")
+        pending = [i for i, outcome in enumerate(outcomes) if outcome is None]
+        pending_photos = [photos[i] for i in pending]
+        pending_downloads = [downloads[i] for i in pending]
+        if batch_size > 1:
+            new_outcomes = _process_photos_batched(executor, pending_photos, pending_downloads,
+                                                   openai_client, rek_client, s3_client,
+                                                   batch_size, budget)
+        else:
+            futures = [
+                executor.submit(_within_budget, budget, process_photo, photo, openai_client,
+                                rek_client, s3_client, download)
+                for photo, download in zip(pending_photos, pending_downloads)
+            ]
+            new_outcomes = []
+            for future in futures:
+                try:
+                    new_outcomes.append(future.result())
+                except Exception as e:
+                    new_outcomes.append(e)
+        for i, outcome in zip(pending, new_outcomes):
+            outcomes[i] = outcome
+
+    for photo, outcome in zip(photos, outcomes):
+        if outcome is DEFERRED:
+            deferred.append(photo)
+        elif isinstance(outcome, Exception):
+            logger.error(f"Failed to process photo {photo.get('id')}: {outcome}")
+            errors.append({"id": photo.get("id"), "error": str(outcome)})
+        else:
+            results.append(outcome)
+    return results, errors, deferred
 
 
 def lambda_handler(event, context):
     """
     Lambda function to generate diary entries and memory entries for the given date.
+
+    Photos are processed concurrently (GENERATE_MAX_WORKERS at a time), and with
+    MEMORY_BATCH_SIZE > 1 several photos share one completion. If some photos fail,
+    the memories of the others are still returned and the log status is PartialSuccess;
+    the invocation fails only when no photo could be processed.
+
+    Each uploaded memory is a checkpoint: when Step Functions retries a failed or timed-out
+    invocation, photos whose memories are already in S3 are skipped (CHECKPOINT_MEMORIES),
+    and the result lists the memories of all attempts.
+
+    New photos are only started while the invocation has time to finish them, judged from
+    the context's remaining time and the recent cost of a photo (utils.deadline). If some
+    are left, the result is {"statusCode": 200, "continuation": {...}} instead, holding the
+    memories so far and the photos left (as stage manifests when STAGE_MANIFESTS is set,
+    like a stage result, so the state stays small); the state machine invokes the Lambda
+    again with the continuation in the event until no continuation is returned.
+
+    Each memory is returned as {"s3_url", "text"}, with the text only if it is at most
+    INLINE_TEXT_MAX_BYTES, so the embed step reads only the larger ones back from S3.
     """
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
@@ -62,94 +632,71 @@ def lambda_handler(event, context):
 
     earth_date = event["earth_date"]
     fetch_result = event["fetch_result"]
-    body = fetch_result.get("body", "[]")
-    photos = json.loads(body)
-    results = []
+    continuation = event.get("continuation") or {}
+    max_workers = int(os.getenv("GENERATE_MAX_WORKERS", 5))
+    # Photos per completion; 1 keeps one completion per photo
+    batch_size = int(os.getenv("MEMORY_BATCH_SIZE", 1))
 
+    start_trace("generate")
     try:
-        # Iterate through photos
-        for photo in photos:
-            logger.info(photo)
-
-            # Download the image
-            img_src = photo["img_src"]
-            img_filename = img_src.split("/")[-1]
-            img_path = f"/tmp/{img_filename}"
-            logger.info(f"Downloading image from {img_src} to {img_path}")
-            response = requests.get(img_src)
-            with open(img_path, "wb") as f:
-                f.write(response.content)
-
-            # Analyze the image
-            labels = analyze_image(img_path)
-            photo["labels"] = labels
-            logger.info(f"Labels: {labels}")
-
-            # Initialize OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
-            # Prompt a memory for the image
-            messages = [
-                {
-                    "role": "system",
-                    "content": f"""You are Curiosity, NASA's Mars rover, exploring the Red Planet.
-                        Your mission is to observe, analyze, and document the Martian landscape
-                        in detail. Every day, you observe the world around you through photos
-                        and store a memory entry in the following format:
-
-                        Memory Entry:
-                        - Data:
-                        - Date: [Earth date]
-                        - Sol: [Martian sol]
-                        - URL: [URL of the image]
-                        - Features: [List of features identified in the image]
-                        - Interpretation:
-                        - Description: [Detailed description of the scene based on the image,
-                                        including colors, shapes, textures, and key geological
-                                        features.]
-                        - Speculation: [Educated guesses about the location, possible
-                                        geological processes, or historical context of
-                                        the features in the image.]
-                        - Reflection: [Reflect on how this image contributes to your journey as
-                                        Curiosity. What does it make you think about as an
-                                        explorer? How do you imagine humans will react when they
-                                        see these findings?]
-
-                        Here is today's image and context:
-                        - Date: {photo['earth_date']}
-                        - Sol: {photo['sol']}
-                        - URL: {photo['img_src']}
-                        - Features:{labels}
-
-                        Write the memory entry.""",
-                }
-            ]
-            response = client.chat.completions.create(model="gpt-4", messages=messages)
-            generated_text = response.choices[0].message.content.strip()
-            logger.info("Successfully generated memory.")
-
-            # Upload memory to S3
-            s3 = boto3.client("s3")
-            bucket = "curiosity-data-1205"
-            logger.info(f"Uploading memory to S3...")
-            memory_filename = f"image{photo['id']}_memory.txt"
-            memory_key = f"memories/{photo['earth_date']}/{memory_filename}"
-            response = s3.put_object(
-                Bucket=bucket, Key=memory_key, Body=generated_text.encode("utf-8")
-            )
-            memory_url = f"https://{bucket}.s3.amazonaws.com/{memory_key}"
-            logger.info(f"Memory uploaded to S3: {memory_url}")
-            results.append(memory_url)
-
-        update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME,
-                            lambda_status="Success", lambda_output=results)
+        if continuation:
+            # The photos an earlier invocation selected but did not get to
+            photos = list(iter_stage_records(continuation["photos"]))
+            logger.info(f"Continuing with {len(photos)} photos "
+                        f"(attempt {continuation['attempt'] + 1}).")
+        else:
+            photos = list(iter_stage_records(fetch_result))
+
+        # Clients are shared by all workers; boto3 clients and OpenAI are thread-safe
+        openai_client = get_openai_client()
+        rek_client = get_rekognition_client()
+        s3_client = get_s3_client()
+
+        budget = WorkBudget(context, get_cost_model("generate.photo", PHOTO_COST_MS))
+        budget.cost_model.load(continuation.get("cost"))
+        results, errors, deferred = process_photos(
+            photos, openai_client, rek_client, s3_client, max_workers=max_workers,
+            batch_size=batch_size, checkpoint=CHECKPOINT_MEMORIES, budget=budget,
+            select=not continuation)
+        if continuation:
+            results = list(iter_stage_records(continuation["results"])) + results
+            errors = list(iter_stage_records(continuation["errors"])) + errors
+
+        if deferred:
+            logger.info(f"Deferring {len(deferred)} photos to the next invocation.")
+            update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME, lambda_status="InProgress",
+                                lambda_output={"memories": len(results), "failed": len(errors),
+                                               "remaining": len(deferred)},
+                                timings=finish_trace(earth_date))
+            wait_for_pipeline_log()
+            # Texts are left out to keep the state small; the embed step reads them from S3
+            return {"statusCode": 200, "continuation": {
+                "attempt": continuation.get("attempt", 0) + 1,
+                "photos": stage_result(deferred, earth_date, "generate-deferred"),
+                "results": stage_result([{"s3_url": record["s3_url"]} for record in results],
+                                        earth_date, "generate-partial"),
+                "errors": stage_result(errors, earth_date, "generate-errors"),
+                "cost": budget.cost_model.state(),
+            }}
+
+        if errors and not results:
+            raise RuntimeError(f"All {len(errors)} photos failed: {errors[0]['error']}")
+
+        status = "PartialSuccess" if errors else "Success"
         # Return the image metadata for the next step
-        return {"statusCode": 200, "body": json.dumps(results)}
-    
+        result = stage_result(results, earth_date, "generate")
+        # The log keeps the URLs only; the texts are in S3
+        update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME, lambda_status=status,
+                            lambda_output=[record["s3_url"] for record in results],
+                            timings=finish_trace(earth_date))
+        wait_for_pipeline_log()
+        return result
+
     except Exception as e:
         logger.error(f"An error occurred: {e}")
-        update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME,
-                            lambda_status="Failed", lambda_output=str(e))
+        update_pipeline_log(earth_date, lambda_name=LAMBDA_NAME, lambda_status="Failed",
+                            lambda_output=str(e), timings=finish_trace(earth_date))
+        wait_for_pipeline_log()
         raise e
 
 
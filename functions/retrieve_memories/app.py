@@ -0,0 +1,228 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+import os
+import sys
+from urllib.parse import urlparse
+
+# Load environment variables from .env file when running outside Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Add the parent directory to sys.path for imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+functions_dir = os.path.abspath(os.path.join(current_dir, ".."))
+repo_root = os.path.abspath(os.path.join(current_dir, "../.."))  # Adjust path to repo root
+if repo_root not in sys.path or functions_dir not in sys.path:
+    sys.path.append(repo_root)  # Ensure repo root is in sys.path
+    sys.path.append(functions_dir)  # Ensure functions directory is in sys.path
+
+from utils.clients import get_openai_client, get_pinecone_index, get_s3_client
+from utils.embedding_cache import content_hash
+from utils.embeddings import EMBEDDING_MODEL, INDEX_NAME, date_number, get_embedding
+from utils.local_index import LocalVectorIndex
+from utils.rate_limiter import rate_limited_call
+from utils.tracing import finish_trace, span, start_trace
+from utils.ttl_cache import TTLCache
+
+# Define logger
+logger = logging.getLogger()
+if not logger.hasHandlers():  # Prevent duplicate handlers during testing
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+logger.setLevel(logging.INFO)  # Set logging level
+
+# Constants
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+HYDRATE_MAX_WORKERS = 8  # Concurrent S3 reads for hits stored without their text
+
+# Query embeddings and the local index are kept across warm invocations
+_query_cache = None
+_local_index = None
+
+
+def get_query_cache():
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = TTLCache(
+            max_entries=int(os.getenv("QUERY_CACHE_SIZE", 1024)),
+            ttl_seconds=int(os.getenv("QUERY_CACHE_TTL_SECONDS", 3600)),
+        )
+    return _query_cache
+
+
+def get_local_index():
+    """
+    Return the local index to search instead of Pinecone, or None unless LOCAL_INDEX_DIR
+    is set.
+    """
+    global _local_index
+    directory = os.getenv("LOCAL_INDEX_DIR")
+    if not directory:
+        return None
+    if _local_index is None or _local_index.directory != directory:
+        _local_index = LocalVectorIndex(directory)
+    return _local_index
+
+
+def embed_query(query, client, cache=None):
+    """
+    Return the embedding of query, from cache when the same query was embedded recently.
+    The cache is keyed on the exact text that is embedded, so a hit never depends on
+    which of several spellings of a question came first.
+    """
+    key = content_hash(query, EMBEDDING_MODEL)
+    embedding = cache.get(key) if cache is not None else None
+    if embedding is not None:
+        logger.info("Using cached query embedding.")
+        return embedding
+    with span("openai.embeddings"):
+        embedding = get_embedding(query, client)
+    if cache is not None:
+        cache.put(key, embedding)
+    return embedding
+
+
+def build_filter(start_date=None, end_date=None, types=None):
+    """
+    Build the Pinecone metadata filter for a date range and memory types, or None.
+    """
+    conditions = []
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = date_number(start_date)
+    if end_date:
+        date_range["$lte"] = date_number(end_date)
+    if date_range:
+        conditions.append({"date_num": date_range})
+    if types:
+        conditions.append({"type": {"$in": list(types)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _match(vector_id, score, metadata):
+    return {"id": vector_id, "score": score, "date": metadata.get("date"),
+            "type": metadata.get("type"), "s3_url": metadata.get("s3_url"),
+            "text": metadata.get("text")}
+
+
+def query_pinecone(index, vector, top_k, start_date=None, end_date=None, types=None):
+    """
+    Query Pinecone with the filters applied by the index, so only matching vectors are
+    scanned.
+    """
+    with span("pinecone.query"):
+        response = rate_limited_call("pinecone", index.query, vector=vector, top_k=top_k,
+                                     include_metadata=True,
+                                     filter=build_filter(start_date, end_date, types))
+    return [_match(match.id, match.score, match.metadata or {}) for match in response.matches]
+
+
+def query_local_index(local_index, vector, top_k, start_date=None, end_date=None, types=None):
+    with span("local_index.search"):
+        hits = local_index.search(vector, top_k, start_date=start_date, end_date=end_date,
+                                  types=types)
+    return [_match(hit["id"], hit["score"], hit["metadata"]) for hit in hits]
+
+
+def read_memory_text(s3_client, url):
+    parsed_url = urlparse(url)
+    bucket = parsed_url.netloc.split(".")[0]
+    with span("s3.get_memory"):
+        response = s3_client.get_object(Bucket=bucket, Key=parsed_url.path.lstrip("/"))
+        return response["Body"].read().decode("utf-8")
+
+
+def hydrate_texts(matches, s3_client, max_workers=HYDRATE_MAX_WORKERS):
+    """
+    Fill in the text of matches stored without it, reading their memories from S3
+    concurrently. Matches whose text cannot be read keep text None.
+    """
+    missing = [match for match in matches if not match["text"] and match["s3_url"]]
+    if not missing:
+        return matches
+    logger.info(f"Reading the text of {len(missing)} memories from S3...")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+        futures = [executor.submit(read_memory_text, s3_client, match["s3_url"])
+                   for match in missing]
+        for match, future in zip(missing, futures):
+            try:
+                match["text"] = future.result()
+            except Exception as e:
+                logger.warning(f"Could not read {match['s3_url']}: {e}")
+    return matches
+
+
+def retrieve_memories(query, top_k=DEFAULT_TOP_K, start_date=None, end_date=None, types=None):
+    """
+    Return the top_k memories most similar to query, best first, optionally only those
+    dated within [start_date, end_date] and with a type in types. Each match is a dict with
+    id, score, date, type, s3_url and text.
+    """
+    vector = embed_query(query, get_openai_client(), get_query_cache())
+    local_index = get_local_index()
+    if local_index is not None:
+        matches = query_local_index(local_index, vector, top_k, start_date, end_date, types)
+    else:
+        matches = query_pinecone(get_pinecone_index(INDEX_NAME), vector, top_k, start_date,
+                                 end_date, types)
+    return hydrate_texts(matches, get_s3_client())
+
+
+def lambda_handler(event, context):
+    """
+    Lambda function to retrieve the memories most relevant to a chatbot question.
+    Input: {"query": "What did the rocks look like near the landing site?", "top_k": 5,
+            "start_date": "2012-08-06", "end_date": "2012-12-31", "types": ["memory"]}
+    Only "query" is required. Dates are inclusive (YYYY-MM-DD).
+
+    Query embeddings are cached for QUERY_CACHE_TTL_SECONDS, and the date and type filters
+    are applied by Pinecone (or by the local index when LOCAL_INDEX_DIR is set).
+    """
+    query = event.get("query")
+    if not query or not query.strip():
+        raise ValueError("Missing 'query' in the input event.")
+    for field in ["start_date", "end_date"]:
+        if event.get(field):
+            try:
+                datetime.strptime(event[field], "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Invalid '{field}' format. Expected YYYY-MM-DD, "
+                                 f"got '{event[field]}'.")
+    top_k = max(1, min(int(event.get("top_k", DEFAULT_TOP_K)), MAX_TOP_K))
+    types = event.get("types")
+    if isinstance(types, str):
+        types = [types]
+
+    start_trace("retrieve")
+    try:
+        matches = retrieve_memories(query, top_k=top_k, start_date=event.get("start_date"),
+                                    end_date=event.get("end_date"), types=types)
+        logger.info(f"Retrieved {len(matches)} memories.")
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"query": query, "matches": matches})
+        }
+    except Exception as e:
+        logger.error(f"An internal error occurred: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
+    finally:
+        finish_trace()
+
+
+if __name__ == "__main__":
+    logger.info("Testing locally...")
+    test_event = {"query": "Describe the rocks you saw in your first week on Mars.",
+                  "end_date": "2012-08-13"}
+    result = lambda_handler(test_event, None)
+    logger.info(f"Result: {result}")
@@ -0,0 +1,154 @@
+import os
+import threading
+
+# Shared clients for the pipeline Lambdas.
+#
+# Each client is created on first use and cached for the lifetime of the container, so warm
+# invocations reuse its HTTP connection pool. The SDKs are imported inside the factories so
+# a Lambda only pays the import cost of the clients it actually uses.
+#
+# Calls made through utils.rate_limiter.rate_limited_call are retried there, within the
+# shared rate limit. The clients used for them are created with retries=False, so the SDK
+# does not multiply the attempts with retries of its own.
+
+# Connections kept per boto3 client; must cover the worker threads sharing a client
+MAX_POOL_CONNECTIONS = int(os.getenv("CLIENT_MAX_POOL_CONNECTIONS", 25))
+# Retries for idempotent HTTP requests made through the shared requests session
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def register_client(name, client):
+    """
+    Register a ready-made client under name, e.g. a stand-in for local runs and tests.
+    """
+    with _lock:
+        _clients[name] = client
+
+
+def reset_clients():
+    """
+    Drop all cached clients so the next call creates them again.
+    """
+    with _lock:
+        _clients.clear()
+
+
+def _boto_config(retries=True):
+    from botocore.config import Config
+    retry_config = {"mode": "standard"}
+    if not retries:
+        retry_config["total_max_attempts"] = 1
+    return Config(max_pool_connections=MAX_POOL_CONNECTIONS, retries=retry_config)
+
+
+def get_boto3_client(service_name, retries=True):
+    """
+    Return the shared client for service_name. Whether it retries is fixed by the first
+    call, so a service's calls should all go through rate_limited_call or none of them.
+    """
+    def factory():
+        import boto3
+        return boto3.client(service_name, config=_boto_config(retries))
+    return _get_or_create(service_name, factory)
+
+
+def get_s3_client():
+    return get_boto3_client("s3")
+
+
+def get_rekognition_client():
+    return get_boto3_client("rekognition", retries=False)
+
+
+def get_stepfunctions_client():
+    return get_boto3_client("stepfunctions")
+
+
+def get_dynamodb_resource():
+    def factory():
+        import boto3
+        return boto3.resource("dynamodb", config=_boto_config())
+    return _get_or_create("dynamodb_resource", factory)
+
+
+def get_dynamodb_table(table_name):
+    return _get_or_create(f"dynamodb_table:{table_name}",
+                          lambda: get_dynamodb_resource().Table(table_name))
+
+
+def get_http_session(retries=True):
+    """
+    Return a pooled requests session that retries GET requests with exponential backoff,
+    honouring Retry-After on 429 and 503 responses; with retries=False, one that does not.
+    """
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=HTTP_MAX_RETRIES if retries else 0, backoff_factor=0.5,
+                      status_forcelist=HTTP_RETRY_STATUSES,
+                      allowed_methods=frozenset(["GET", "HEAD"]),
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=MAX_POOL_CONNECTIONS, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _get_or_create("http_session" if retries else "http_session:no_retries", factory)
+
+
+def get_json(url, params=None, timeout=30, retries=True):
+    """
+    GET url with the shared session and return the decoded JSON body, raising on HTTP errors.
+    Pass retries=False when the call is retried by rate_limited_call.
+    """
+    response = get_http_session(retries).get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_openai_client():
+    def factory():
+        from openai import OpenAI
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is not set in the environment variables.")
+        # Every OpenAI call goes through rate_limited_call, which does the retrying
+        return OpenAI(api_key=api_key, max_retries=0)
+    return _get_or_create("openai", factory)
+
+
+def get_pinecone_client():
+    def factory():
+        from pinecone import Pinecone
+        api_key = os.getenv("PINECONE_API_KEY")
+        if not api_key:
+            raise ValueError("PINECONE_API_KEY is not set in the environment variables.")
+        client = Pinecone(api_key=api_key)
+        # Every Pinecone call goes through rate_limited_call, so the index clients made from
+        # this configuration do not retry at the connection level. (The SDK still makes up
+        # to 3 attempts per request itself, which cannot be configured.)
+        client.openapi_config.retries = 0
+        return client
+    return _get_or_create("pinecone", factory)
+
+
+def get_pinecone_index(index_name):
+    return _get_or_create(f"pinecone_index:{index_name}",
+                          lambda: get_pinecone_client().Index(index_name))
@@ -1,15 +1,35 @@
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from decimal import Decimal
+import heapq
+import json
 import os
 import logging
+import re
+import threading
+
+from utils.clients import get_dynamodb_table, get_s3_client
 
 # DynamoDB Table Name
 TABLE_NAME = os.environ["DDB_TABLE_NAME"]
 
-# DynamoDB Client
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(TABLE_NAME)
+# Outputs larger than this are stored in S3 and logged as a pointer; DynamoDB items are
+# limited to 400 KB and every KB costs a write capacity unit
+LOG_INLINE_MAX_BYTES = int(os.getenv("LOG_INLINE_MAX_BYTES", 16 * 1024))
+LOG_OFFLOAD_BUCKET = os.getenv("LOG_OFFLOAD_BUCKET", "curiosity-data-1205")
+LOG_OFFLOAD_PREFIX = "pipeline-logs"
+LOG_WAIT_SECONDS = float(os.getenv("LOG_WAIT_SECONDS", 10))  # See wait_for_pipeline_log
+
+# Flat status of each date, indexed with the date by StatusDateIndex:
+# COMPLETE once the last stage succeeds, SKIPPED when the scheduler found no photos,
+# FAILED when the latest stage failed, and IN_PROGRESS otherwise
+STATUS_INDEX_NAME = "StatusDateIndex"
+FINAL_STAGE = "Lambda3__EmbedToPinecone"
+FAILED_STATUSES = {"Error", "ERROR", "Failed", "FAILED"}
+COMPLETE_STATUSES = {"Success", "PartialSuccess"}
+INCOMPLETE_STATUSES = ("FAILED", "IN_PROGRESS")
+STATUS_FIELDS = ("pipeline_status", "last_stage", "status_updated_at")
 
 # Define logger
 logger = logging.getLogger()
@@ -20,46 +40,276 @@ if not logger.hasHandlers():  # Prevent duplicate handlers during testing
     logger.addHandler(handler)
 logger.setLevel(logging.INFO)  # Set logging level
 
+# Writer and thread behind update_pipeline_log, kept across warm invocations
+_log_writer = None
+_log_executor = None
+_log_futures = []
+_log_lock = threading.Lock()
+
+
+def _lambda_field(lambda_name):
+    return lambda_name.replace(" ", "_").replace(":", "_")  # Normalize name for keys.
+
+
+def _stage_number(field):
+    match = re.match(r"Lambda(\d+)__", field)
+    return int(match.group(1)) if match else None
+
+
+def pipeline_status(fields):
+    """
+    Return (pipeline_status, last_stage) for the Lambda entries in fields, a log item or
+    the fields of one update, or (None, None) if it has no Lambda entries.
+    The latest stage decides, so a rerun moves a FAILED date back to IN_PROGRESS.
+    """
+    stages = [(_stage_number(field), field) for field, value in fields.items()
+              if isinstance(value, dict) and "status" in value and _stage_number(field) is not None]
+    if not stages:
+        return None, None
+    _, last_stage = max(stages)
+    status = fields[last_stage]["status"]
+    if status is None:
+        return None, None
+    if status in FAILED_STATUSES:
+        return "FAILED", last_stage
+    if status == "SKIPPED":
+        return "SKIPPED", last_stage
+    if last_stage == FINAL_STAGE and status in COMPLETE_STATUSES:
+        return "COMPLETE", last_stage
+    return "IN_PROGRESS", last_stage
+
+
+def _to_dynamodb(value):
+    # The DynamoDB resource rejects floats, so round-trip through JSON with Decimals;
+    # anything else JSON cannot represent (e.g. datetimes) is logged as a string
+    return json.loads(json.dumps(value, default=str), parse_float=Decimal)
+
+
+class PipelineLogWriter:
+    """
+    Buffer updates to the PipelineLog table and write each date's item once per flush.
+
+    Each Lambda's output is stored in its own nested structure within the DynamoDB item.
+    Outputs larger than LOG_INLINE_MAX_BYTES are written to S3 and replaced by a pointer:
+    {"s3_url": ..., "bytes": ..., "items": ...}. A Lambda's timing summary from
+    utils.tracing is stored next to its output under "timings".
+
+    Every update also sets the flat "pipeline_status" and "last_stage" attributes (see
+    pipeline_status), which StatusDateIndex indexes with the date, and "status_updated_at",
+    the time the status was recorded. A status recorded before the item's current one is
+    not written, so a late flush of an earlier stage (e.g. the scheduler's) leaves a newer
+    COMPLETE status alone, while a rerun's updates replace it. FAILED is always written.
+    """
+
+    def __init__(self, table_name=None):
+        self.table_name = table_name or TABLE_NAME
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, earth_date, sol=None, lambda_name=None, lambda_status=None,
+               lambda_output=None, timings=None):
+        """
+        Buffer the status and output of a Lambda for earth_date; later records for the same
+        Lambda replace earlier ones.
+        """
+        timestamp = datetime.utcnow().isoformat()
+        lambda_field = _lambda_field(lambda_name)
+        output = self._compact_output(earth_date, lambda_field, lambda_output)
+        with self._lock:
+            fields = self._pending.setdefault(earth_date, {})
+            fields[lambda_field] = {
+                "status": lambda_status,
+                "output": output,
+                "updated_at": timestamp
+            }
+            if timings is not None:
+                fields[lambda_field]["timings"] = timings
+            fields["updated_at"] = timestamp
+            if sol is not None:
+                fields["sol"] = sol
+            status, last_stage = pipeline_status(fields)
+            if status:  # An index key attribute cannot be null
+                fields["pipeline_status"], fields["last_stage"] = status, last_stage
+                fields["status_updated_at"] = timestamp
+
+    def flush(self):
+        """
+        Write all buffered updates, one update_item per date. Errors are logged, not raised,
+        so logging never fails a pipeline step. Returns the errors, if any.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        errors = []
+        for earth_date, fields in pending.items():
+            try:
+                self._update(get_dynamodb_table(self.table_name), earth_date, fields)
+                statuses = {field: value["status"] for field, value in fields.items()
+                            if isinstance(value, dict)}
+                logger.info(f"Updated log for {earth_date}: {statuses}")
+            except (BotoCoreError, ClientError, TypeError, ValueError) as e:
+                logger.error(f"Error updating DynamoDB: {e}")
+                errors.append({"earth_date": earth_date, "error": str(e)})
+        return errors
+
+    def _update(self, table, earth_date, fields):
+        """
+        Write one date's buffered fields. Unless the status is FAILED, the status attributes
+        are only set if they were recorded no earlier than the stored ones; ISO timestamps
+        sort in time order.
+        """
+        names, values, assignments = {}, {}, []
+        for i, (field, value) in enumerate(fields.items()):
+            names[f"#f{i}"] = field
+            values[f":v{i}"] = _to_dynamodb(value)
+            assignments.append(f"#f{i} = :v{i}")
+        kwargs = {}
+        if "status_updated_at" in fields and fields["pipeline_status"] != "FAILED":
+            i = list(fields).index("status_updated_at")
+            kwargs["ConditionExpression"] = f"attribute_not_exists(#f{i}) OR #f{i} <= :v{i}"
+        try:
+            table.update_item(
+                Key={"EarthDate": earth_date},
+                UpdateExpression="SET " + ", ".join(assignments),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="NONE",
+                **kwargs
+            )
+        except ClientError as e:
+            if not kwargs or e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            logger.info(f"Log for {earth_date} has a newer status; keeping it.")
+            self._update(table, earth_date, {field: value for field, value in fields.items()
+                                             if field not in STATUS_FIELDS})
+
+    def _compact_output(self, earth_date, lambda_field, lambda_output):
+        payload = json.dumps(lambda_output, default=str).encode("utf-8")
+        if len(payload) <= LOG_INLINE_MAX_BYTES:
+            return lambda_output
+        pointer = {"bytes": len(payload)}
+        if isinstance(lambda_output, list):
+            pointer["items"] = len(lambda_output)
+        key = f"{LOG_OFFLOAD_PREFIX}/{earth_date}/{lambda_field}.json"
+        try:
+            get_s3_client().put_object(Bucket=LOG_OFFLOAD_BUCKET, Key=key, Body=payload,
+                                       ContentType="application/json")
+            pointer["s3_url"] = f"https://{LOG_OFFLOAD_BUCKET}.s3.amazonaws.com/{key}"
+        except (BotoCoreError, ClientError) as e:
+            logger.error(f"Error offloading log output to S3: {e}")
+            pointer["truncated"] = True
+        return pointer
+
 
 def update_pipeline_log(earth_date, sol=None, lambda_name=None,
-                        lambda_status=None, lambda_output=None):
+                        lambda_status=None, lambda_output=None, timings=None):
     """
     Update the PipelineLog table in DynamoDB with the status and output of a Lambda function.
 
     Each Lambda's output will be stored in its own nested structure within the DynamoDB item.
+    The update is buffered and written by a background thread, so the caller carries on
+    meanwhile, and updates buffered before the thread gets to them share one write.
+    Lambda freezes background threads once the handler returns, so handlers call
+    wait_for_pipeline_log before returning. Returns a future of the write's errors.
     """
-    try:
-        # Create timestamp
-        timestamp = datetime.utcnow().isoformat()
+    global _log_writer, _log_executor
+    with _log_lock:
+        if _log_writer is None:
+            _log_writer = PipelineLogWriter()
+            _log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-log")
+        _log_writer.record(earth_date, sol=sol, lambda_name=lambda_name,
+                           lambda_status=lambda_status, lambda_output=lambda_output,
+                           timings=timings)
+        future = _log_executor.submit(_log_writer.flush)
+        _log_futures.append(future)
+    return future
 
-        # Define the Lambda-specific field name
-        lambda_field = lambda_name.replace(" ", "_").replace(":", "_")  # Normalize name for keys.
 
-        # Prepare the update expression for the specific Lambda
-        update_expression = f"SET {lambda_field} = :lambda_data, updated_at = :updated_at"
-        expression_values = {
-            ":lambda_data": {
-                "status": lambda_status,
-                "output": lambda_output,
-                "updated_at": timestamp
-            },
-            ":updated_at": timestamp
-        }
-
-        # Add sol to the update if provided
-        if sol is not None:
-            update_expression += ", sol = :sol"
-            expression_values[":sol"] = sol
-
-        # Perform the update
-        response = table.update_item(
-            Key={"EarthDate": earth_date},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_values,
-            ReturnValues="UPDATED_NEW"
-        )
-        logger.info(f"Updated log for {earth_date} with {lambda_name} status: {lambda_status}")
-        return response
-    except (BotoCoreError, ClientError) as e:
-        logger.error(f"Error updating DynamoDB: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+def wait_for_pipeline_log(timeout=LOG_WAIT_SECONDS):
+    """
+    Wait up to timeout seconds for the updates made by update_pipeline_log to be written.
+    Returns their errors, which have been logged already.
+    """
+    with _log_lock:
+        futures = list(_log_futures)
+        _log_futures.clear()
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        logger.error(f"{len(not_done)} pipeline log writes did not finish in {timeout} s.")
+    return [error for future in done for error in future.result()]
+
+
+def query_dates_by_status(status, start_date=None, end_date=None, page_size=100,
+                          start_key=None, table_name=None):
+    """
+    Return one page of the log items whose pipeline_status is status, dated within
+    [start_date, end_date] and oldest first, as (items, next_key). Pass next_key back as
+    start_key for the next page; it is None after the last page.
+    Items hold only the attributes projected into StatusDateIndex.
+    """
+    names = {"#status": "pipeline_status", "#date": "EarthDate"}
+    values = {":status": status}
+    condition = "#status = :status"
+    if start_date and end_date:
+        condition += " AND #date BETWEEN :start AND :end"
+        values.update({":start": start_date, ":end": end_date})
+    elif start_date:
+        condition += " AND #date >= :start"
+        values[":start"] = start_date
+    elif end_date:
+        condition += " AND #date <= :end"
+        values[":end"] = end_date
+    kwargs = {"IndexName": STATUS_INDEX_NAME, "KeyConditionExpression": condition,
+              "ExpressionAttributeNames": names, "ExpressionAttributeValues": values,
+              "Limit": page_size}
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    response = get_dynamodb_table(table_name or TABLE_NAME).query(**kwargs)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def iter_dates_by_status(status, start_date=None, end_date=None, page_size=100,
+                         table_name=None):
+    start_key = None
+    while True:
+        items, start_key = query_dates_by_status(status, start_date, end_date, page_size,
+                                                 start_key, table_name)
+        for item in items:
+            yield item["EarthDate"]
+        if not start_key:
+            return
+
+
+def iter_incomplete_dates(start_date=None, end_date=None, statuses=INCOMPLETE_STATUSES,
+                          page_size=100, table_name=None):
+    """
+    Yield the dates within [start_date, end_date] whose pipeline failed or has not
+    finished, oldest first, reading StatusDateIndex one page at a time per status.
+    """
+    yield from heapq.merge(*[iter_dates_by_status(status, start_date, end_date, page_size,
+                                                  table_name)
+                             for status in statuses])
+
+
+def backfill_status_attributes(table_name=None):
+    """
+    Set pipeline_status and last_stage on log items written before they existed, so the
+    dates show up in StatusDateIndex. Scans the whole table once; returns the items updated.
+    """
+    table = get_dynamodb_table(table_name or TABLE_NAME)
+    updated = 0
+    kwargs = {}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response["Items"]:
+            status, last_stage = pipeline_status(item)
+            if status is None or "pipeline_status" in item:
+                continue
+            table.update_item(
+                Key={"EarthDate": item["EarthDate"]},
+                UpdateExpression="SET pipeline_status = :status, last_stage = :stage",
+                ExpressionAttributeValues={":status": status, ":stage": last_stage},
+            )
+            updated += 1
+        if "LastEvaluatedKey" not in response:
+            return updated
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+# Deadline-aware budgeting of work within one Lambda invocation.
+#
+# A WorkBudget reads the invocation's remaining time from the Lambda context and only lets
+# an item of work start if its predicted cost fits in what is left, minus a safety margin.
+# The cost is predicted from the recent timings of the same kind of work, kept as
+# exponentially weighted moving averages of the mean and deviation per stage. These survive
+# across warm invocations and can be carried over to the next invocation in a continuation.
+
+DEADLINE_MARGIN_MS = int(os.getenv("DEADLINE_MARGIN_MS", 10000))
+COST_SMOOTHING = 0.25  # Weight of the newest timing in the moving averages
+DEVIATIONS = 2  # Predict mean + DEVIATIONS * deviation, so most items finish in time
+
+_cost_models = {}
+_lock = threading.Lock()
+
+
+class CostModel:
+    """
+    Exponentially weighted moving average of an item's cost and of its deviation, in ms.
+    """
+
+    def __init__(self, initial_ms, alpha=COST_SMOOTHING):
+        self.alpha = alpha
+        self.mean_ms = float(initial_ms)
+        self.deviation_ms = float(initial_ms) / 2
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms):
+        with self._lock:
+            if not self.samples:
+                # The first timing replaces the guess
+                self.mean_ms, self.deviation_ms = elapsed_ms, elapsed_ms / 2
+            else:
+                error = elapsed_ms - self.mean_ms
+                self.mean_ms += self.alpha * error
+                self.deviation_ms += self.alpha * (abs(error) - self.deviation_ms)
+            self.samples += 1
+
+    def predict_ms(self):
+        return self.mean_ms + DEVIATIONS * self.deviation_ms
+
+    def state(self):
+        """
+        Return the model as a dict for a continuation; see load.
+        """
+        return {"mean_ms": round(self.mean_ms), "deviation_ms": round(self.deviation_ms),
+                "samples": self.samples}
+
+    def load(self, state):
+        """
+        Adopt a model saved by state() unless this one has seen more timings.
+        """
+        if state and int(state.get("samples", 0)) > self.samples:
+            with self._lock:
+                self.mean_ms = float(state["mean_ms"])
+                self.deviation_ms = float(state["deviation_ms"])
+                self.samples = int(state["samples"])
+
+
+def get_cost_model(stage, initial_ms):
+    """
+    Return the cost model for stage, shared by every invocation of this Lambda instance.
+    """
+    with _lock:
+        if stage not in _cost_models:
+            _cost_models[stage] = CostModel(initial_ms)
+        return _cost_models[stage]
+
+
+def reset_cost_models():
+    with _lock:
+        _cost_models.clear()
+
+
+def remaining_time_ms(context):
+    """
+    Return the milliseconds left in the invocation, or None without a Lambda context.
+    """
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        return context.get_remaining_time_in_millis()
+    return None
+
+
+class WorkBudget:
+    """
+    Admit items of work while the invocation has time to finish them.
+
+    Call start() before an item: it returns a token if the item may start, or None from
+    the first time the predicted cost no longer fits before the deadline. Pass the token
+    to finish() when the item is done, so its timing refines the prediction. The first
+    item is always admitted, so each invocation makes progress. Without a Lambda context
+    nothing is ever refused.
+    """
+
+    def __init__(self, context, cost_model, margin_ms=DEADLINE_MARGIN_MS, clock=time.monotonic):
+        self.context = context
+        self.cost_model = cost_model
+        self.margin_ms = margin_ms
+        self._clock = clock
+        self._started = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def remaining_ms(self):
+        remaining = remaining_time_ms(self.context)
+        return None if remaining is None else remaining - self.margin_ms
+
+    def start(self):
+        with self._lock:
+            remaining = self.remaining_ms()
+            if self.deferred or (self._started and remaining is not None
+                                 and remaining < self.cost_model.predict_ms()):
+                self.deferred += 1
+                return None
+            self._started += 1
+        return self._clock()
+
+    def finish(self, token):
+        self.cost_model.observe((self._clock() - token) * 1000)
@@ -0,0 +1,47 @@
+import io
+import re
+
+# Stereo and hazard cameras take left and right frames of the same scene. Their raw image
+# filenames differ only in the eye character: NLA_397586928EDR_... and NRA_397586928EDR_...
+STEREO_FILENAME = re.compile(r"^([NFR])[LR]([A-Z]_.+)$")
+
+
+def sequence_key(img_src):
+    """
+    Return a key shared by the left and right frames of a stereo pair: the image filename
+    without its eye character. Other filenames are returned unchanged.
+    """
+    filename = img_src.rsplit("/", 1)[-1]
+    match = STEREO_FILENAME.match(filename)
+    return match.group(1) + match.group(2) if match else filename
+
+
+def dhash(image_bytes, hash_size=8):
+    """
+    Return the difference hash of an image as an int of hash_size * hash_size bits, or None
+    if the image cannot be decoded. Similar images have hashes a small Hamming distance apart.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Let the JPEG decoder scale down while decoding, which is much cheaper
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        image = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    except (OSError, ValueError):
+        return None
+
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
@@ -0,0 +1,60 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+
+
+def content_hash(text, model):
+    """
+    Return the hash identifying the embedding of text by model.
+    """
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite cache of embeddings keyed by content hash, stored as packed float32 vectors.
+
+    The database lives on local disk (e.g. /tmp), so it is shared by warm invocations of
+    the same container; use ":memory:" for a cache that lasts one process only.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(content_hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+    def get_many(self, hashes):
+        """
+        Return a dict of content hash to embedding for the hashes found in the cache.
+        """
+        found = {}
+        hashes = list(hashes)
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT content_hash, vector FROM embeddings "
+                    f"WHERE content_hash IN ({placeholders})", chunk
+                ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        return found
+
+    def put_many(self, embeddings):
+        """
+        Store a dict of content hash to embedding.
+        """
+        rows = [(key, array("f", vector).tobytes()) for key, vector in embeddings.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, vector) VALUES (?, ?)", rows
+            )
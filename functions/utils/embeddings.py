@@ -0,0 +1,20 @@
+from utils.rate_limiter import rate_limited_call
+
+# Embedding settings shared by the Lambda that writes memories to Pinecone and the one that
+# retrieves them: queries must be embedded with the same model as the memories.
+
+INDEX_NAME = "rover-memories"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def get_embedding(text, client, model=EMBEDDING_MODEL):
+    response = rate_limited_call("openai", client.embeddings.create, input=[text], model=model)
+    return response.data[0].embedding
+
+
+def date_number(earth_date):
+    """
+    Return a YYYY-MM-DD date as the number YYYYMMDD, stored with each memory as "date_num"
+    because Pinecone range filters ($gte, $lte) only apply to numbers.
+    """
+    return int(earth_date.replace("-", ""))
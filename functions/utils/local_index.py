@@ -0,0 +1,269 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import threading
+from array import array
+from datetime import date
+
+INDEX_FORMAT_VERSION = 1
+
+
+class LocalVectorIndex:
+    """
+    File-backed vector index with exact top-k cosine search, for offline retrieval and
+    for mirroring the upserts sent to Pinecone.
+
+    A directory holds:
+    - vectors.f32: unit-length float32 vectors, one contiguous row per vector, memory-mapped
+      for search;
+    - dates.i32 and types.u16: fixed-width columns of date ordinals and type codes, so date
+      and type filters are array comparisons;
+    - <field>.jsonl: append-only columns of ids and the other metadata, as [row, value]
+      lines where the last line for a row wins;
+    - index.json: the row count, dimensions and type names, written last, so rows from an
+      interrupted upsert are ignored.
+
+    Search is vectorised with numpy (imported lazily; the Lambda layer installs it) and
+    falls back to pure Python without it, or with use_numpy=False.
+    """
+
+    def __init__(self, directory, use_numpy=True):
+        self.directory = directory
+        self.use_numpy = use_numpy
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        self.dims = None
+        self.type_names = []
+        self.ids = []
+        self.columns = {}
+        self.dates = array("i")
+        self.types = array("H")
+        self._mapped = None
+        try:
+            with open(self._path("index.json")) as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            header = {"version": INDEX_FORMAT_VERSION, "rows": 0, "dims": None,
+                      "type_names": [], "fields": []}
+        if header["version"] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported local index format in {self.directory}.")
+
+        rows = header["rows"]
+        self.dims = header["dims"]
+        self.type_names = list(header["type_names"])
+        self.ids = self._read_column("id", rows)
+        self.columns = {field: self._read_column(field, rows) for field in header["fields"]}
+        for column, name in [(self.dates, "dates.i32"), (self.types, "types.u16")]:
+            if rows:
+                with open(self._path(name), "rb") as f:
+                    column.frombytes(f.read(rows * column.itemsize))
+        self._rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self._type_codes = {name: code for code, name in enumerate(self.type_names)}
+
+    def _read_column(self, field, rows):
+        values = [None] * rows
+        try:
+            with open(self._path(f"{field}.jsonl")) as f:
+                for line in f:
+                    row, value = json.loads(line)
+                    if row < rows:
+                        values[row] = value
+        except FileNotFoundError:
+            pass
+        return values
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Writes
+
+    def upsert(self, vectors):
+        """
+        Insert or replace vectors given as Pinecone-style dicts: {"id", "values", "metadata"}.
+        The "date" (YYYY-MM-DD) and "type" metadata fields are indexed for filtering.
+        """
+        with self._lock:
+            vector_writes, date_writes, type_writes, column_lines = [], [], [], {"id": []}
+            for vector in vectors:
+                values = _normalize(vector["values"])
+                if self.dims is None:
+                    self.dims = len(values)
+                if len(values) != self.dims:
+                    raise ValueError(f"Vector '{vector['id']}' has {len(values)} dimensions, "
+                                     f"the index has {self.dims}.")
+                metadata = dict(vector.get("metadata") or {})
+                row = self._rows.get(vector["id"])
+                if row is None:
+                    row = len(self.ids)
+                    self._rows[vector["id"]] = row
+                    self.ids.append(vector["id"])
+                    self.dates.append(0)
+                    self.types.append(0)
+                    for column in self.columns.values():
+                        column.append(None)
+                    column_lines["id"].append([row, vector["id"]])
+
+                self.dates[row] = _date_ordinal(metadata.pop("date", None))
+                self.types[row] = self._type_code(metadata.pop("type", None))
+                for field in set(self.columns) | set(metadata):
+                    column = self.columns.setdefault(field, [None] * len(self.ids))
+                    column[row] = metadata.get(field)
+                    column_lines.setdefault(field, []).append([row, column[row]])
+                vector_writes.append((row * self.dims * 4, values.tobytes()))
+                date_writes.append((row * self.dates.itemsize,
+                                    self.dates[row:row + 1].tobytes()))
+                type_writes.append((row * self.types.itemsize,
+                                    self.types[row:row + 1].tobytes()))
+
+            _write_at(self._path("vectors.f32"), vector_writes)
+            _write_at(self._path("dates.i32"), date_writes)
+            _write_at(self._path("types.u16"), type_writes)
+            for field, lines in column_lines.items():
+                with open(self._path(f"{field}.jsonl"), "a") as f:
+                    f.writelines(json.dumps(line) + "\n" for line in lines)
+            self._save_header()
+            self._mapped = None
+
+    def _type_code(self, type_name):
+        if type_name is None:
+            type_name = ""
+        if type_name not in self._type_codes:
+            self._type_codes[type_name] = len(self.type_names)
+            self.type_names.append(type_name)
+        return self._type_codes[type_name]
+
+    def _save_header(self):
+        header = {"version": INDEX_FORMAT_VERSION, "rows": len(self.ids), "dims": self.dims,
+                  "type_names": self.type_names, "fields": sorted(self.columns)}
+        tmp_path = self._path("index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self._path("index.json"))
+
+    # Search
+
+    def _matrix(self, numpy):
+        """
+        Return the vectors memory-mapped as a (rows, dims) numpy array, or a flat float32
+        memoryview without numpy.
+        """
+        if self._mapped is None:
+            rows = len(self.ids)
+            if numpy is not None:
+                self._mapped = numpy.memmap(self._path("vectors.f32"), dtype=numpy.float32,
+                                            mode="r", shape=(rows, self.dims))
+            else:
+                with open(self._path("vectors.f32"), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped = memoryview(mapped)[:rows * self.dims * 4].cast("f")
+        return self._mapped
+
+    def search(self, vector, top_k=10, start_date=None, end_date=None, types=None):
+        """
+        Return the top_k vectors most similar to vector by cosine similarity, optionally
+        only those dated within [start_date, end_date] and with a type in types.
+        Each hit is {"id", "score", "metadata"}, best first.
+        """
+        with self._lock:
+            if not self.ids or top_k <= 0:
+                return []
+            query = _normalize(vector)
+            if len(query) != self.dims:
+                raise ValueError(f"Query has {len(query)} dimensions, the index has {self.dims}.")
+            lo = _date_ordinal(start_date) if start_date else None
+            hi = _date_ordinal(end_date) if end_date else None
+            codes = None if types is None else {self._type_codes[name] for name in types
+                                                if name in self._type_codes}
+            numpy = _import_numpy() if self.use_numpy else None
+            if numpy is not None:
+                hits = self._search_numpy(numpy, query, top_k, lo, hi, codes)
+            else:
+                hits = self._search_python(query, top_k, lo, hi, codes)
+            return [{"id": self.ids[row], "score": score, "metadata": self._metadata(row)}
+                    for row, score in hits]
+
+    def _search_numpy(self, numpy, query, top_k, lo, hi, codes):
+        matrix = self._matrix(numpy)
+        rows = None
+        if lo is not None or hi is not None or codes is not None:
+            mask = numpy.ones(len(self.ids), dtype=bool)
+            dates = numpy.frombuffer(self.dates, dtype=numpy.int32)
+            if lo is not None:
+                mask &= dates >= lo
+            if hi is not None:
+                mask &= dates <= hi
+            if codes is not None:
+                mask &= numpy.isin(numpy.frombuffer(self.types, dtype=numpy.uint16),
+                                   list(codes))
+            rows = numpy.flatnonzero(mask)
+            if not len(rows):
+                return []
+        candidates = matrix if rows is None else matrix[rows]
+        scores = candidates @ numpy.frombuffer(query, dtype=numpy.float32)
+        k = min(top_k, len(scores))
+        top = numpy.argpartition(-scores, k - 1)[:k]
+        top = top[numpy.argsort(-scores[top])]
+        return [(int(i if rows is None else rows[i]), float(scores[i])) for i in top]
+
+    def _search_python(self, query, top_k, lo, hi, codes):
+        matrix = self._matrix(None)
+        dims = self.dims
+
+        def scored():
+            for row in range(len(self.ids)):
+                if ((lo is not None and self.dates[row] < lo)
+                        or (hi is not None and self.dates[row] > hi)
+                        or (codes is not None and self.types[row] not in codes)):
+                    continue
+                offset = row * dims
+                yield row, sum(a * b for a, b in zip(matrix[offset:offset + dims], query))
+        return heapq.nlargest(top_k, scored(), key=lambda hit: hit[1])
+
+    def _metadata(self, row):
+        metadata = {field: column[row] for field, column in self.columns.items()
+                    if column[row] is not None}
+        if self.dates[row]:
+            metadata["date"] = date.fromordinal(self.dates[row]).isoformat()
+        if self.type_names[self.types[row]]:
+            metadata["type"] = self.type_names[self.types[row]]
+        return metadata
+
+
+def _normalize(values):
+    vector = array("f", values)
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm:
+        vector = array("f", (v / norm for v in vector))
+    return vector
+
+
+def _date_ordinal(value):
+    return date.fromisoformat(value).toordinal() if value else 0
+
+
+def _write_at(path, writes):
+    """
+    Write each (offset, bytes) pair into the file at path, creating it if needed.
+    """
+    if not writes:
+        return
+    with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+        for offset, data in writes:
+            f.seek(offset)
+            f.write(data)
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+from utils.clients import get_json, get_s3_client
+from utils.rate_limiter import rate_limited_call
+from utils.tracing import span
+
+# Define logger
+logger = logging.getLogger()
+
+NASA_MANIFEST_URL = "https://api.nasa.gov/mars-photos/api/v1/manifests/curiosity"
+MANIFEST_FORMAT_VERSION = 1
+
+# Manifest kept across warm invocations
+_manifest = None
+
+
+class MissionManifest:
+    """
+    Index of the rover's mission manifest: one row per sol with photos, holding the sol,
+    its Earth date, its total photo count and a bitmask of the cameras that took photos.
+
+    Rows are stored in parallel arrays sorted by sol, plus a date-sorted view, so lookups
+    are binary searches and range queries are slices. The manifest does not break photo
+    counts down by camera, so camera data is presence only.
+    """
+
+    def __init__(self, sols, date_ordinals, total_photos, camera_masks, cameras, fetched_at):
+        self.sols = array("I", sols)
+        self.date_ordinals = array("I", date_ordinals)
+        self.total_photos = array("I", total_photos)
+        self.camera_masks = array("I", camera_masks)
+        self.cameras = list(cameras)
+        self.fetched_at = fetched_at
+        self._camera_bits = {name: 1 << i for i, name in enumerate(self.cameras)}
+        # Earth dates increase with sol, but sort explicitly rather than rely on it
+        order = sorted(range(len(self.sols)), key=lambda row: self.date_ordinals[row])
+        self._dates_sorted = array("I", (self.date_ordinals[row] for row in order))
+        self._date_rows = array("I", order)
+
+    @classmethod
+    def from_api_response(cls, data, fetched_at=None):
+        """
+        Build the index from the JSON returned by the NASA manifests endpoint.
+        """
+        photos = sorted(data["photo_manifest"]["photos"], key=lambda entry: entry["sol"])
+        cameras = sorted({camera for entry in photos for camera in entry["cameras"]})
+        bits = {name: 1 << i for i, name in enumerate(cameras)}
+        return cls(
+            sols=[entry["sol"] for entry in photos],
+            date_ordinals=[date.fromisoformat(entry["earth_date"]).toordinal()
+                           for entry in photos],
+            total_photos=[entry["total_photos"] for entry in photos],
+            camera_masks=[sum(bits[camera] for camera in entry["cameras"]) for entry in photos],
+            cameras=cameras,
+            fetched_at=fetched_at if fetched_at is not None else time.time(),
+        )
+
+    def __len__(self):
+        return len(self.sols)
+
+    # Serialisation: a one-line JSON header followed by the raw arrays
+
+    def to_bytes(self):
+        header = {"version": MANIFEST_FORMAT_VERSION, "rows": len(self), "cameras": self.cameras,
+                  "fetched_at": self.fetched_at, "itemsize": self.sols.itemsize}
+        return (json.dumps(header).encode("utf-8") + b"\n" + self.sols.tobytes()
+                + self.date_ordinals.tobytes() + self.total_photos.tobytes()
+                + self.camera_masks.tobytes())
+
+    @classmethod
+    def from_bytes(cls, payload):
+        header_line, _, body = bytes(payload).partition(b"\n")
+        header = json.loads(header_line)
+        if (header["version"] != MANIFEST_FORMAT_VERSION
+                or header["itemsize"] != array("I").itemsize):
+            raise ValueError("Unsupported mission manifest format.")
+        columns = []
+        width = header["rows"] * header["itemsize"]
+        for i in range(4):
+            column = array("I")
+            column.frombytes(body[i * width:(i + 1) * width])
+            columns.append(column)
+        return cls(*columns, cameras=header["cameras"], fetched_at=header["fetched_at"])
+
+    # Lookups
+
+    @property
+    def max_date(self):
+        return date.fromordinal(self._dates_sorted[-1]).isoformat() if len(self) else None
+
+    def covers(self, earth_date):
+        """
+        True if earth_date is on or before the last date in the manifest, i.e. a missing
+        date means the rover took no photos rather than that the manifest is out of date.
+        """
+        if not len(self):
+            return False
+        return date.fromisoformat(earth_date).toordinal() <= self._dates_sorted[-1]
+
+    def sol_for_earth_date(self, earth_date):
+        """
+        Return the sol whose photos are dated earth_date, or None if there are none.
+        """
+        ordinal = date.fromisoformat(earth_date).toordinal()
+        i = bisect_left(self._dates_sorted, ordinal)
+        if i < len(self._dates_sorted) and self._dates_sorted[i] == ordinal:
+            return self.sols[self._date_rows[i]]
+        return None
+
+    def _row_for_sol(self, sol):
+        i = bisect_left(self.sols, sol)
+        return i if i < len(self.sols) and self.sols[i] == sol else None
+
+    def photo_count(self, sol):
+        row = self._row_for_sol(sol)
+        return self.total_photos[row] if row is not None else 0
+
+    def cameras_for_sol(self, sol):
+        row = self._row_for_sol(sol)
+        if row is None:
+            return []
+        return [name for name, bit in self._camera_bits.items() if self.camera_masks[row] & bit]
+
+    def has_camera(self, sol, camera):
+        row = self._row_for_sol(sol)
+        bit = self._camera_bits.get(camera, 0)
+        return row is not None and bool(self.camera_masks[row] & bit)
+
+    def has_camera_on(self, earth_date, camera):
+        """
+        Return whether camera took photos on earth_date, or None if the date is past the end
+        of the manifest and so unknown.
+        """
+        if not self.covers(earth_date):
+            return None
+        sol = self.sol_for_earth_date(earth_date)
+        return sol is not None and self.has_camera(sol, camera)
+
+    def sols_with_camera(self, start_sol, end_sol, camera):
+        """
+        Return the sols in [start_sol, end_sol] on which camera took photos.
+        """
+        bit = self._camera_bits.get(camera, 0)
+        lo, hi = bisect_left(self.sols, start_sol), bisect_right(self.sols, end_sol)
+        return [self.sols[row] for row in range(lo, hi) if self.camera_masks[row] & bit]
+
+    def dates_with_camera(self, start_date, end_date, camera):
+        """
+        Return the Earth dates in [start_date, end_date] on which camera took photos.
+        """
+        bit = self._camera_bits.get(camera, 0)
+        lo = bisect_left(self._dates_sorted, date.fromisoformat(start_date).toordinal())
+        hi = bisect_right(self._dates_sorted, date.fromisoformat(end_date).toordinal())
+        return [date.fromordinal(self._dates_sorted[i]).isoformat() for i in range(lo, hi)
+                if self.camera_masks[self._date_rows[i]] & bit]
+
+
+def get_mission_manifest(NASA_API_KEY):
+    """
+    Return the mission manifest index, refreshed at most every MANIFEST_TTL_SECONDS.
+
+    The index is kept in memory, under MANIFEST_CACHE_DIR on disk and, when
+    NASA_CACHE_BUCKET is set, in S3, so most containers never call the manifest endpoint.
+    """
+    global _manifest
+    ttl = int(os.getenv("MANIFEST_TTL_SECONDS", 24 * 60 * 60))
+    if _manifest is not None and time.time() - _manifest.fetched_at < ttl:
+        return _manifest
+
+    path = os.path.join(os.getenv("MANIFEST_CACHE_DIR", "/tmp/nasa_cache"), "curiosity.manifest")
+    bucket = os.getenv("NASA_CACHE_BUCKET")
+    s3_key = "cache/mission-manifest/curiosity.manifest"
+
+    manifest = _load_from_disk(path)
+    if (manifest is None or time.time() - manifest.fetched_at >= ttl) and bucket:
+        s3_manifest = _load_from_s3(bucket, s3_key)
+        if s3_manifest is not None:
+            manifest = s3_manifest
+            _save_to_disk(path, manifest)
+    if manifest is None or time.time() - manifest.fetched_at >= ttl:
+        logger.info("Fetching the Curiosity mission manifest...")
+        with span("nasa.manifest"):
+            data = rate_limited_call("nasa", get_json, NASA_MANIFEST_URL,
+                                     params={"api_key": NASA_API_KEY}, retries=False)
+        manifest = MissionManifest.from_api_response(data)
+        _save_to_disk(path, manifest)
+        if bucket:
+            get_s3_client().put_object(Bucket=bucket, Key=s3_key, Body=manifest.to_bytes())
+        logger.info(f"Mission manifest has {len(manifest)} sols up to {manifest.max_date}.")
+
+    _manifest = manifest
+    return manifest
+
+
+def _load_from_disk(path):
+    try:
+        with open(path, "rb") as f:
+            return MissionManifest.from_bytes(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_to_disk(path, manifest):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(manifest.to_bytes())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not cache the mission manifest on disk: {e}")
+
+
+def _load_from_s3(bucket, key):
+    try:
+        response = get_s3_client().get_object(Bucket=bucket, Key=key)
+        return MissionManifest.from_bytes(response["Body"].read())
+    except Exception as e:
+        logger.info(f"No usable mission manifest in S3: {e}")
+        return None
@@ -0,0 +1,267 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from utils.clients import get_dynamodb_table
+from utils.tracing import span
+
+# Rate limits for the external APIs the pipeline calls.
+#
+# Each provider has a token bucket refilled at its rate (calls per second) up to its burst.
+# Calls go through rate_limited_call(provider, fn, ...), which waits for a token and retries
+# throttled calls and transient failures (5xx responses, dropped connections, timeouts) with
+# jittered exponential backoff, honouring Retry-After when the provider sends one. The
+# clients used for these calls do not retry themselves (see utils.clients). With
+# RATE_LIMIT_TABLE set, the buckets live in DynamoDB, so Lambdas running at the same time
+# share one budget per provider instead of each having their own.
+
+logger = logging.getLogger()
+
+# (calls per second, burst) per provider; override with RATE_LIMIT_<PROVIDER>="rate:burst",
+# where a rate of 0 disables the limit
+DEFAULT_RATE_LIMITS = {
+    "nasa": (1000 / 3600, 1000),  # api.nasa.gov allows 1000 requests per hour per key
+    "openai": (50, 50),
+    "rekognition": (50, 50),  # DetectLabels default quota in us-east-1
+    "pinecone": (100, 100),
+}
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))
+BACKOFF_BASE_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_BASE_SECONDS", 0.5))
+BACKOFF_MAX_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_MAX_SECONDS", 20))
+THROTTLING_CODES = {"ThrottlingException", "Throttling", "ThrottledException",
+                    "ProvisionedThroughputExceededException", "TooManyRequestsException",
+                    "RequestLimitExceeded", "SlowDown", "LimitExceededException"}
+RETRYABLE_STATUSES = {429, 503}
+TRANSIENT_STATUSES = {500, 502, 504}
+# Connection and timeout errors of requests, urllib3, botocore and the OpenAI SDK, by class
+# name so that none of them has to be imported
+TRANSIENT_ERRORS = {"ConnectionError", "Timeout", "TimeoutError", "ChunkedEncodingError",
+                    "ProtocolError", "MaxRetryError", "ReadTimeoutError",
+                    "ConnectTimeoutError", "APIConnectionError"}
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket holding up to capacity tokens, refilled at rate per second.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens):
+        """
+        Take tokens if available and return 0, or return the seconds until they will be.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are taken from the bucket. Returns the seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return waited
+            self._sleep(wait)
+            waited += wait
+
+
+class DynamoDBTokenBucket(TokenBucket):
+    """
+    Token bucket stored in a DynamoDB item, shared by every process using the same key.
+
+    Tokens are taken in leases of up to lease tokens per conditional write and handed out
+    locally, so a busy Lambda does not read and write the item for every call. Concurrent
+    writers are detected with a version attribute, as for backfill progress items.
+    """
+
+    def __init__(self, table_name, key, rate, capacity, lease=5, key_attribute="limit_key",
+                 clock=time.time, sleep=time.sleep):
+        super().__init__(rate, capacity, clock=clock, sleep=sleep)
+        self.table_name = table_name
+        self.key = key
+        self.lease = max(1, min(lease, int(capacity)))
+        self.key_attribute = key_attribute
+        self._leased = 0
+
+    def _take(self, tokens):
+        from botocore.exceptions import ClientError
+
+        with self._lock:
+            if self._leased >= tokens:
+                self._leased -= tokens
+                return 0
+            table = get_dynamodb_table(self.table_name)
+            item = table.get_item(Key={self.key_attribute: self.key},
+                                  ConsistentRead=True).get("Item")
+            now_ms = int(self._clock() * 1000)
+            version = int(item["version"]) if item else 0
+            if item:
+                elapsed = max(0, now_ms - int(item["updated_ms"])) / 1000
+                level = min(self.capacity,
+                            int(item["tokens_milli"]) / 1000 + elapsed * self.rate)
+            else:
+                level = self.capacity
+            needed = tokens - self._leased
+            if level < needed:
+                return (needed - level) / self.rate
+            taken = max(needed, min(self.lease, int(level)))
+            try:
+                table.put_item(
+                    Item={self.key_attribute: self.key,
+                          "tokens_milli": int((level - taken) * 1000),
+                          "updated_ms": now_ms, "version": version + 1},
+                    ConditionExpression="attribute_not_exists(version) OR version = :version",
+                    ExpressionAttributeValues={":version": version},
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                # Another process took tokens since the read; try again shortly
+                return random.uniform(0.005, 0.05)
+            self._leased += taken - tokens
+            return 0
+
+
+def parse_limit(value):
+    """
+    Parse "rate:burst" (or just "rate", with a burst of max(1, rate)) into (rate, burst).
+    """
+    rate, _, burst = value.partition(":")
+    rate = float(rate)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+
+def get_limiter(provider):
+    """
+    Return the shared token bucket for provider, or None if its rate limit is disabled.
+    """
+    limiter = _limiters.get(provider)
+    if limiter is None and provider not in _limiters:
+        with _lock:
+            if provider not in _limiters:
+                override = os.getenv(f"RATE_LIMIT_{provider.upper()}")
+                rate, burst = (parse_limit(override) if override
+                               else DEFAULT_RATE_LIMITS.get(provider, (0, 0)))
+                table_name = os.getenv("RATE_LIMIT_TABLE")
+                if rate <= 0:
+                    _limiters[provider] = None
+                elif table_name:
+                    _limiters[provider] = DynamoDBTokenBucket(
+                        table_name, provider, rate, burst,
+                        lease=int(os.getenv("RATE_LIMIT_LEASE", 5)))
+                else:
+                    _limiters[provider] = TokenBucket(rate, burst)
+            limiter = _limiters[provider]
+    return limiter
+
+
+def reset_limiters():
+    """
+    Drop all buckets so the next call creates them again from the environment.
+    """
+    with _lock:
+        _limiters.clear()
+
+
+def _error_response(error):
+    """
+    Return (status, headers) of the HTTP response behind an SDK or requests error.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        metadata = response.get("ResponseMetadata", {})
+        return metadata.get("HTTPStatusCode"), metadata.get("HTTPHeaders") or {}
+    status = (getattr(error, "status_code", None) or getattr(error, "status", None)
+              or getattr(response, "status_code", None))
+    headers = getattr(error, "headers", None) or getattr(response, "headers", None) or {}
+    return status, headers
+
+
+def is_throttled(error):
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in THROTTLING_CODES:
+        return True
+    status, _ = _error_response(error)
+    return status in RETRYABLE_STATUSES
+
+
+def is_transient(error):
+    status, _ = _error_response(error)
+    return status in TRANSIENT_STATUSES or any(cls.__name__ in TRANSIENT_ERRORS
+                                               for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error):
+    """
+    Return the delay the provider asked for in Retry-After (or OpenAI's retry-after-ms),
+    or None.
+    """
+    _, headers = _error_response(error)
+    headers = {str(name).lower(): value for name, value in dict(headers).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_seconds(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS, rng=random):
+    """
+    Full-jitter exponential backoff: a random delay up to base * 2**attempt, capped.
+    """
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def rate_limited_call(provider, fn, *args, max_retries=MAX_RETRIES, sleep=time.sleep,
+                      **kwargs):
+    """
+    Call fn(*args, **kwargs) once a token for provider is available, retrying throttled
+    calls and transient failures up to max_retries times. Other errors, and the last
+    retried error, are raised.
+    """
+    limiter = get_limiter(provider)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            with span(f"rate_limit.{provider}"):
+                limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not (is_throttled(e) or is_transient(e)):
+                raise
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = backoff_seconds(attempt)
+            attempt += 1
+            logger.warning(f"{provider} call failed, retrying in {delay:.2f} s "
+                           f"(attempt {attempt}/{max_retries}): {e}")
+            sleep(min(delay, BACKOFF_MAX_SECONDS))
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# Define logger
+logger = logging.getLogger()
+
+
+class ResponseCache:
+    """
+    Cache of JSON-serialisable API responses with up to three levels:
+
+    - memory: an LRU of serialised entries, kept for the lifetime of the container.
+    - disk: one file per entry under disk_dir (e.g. /tmp), shared by warm invocations.
+    - S3 (optional): one object per entry under s3_prefix, shared by all containers.
+
+    The memory and disk levels evict their least recently used entries once their total
+    size exceeds the configured number of bytes. Entries are never expired, so only cache
+    responses that do not change once published.
+    """
+
+    def __init__(self, namespace, memory_max_bytes=8 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=256 * 1024 * 1024, s3_client=None, s3_bucket=None,
+                 s3_prefix="cache"):
+        self.namespace = namespace
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = os.path.join(disk_dir, namespace) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.s3_client = s3_client if s3_bucket else None
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = f"{s3_prefix.strip('/')}/{namespace}"
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # Measured on first disk access
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if no level has it.
+        """
+        payload = self._memory_get(key)
+        if payload is None:
+            payload = self._disk_get(key)
+            if payload is None:
+                payload = self._s3_get(key)
+                if payload is None:
+                    return None
+                self._disk_put(key, payload)
+            self._memory_put(key, payload)
+        return json.loads(payload)
+
+    def put(self, key, value):
+        """
+        Store value under key in every level.
+        """
+        payload = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self._memory_put(key, payload)
+        self._disk_put(key, payload)
+        self._s3_put(key, payload)
+
+    # Memory level
+
+    def _memory_get(self, key):
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+            return payload
+
+    def _memory_put(self, key, payload):
+        if len(payload) > self.memory_max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = payload
+            self._memory_bytes += len(payload)
+            while self._memory_bytes > self.memory_max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    # Disk level
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # Mark as recently used for eviction
+            return payload
+        except OSError:
+            return None
+
+    def _disk_put(self, key, payload):
+        if not self.disk_dir or len(payload) > self.disk_max_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(entry.stat().st_size
+                                           for entry in os.scandir(self.disk_dir))
+                if os.path.exists(path):
+                    self._disk_bytes -= os.path.getsize(path)
+                # Write then rename so readers never see a partial entry
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+                self._disk_bytes += len(payload)
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._disk_evict()
+        except OSError as e:
+            logger.warning(f"Could not write cache entry '{key}' to disk: {e}")
+
+    def _disk_evict(self):
+        entries = sorted(os.scandir(self.disk_dir), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self._disk_bytes -= size
+
+    # S3 level
+
+    def _s3_key(self, key):
+        return f"{self.s3_prefix}/{key}.json"
+
+    def _s3_get(self, key):
+        if not self.s3_client:
+            return None
+        try:
+            response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self._s3_key(key))
+            return response["Body"].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read cache entry '{key}' from S3: {e}")
+            return None
+
+    def _s3_put(self, key, payload):
+        if not self.s3_client:
+            return
+        try:
+            self.s3_client.put_object(Bucket=self.s3_bucket, Key=self._s3_key(key), Body=payload,
+                                      ContentType="application/json")
+        except Exception as e:
+            logger.warning(f"Could not write cache entry '{key}' to S3: {e}")
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+from utils.clients import get_s3_client
+from utils.tracing import span
+
+# Define logger
+logger = logging.getLogger()
+
+STAGE_MANIFEST_BUCKET = os.getenv("STAGE_MANIFEST_BUCKET", "curiosity-data-1205")
+STAGE_MANIFEST_PREFIX = "manifests"
+# Manifests are checked before any record is read; larger ones are spooled to /tmp
+MANIFEST_SPOOL_MAX_BYTES = int(os.getenv("MANIFEST_SPOOL_MAX_BYTES", 8 * 1024 * 1024))
+
+
+def stage_manifests_enabled():
+    """
+    True if stages should hand their records to the next stage as an S3 manifest.
+    """
+    return os.getenv("STAGE_MANIFESTS", "false").lower() == "true"
+
+
+def write_manifest(records, earth_date, stage, compress=True):
+    """
+    Write records to S3 as JSON Lines (gzip-compressed by default).
+    Returns a reference to pass to the next stage: {"bucket", "key", "sha256", "count"}.
+
+    The key ends in the content's checksum, so executions handling the same date (reruns,
+    backfills, several simulations) never overwrite a manifest another one still reads.
+    """
+    buffer = io.BytesIO()
+    stream = gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) if compress else buffer
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        count += 1
+    if compress:
+        stream.close()
+    body = buffer.getvalue()
+    sha256 = hashlib.sha256(body).hexdigest()
+
+    key = (f"{STAGE_MANIFEST_PREFIX}/{earth_date}/{stage}-{sha256[:16]}.jsonl"
+           + (".gz" if compress else ""))
+    with span("s3.put_manifest"):
+        get_s3_client().put_object(Bucket=STAGE_MANIFEST_BUCKET, Key=key, Body=body,
+                                   ContentType="application/x-ndjson")
+    logger.info(f"Wrote {count} records ({len(body)} bytes) to s3://{STAGE_MANIFEST_BUCKET}/{key}")
+    return {"bucket": STAGE_MANIFEST_BUCKET, "key": key,
+            "sha256": sha256, "count": count}
+
+
+def iter_manifest(ref):
+    """
+    Stream the records of a manifest written by write_manifest.
+    Raises ValueError before yielding any record if the object does not match the checksum
+    in the reference. The object is kept as stored (compressed) while it is checked, and
+    records are decoded from it one at a time.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_MAX_BYTES)
+    with body:
+        sha256 = hashlib.sha256()
+        with span("s3.get_manifest"):
+            response = get_s3_client().get_object(Bucket=ref["bucket"], Key=ref["key"])
+            for chunk in iter(lambda: response["Body"].read(64 * 1024), b""):
+                sha256.update(chunk)
+                body.write(chunk)
+        if sha256.hexdigest() != ref["sha256"]:
+            raise ValueError(f"Checksum mismatch for manifest s3://{ref['bucket']}/{ref['key']}")
+        body.seek(0)
+        stream = gzip.GzipFile(fileobj=body, mode="rb") if ref["key"].endswith(".gz") else body
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def stage_result(records, earth_date, stage):
+    """
+    Build a stage's return value: the records inline in "body", or with stage manifests
+    enabled, a reference to them in "manifest".
+    """
+    if stage_manifests_enabled():
+        return {"statusCode": 200, "manifest": write_manifest(records, earth_date, stage)}
+    return {"statusCode": 200, "body": json.dumps(records)}
+
+
+def iter_stage_records(result):
+    """
+    Yield the records of a previous stage's result, inline or by manifest reference.
+    """
+    if "manifest" in result:
+        yield from iter_manifest(result["manifest"])
+    else:
+        yield from json.loads(result.get("body", "[]"))
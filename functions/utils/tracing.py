@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight timing for the pipeline Lambdas.
+#
+# A handler calls start_trace(stage) when it starts and finish_trace() when it is done;
+# helpers wrap their external calls in `with span("openai.chat"):`. Spans outside a trace
+# are not recorded, so helpers can be used on their own. finish_trace() prints the timings
+# as CloudWatch embedded metric format (EMF) records and returns a summary that handlers
+# store in the pipeline log.
+
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "CuriosityPipeline")
+MAX_EMF_VALUES = 100  # CloudWatch accepts at most 100 values per metric in one record
+
+# A Lambda container handles one invocation at a time, so one trace at a time is enough;
+# the tracer itself is thread-safe for spans recorded by worker threads.
+_current = None
+
+
+class Tracer:
+    """
+    Collect the duration and outcome of named spans for one stage of one date.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = time.perf_counter()
+        self._durations = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._durations.setdefault(name, []).append(elapsed_ms)
+                self._errors[name] = self._errors.get(name, 0) + failed
+
+    def summary(self):
+        """
+        Return {"total_ms", "spans": {name: {"count", "errors", "total_ms", "max_ms"}}}.
+        Spans run concurrently, so their totals can add up to more than total_ms.
+        """
+        with self._lock:
+            spans = {
+                name: {"count": len(durations), "errors": self._errors[name],
+                       "total_ms": round(sum(durations), 1), "max_ms": round(max(durations), 1)}
+                for name, durations in self._durations.items()
+            }
+        return {"total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "spans": spans}
+
+    def metric_records(self, earth_date=None):
+        """
+        Return the trace as EMF records: one for the stage, then one per span name.
+        """
+        timestamp = int(time.time() * 1000)
+        properties = {"EarthDate": earth_date} if earth_date else {}
+
+        def record(dimensions, metrics, values):
+            return {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, unit in metrics],
+                    }],
+                },
+                **dimensions, **properties, **values,
+            }
+
+        summary = self.summary()
+        records = [record({"Stage": self.stage}, [("StageDuration", "Milliseconds")],
+                          {"StageDuration": summary["total_ms"]})]
+        with self._lock:
+            spans = {name: list(durations) for name, durations in self._durations.items()}
+            errors = dict(self._errors)
+        for name, durations in spans.items():
+            records.append(record(
+                {"Stage": self.stage, "Span": name},
+                [("Duration", "Milliseconds"), ("Calls", "Count"), ("Errors", "Count")],
+                {"Duration": [round(d, 1) for d in durations[:MAX_EMF_VALUES]],
+                 "Calls": len(durations), "Errors": errors[name]},
+            ))
+        return records
+
+
+def start_trace(stage):
+    """
+    Start the trace of a handler invocation, replacing any unfinished one.
+    """
+    global _current
+    _current = Tracer(stage)
+    return _current
+
+
+def finish_trace(earth_date=None):
+    """
+    End the current trace, emit its metrics and return its summary (None without a trace).
+    Metrics are printed to stdout, where CloudWatch Logs extracts them; set EMIT_METRICS to
+    false to turn them off.
+    """
+    global _current
+    tracer, _current = _current, None
+    if tracer is None:
+        return None
+    if os.getenv("EMIT_METRICS", "true").lower() == "true":
+        for record in tracer.metric_records(earth_date):
+            print(json.dumps(record, separators=(",", ":")), flush=True)
+    return tracer.summary()
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as span name of the current trace, if there is one.
+    """
+    tracer = _current
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name):
+        yield
@@ -0,0 +1,277 @@
+"""
+Local pipeline runner that streams photos through every stage in one process.
+
+The Step Functions pipeline runs each stage for a whole date before the next one starts.
+Here each photo moves on as soon as it is ready:
+
+    fetch (per date) -> analyse -> generate -> upload -> embed (in batches)
+
+Stages are asyncio workers connected by bounded queues, so a slow stage holds back the
+stages feeding it instead of letting work pile up in memory. The blocking calls are the
+same functions the Lambdas use, run in a thread pool. Each date's results are written to
+the pipeline log as the Lambdas would, once all of its photos are done.
+
+Usage (from the repo root):
+    python -m runner.pipeline --start-date 2012-08-06 --end-date 2012-08-31
+    python -m runner.pipeline --start-date 2012-08-06 --end-date 2012-08-31 --fakes
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from functions.embed_memories_to_pinecone import app as embed_app
+from functions.fetch_images_with_metadata import app as fetch_app
+from functions.generate_memories_and_diary import app as generate_app
+from utils.clients import (get_openai_client, get_pinecone_index, get_rekognition_client,
+                           get_s3_client)
+from utils.ddb_utility import PipelineLogWriter
+
+logger = logging.getLogger()
+
+DEFAULT_WORKERS = {"fetch": 2, "analyse": 5, "generate": 5, "upload": 5}
+
+
+class DateProgress:
+    """
+    Outcome of one date's photos, complete once every photo has succeeded or failed.
+    """
+
+    def __init__(self, earth_date, sol, photos):
+        self.earth_date = earth_date
+        self.sol = sol
+        self.expected = photos
+        self.urls = []
+        self.embedded = []
+        self.errors = []
+
+    @property
+    def complete(self):
+        return len(self.embedded) + len(self.errors) >= self.expected
+
+
+class PipelineRunner:
+    """
+    Run the pipeline for many dates with per-photo streaming between stages.
+
+    workers sets the number of concurrent workers per stage (see DEFAULT_WORKERS),
+    queue_size bounds every queue between stages, and embeddings are upserted in batches
+    of up to embed_batch_size memories, waiting at most embed_linger_seconds to fill one.
+    """
+
+    def __init__(self, workers=None, queue_size=10, embed_batch_size=50,
+                 embed_linger_seconds=0.5, log_writer=None):
+        self.workers = {**DEFAULT_WORKERS, **(workers or {})}
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.embed_linger_seconds = embed_linger_seconds
+        self.log_writer = log_writer or PipelineLogWriter()
+        self.progress = {}
+        self.photo_latencies_ms = []
+
+    async def run(self, dates):
+        """
+        Process dates and return a summary of the run.
+        """
+        nasa_api_key = os.getenv("NASA_API_KEY")
+        if not nasa_api_key:
+            raise ValueError("NASA_API_KEY is not set in the environment variables.")
+
+        loop = asyncio.get_running_loop()
+        threads = sum(self.workers.values()) + 1
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._downloads = ThreadPoolExecutor(max_workers=self.workers["analyse"])
+        self._openai, self._rekognition = get_openai_client(), get_rekognition_client()
+        self._s3, self._index = get_s3_client(), get_pinecone_index(embed_app.INDEX_NAME)
+
+        queues = {name: asyncio.Queue(maxsize=self.queue_size)
+                  for name in ["dates", "analyse", "generate", "upload", "embed"]}
+        stages = [
+            ("fetch", queues["dates"], queues["analyse"],
+             lambda earth_date: self._fetch(earth_date, nasa_api_key)),
+            ("analyse", queues["analyse"], queues["generate"], self._analyse),
+            ("generate", queues["generate"], queues["upload"], self._generate),
+            ("upload", queues["upload"], queues["embed"], self._upload),
+        ]
+        tasks = [loop.create_task(self._worker(name, inbox, outbox, fn))
+                 for name, inbox, outbox, fn in stages for _ in range(self.workers[name])]
+        tasks.append(loop.create_task(self._embed_worker(queues["embed"])))
+
+        started = time.perf_counter()
+        try:
+            for earth_date in dates:
+                await queues["dates"].put(earth_date)
+            # Every stage puts its output downstream before marking its input done, so once
+            # a queue is drained, nothing more can arrive in the next one
+            for name in ["dates", "analyse", "generate", "upload", "embed"]:
+                await queues[name].join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._executor.shutdown()
+            self._downloads.shutdown()
+
+        return {
+            "dates": len(self.progress),
+            "photos": sum(progress.expected for progress in self.progress.values()),
+            "memories": sum(len(progress.urls) for progress in self.progress.values()),
+            "embedded": sum(len(progress.embedded) for progress in self.progress.values()),
+            "failed": sum(len(progress.errors) for progress in self.progress.values()),
+            "elapsed_s": time.perf_counter() - started,
+        }
+
+    async def _worker(self, name, inbox, outbox, fn):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await inbox.get()
+            try:
+                results = await loop.run_in_executor(self._executor, fn, item)
+                for result in results:
+                    await outbox.put(result)
+            except Exception as e:
+                if isinstance(item, dict):
+                    self._fail(item, e)
+                else:
+                    logger.error(f"Stage {name} failed for {item}: {e}")
+            finally:
+                inbox.task_done()
+
+    # Stages, run in worker threads; each returns the items for the next stage
+
+    def _fetch(self, earth_date, nasa_api_key):
+        try:
+            sol, photos = fetch_app.sample_photos(earth_date, nasa_api_key)
+            self.log_writer.record(earth_date, sol=sol, lambda_name=fetch_app.LAMBDA_NAME,
+                                   lambda_status="Success", lambda_output=photos)
+        except Exception as e:
+            self.log_writer.record(earth_date, lambda_name=fetch_app.LAMBDA_NAME,
+                                   lambda_status="Error", lambda_output=str(e))
+            self.log_writer.flush()
+            raise
+
+        photos, downloads = generate_app.select_distinct_photos(self._downloads, photos)
+        progress = DateProgress(earth_date, sol, len(photos))
+        self.progress[earth_date] = progress
+        if progress.complete:
+            self._finish_date(progress)
+        started = time.perf_counter()
+        return [{"earth_date": earth_date, "photo": photo, "download": download,
+                 "started": started} for photo, download in zip(photos, downloads)]
+
+    def _analyse(self, item):
+        generate_app.prepare_photo(item["photo"], self._rekognition, item.pop("download"))
+        return [item]
+
+    def _generate(self, item):
+        item["text"] = generate_app.generate_memory(self._openai, item["photo"])
+        return [item]
+
+    def _upload(self, item):
+        item["url"] = generate_app.upload_memory(self._s3, item["photo"], item["text"])
+        self.progress[item["earth_date"]].urls.append(item["url"])
+        return [item]
+
+    async def _embed_worker(self, inbox):
+        """
+        Upsert memories in batches: wait for one, then take whatever else arrives within
+        embed_linger_seconds, up to embed_batch_size.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await inbox.get()]
+            deadline = loop.time() + self.embed_linger_seconds
+            while len(batch) < self.embed_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(inbox.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                memories = [embed_app.memory_record(item["url"], item["text"]) for item in batch]
+                upserted = await loop.run_in_executor(
+                    self._executor, lambda: embed_app.upsert_memories(
+                        self._openai, self._index, memories,
+                        cache=embed_app.get_embedding_cache(), mirror=embed_app.get_local_index()))
+                for item, memory in zip(batch, memories):
+                    self._succeed(item, memory, memory["id"] in upserted)
+            except Exception as e:
+                for item in batch:
+                    self._fail(item, e)
+            finally:
+                for _ in batch:
+                    inbox.task_done()
+
+    # Per-date bookkeeping
+
+    def _succeed(self, item, memory, upserted):
+        self.photo_latencies_ms.append((time.perf_counter() - item["started"]) * 1000)
+        progress = self.progress[item["earth_date"]]
+        progress.embedded.append({"id": memory["id"], "date": memory["date"],
+                                  "type": memory["type"], "s3_url": memory["s3_url"],
+                                  "upserted": upserted})
+        if progress.complete:
+            self._finish_date(progress)
+
+    def _fail(self, item, error):
+        logger.error(f"Failed to process photo {item['photo'].get('id')}: {error}")
+        progress = self.progress[item["earth_date"]]
+        progress.errors.append({"id": item["photo"].get("id"), "error": str(error)})
+        if progress.complete:
+            self._finish_date(progress)
+
+    def _finish_date(self, progress):
+        if progress.errors and not progress.urls:
+            status = "Failed"
+        else:
+            status = "PartialSuccess" if progress.errors else "Success"
+        self.log_writer.record(progress.earth_date, lambda_name=generate_app.LAMBDA_NAME,
+                               lambda_status=status, lambda_output=progress.urls)
+        self.log_writer.record(progress.earth_date, lambda_name=embed_app.LAMBDA_NAME,
+                               lambda_status="Success" if progress.embedded else status,
+                               lambda_output=progress.embedded)
+        self.log_writer.flush()
+        logger.info(f"Finished {progress.earth_date}: {len(progress.embedded)} embedded, "
+                    f"{len(progress.errors)} failed.")
+
+
+def date_range(start_date, end_date):
+    current = date.fromisoformat(start_date)
+    while current <= date.fromisoformat(end_date):
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start-date", required=True)
+    parser.add_argument("--end-date", required=True)
+    for stage, count in DEFAULT_WORKERS.items():
+        parser.add_argument(f"--{stage}-workers", type=int, default=count)
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--embed-batch-size", type=int, default=50)
+    parser.add_argument("--fakes", action="store_true",
+                        help="run offline against the fake backends in tests/fakes.py")
+    args = parser.parse_args()
+
+    if args.fakes:
+        from tests.fakes import install_fakes
+        install_fakes()
+        os.environ.setdefault("NASA_API_KEY", "fake")
+
+    runner = PipelineRunner(
+        workers={stage: getattr(args, f"{stage}_workers") for stage in DEFAULT_WORKERS},
+        queue_size=args.queue_size, embed_batch_size=args.embed_batch_size)
+    summary = asyncio.run(runner.run(date_range(args.start_date, args.end_date)))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,677 @@
+"""
+In-process stand-ins for the services the pipeline calls: the NASA API and image hosts,
+S3, Rekognition, OpenAI, Pinecone, DynamoDB and Step Functions.
+
+Every fake records its calls, can add latency and can fail a fraction of calls, so the
+Lambdas can be tested and benchmarked offline and repeatably:
+
+    backends = install_fakes(latency_scale=0.001, error_rate=0.0)
+    ...  # call lambda_handler functions
+    print(backends.stats.counts)
+
+Photo lists come from a synthetic but realistic mission (FixtureMission): most sols have
+a few dozen NAVCAM photos, some have none, and a few busy sols have hundreds.
+"""
+import base64
+import hashlib
+import io
+import json
+import math
+import operator
+import os
+import random
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+# The Lambdas import shared code as 'utils', so register fakes in that module
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "functions"))
+if FUNCTIONS_DIR not in sys.path:
+    sys.path.append(FUNCTIONS_DIR)
+
+from utils import clients  # noqa: E402
+
+LANDING_DATE = date(2012, 8, 6)
+SOL_LENGTH_IN_DAYS = 1.027491252
+CAMERAS = ["CHEMCAM", "FHAZ", "MAHLI", "MARDI", "MAST", "NAVCAM", "RHAZ"]
+
+# Typical latency of each operation in seconds, scaled by install_fakes(latency_scale=...)
+TYPICAL_LATENCY = {
+    "nasa.photos": 0.35,
+    "nasa.manifest": 1.5,
+    "http.image": 0.25,
+    "s3.put_object": 0.04,
+    "s3.get_object": 0.03,
+    "s3.head_object": 0.02,
+    "rekognition.detect_labels": 0.45,
+    "openai.chat": 9.0,
+    "openai.embeddings": 0.25,
+    "pinecone.upsert": 0.08,
+    "pinecone.fetch": 0.05,
+    "pinecone.query": 0.06,
+    "pinecone.list": 0.05,
+    "pinecone.delete": 0.05,
+    "dynamodb.write": 0.01,
+    "dynamodb.read": 0.008,
+    "dynamodb.batch_read": 0.012,
+    "dynamodb.scan": 0.02,
+    "dynamodb.query": 0.01,
+    "stepfunctions.start_execution": 0.05,
+    "stepfunctions.describe_execution": 0.03,
+}
+
+
+class FakeServiceError(Exception):
+    """
+    Error injected by a fake backend.
+    """
+
+
+class CallStats:
+    """
+    Thread-safe counters of calls made to the fakes.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation):
+        with self._lock:
+            self.counts[operation] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+class FakeService:
+    """
+    Base class adding call counting, latency and error injection to a fake backend.
+    """
+
+    aws = False  # AWS fakes fail with a botocore ClientError, like the real clients
+
+    def __init__(self, stats, latency_scale=0.0, error_rate=0.0, seed=0):
+        self.stats = stats
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _call(self, operation):
+        self.stats.record(operation)
+        with self._rng_lock:
+            jitter = self._rng.uniform(0.5, 1.5)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+        latency = TYPICAL_LATENCY.get(operation, 0) * self.latency_scale * jitter
+        if latency:
+            time.sleep(latency)
+        if fail and self.aws:
+            raise _client_error_class("ServiceUnavailable")(
+                {"Error": {"Code": "ServiceUnavailable", "Message": "Injected failure"}},
+                operation)
+        if fail:
+            raise FakeServiceError(f"Injected failure in {operation}")
+
+
+# Fixture data
+
+class FixtureMission:
+    """
+    Deterministic synthetic mission: photo counts per sol and camera, and photo records
+    with NAVCAM stereo pairs (NLA_/NRA_ frames sharing a sequence id).
+    """
+
+    def __init__(self, max_sol=4000, seed=1205):
+        self.max_sol = max_sol
+        self.seed = seed
+
+    def earth_date(self, sol):
+        return (LANDING_DATE + timedelta(days=math.floor(sol * SOL_LENGTH_IN_DAYS))).isoformat()
+
+    def sol_for_date(self, earth_date):
+        for sol in range(max(0, math.floor((date.fromisoformat(earth_date) - LANDING_DATE).days
+                                           / SOL_LENGTH_IN_DAYS) - 1), self.max_sol + 1):
+            if self.earth_date(sol) == earth_date:
+                return sol
+            if self.earth_date(sol) > earth_date:
+                return None
+        return None
+
+    def camera_counts(self, sol):
+        rng = random.Random(self.seed * 100003 + sol)
+        if rng.random() < 0.08:  # Solar conjunctions, safe mode, ...
+            return {}
+        counts = {}
+        for camera in CAMERAS:
+            if rng.random() < 0.6:
+                counts[camera] = int(rng.lognormvariate(2.5, 1.0))
+        if rng.random() < 0.15:
+            counts["NAVCAM"] = 0
+        elif "NAVCAM" in counts and rng.random() < 0.05:
+            counts["NAVCAM"] *= 10  # Busy sols: traverses and panoramas
+        return {camera: count for camera, count in counts.items() if count}
+
+    def photos(self, sol, camera):
+        count = self.camera_counts(sol).get(camera, 0)
+        photos = []
+        for i in range(count):
+            photo_id = sol * 10000 + CAMERAS.index(camera) * 1000 + i
+            # NAVCAM frames come in left/right stereo pairs
+            eye = "L" if i % 2 == 0 else "R"
+            sequence = 397586928 + sol * 88775 + i // 2
+            filename = (f"N{eye}A_{sequence}EDR_F{sol:07d}AUT_04096M_.JPG"
+                        if camera == "NAVCAM" else f"{camera}_{photo_id}.JPG")
+            photos.append({
+                "id": photo_id,
+                "sol": sol,
+                "camera": {"name": camera},
+                "img_src": ("http://mars.jpl.nasa.gov/msl-raw-images/proj/msl/redops/ods/"
+                            f"surface/sol/{sol:05d}/opgs/edr/ncam/{filename}"),
+                "earth_date": self.earth_date(sol),
+                "rover": {"name": "Curiosity"},
+            })
+        return photos
+
+    def manifest(self):
+        photos = []
+        for sol in range(self.max_sol + 1):
+            counts = self.camera_counts(sol)
+            if counts:
+                photos.append({"sol": sol, "earth_date": self.earth_date(sol),
+                               "total_photos": sum(counts.values()),
+                               "cameras": sorted(counts)})
+        return {"photo_manifest": {"name": "Curiosity", "max_sol": self.max_sol,
+                                   "photos": photos}}
+
+    def dates_with_navcam(self, count, start_sol=1):
+        dates = []
+        sol = start_sol
+        while len(dates) < count and sol <= self.max_sol:
+            if self.camera_counts(sol).get("NAVCAM"):
+                dates.append(self.earth_date(sol))
+            sol += 1
+        return dates
+
+
+# HTTP: NASA API and image downloads
+
+class FakeResponse:
+    def __init__(self, payload=None, content=b"", status_code=200):
+        self._payload = payload
+        self.content = content
+        self.status_code = status_code
+        self.headers = {"Content-Length": str(len(content))} if content else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FakeServiceError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._payload
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FakeHttpSession(FakeService):
+    PAGE_SIZE = 25
+
+    def __init__(self, stats, mission, image_bytes=64 * 1024, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.mission = mission
+        self.image_bytes = image_bytes
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        params = params or {}
+        if "/manifests/" in url:
+            self._call("nasa.manifest")
+            return FakeResponse(self.mission.manifest())
+        if "/photos" in url and "api.nasa.gov" in url:
+            self._call("nasa.photos")
+            photos = []
+            cameras = [params["camera"].upper()] if params.get("camera") else CAMERAS
+            for camera in cameras:
+                photos.extend(self.mission.photos(int(params["sol"]), camera))
+            page = params.get("page")
+            if page:
+                photos = photos[(int(page) - 1) * self.PAGE_SIZE:int(page) * self.PAGE_SIZE]
+            return FakeResponse({"photos": photos})
+        self._call("http.image")
+        return FakeResponse(content=fake_image(url, self.image_bytes))
+
+
+def fake_image(url, size):
+    """
+    Deterministic image for url. With Pillow installed this is a JPEG of a random scene, and
+    the two frames of a stereo pair show the same scene slightly shifted; otherwise it is
+    size bytes of noise.
+    """
+    filename = url.rsplit("/", 1)[-1]
+    scene = re.sub(r"^N[LR]", "N", filename)
+    block = hashlib.sha256(scene.encode("utf-8")).digest()
+    try:
+        from PIL import Image
+    except ImportError:
+        return (block * (size // len(block) + 1))[:size]
+
+    rng = random.Random(block)
+    coarse = Image.new("L", (12, 12))
+    coarse.putdata([rng.randrange(256) for _ in range(144)])
+    image = coarse.resize((264, 256), Image.BICUBIC)
+    shift = 3 if filename.startswith("NR") else 0
+    output = io.BytesIO()
+    image.crop((shift, 0, shift + 256, 256)).save(output, format="JPEG", quality=80)
+    return output.getvalue()
+
+
+# AWS
+
+class FakeS3(FakeService):
+    aws = True
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.objects = {}
+        self.checksums = {}
+        self.exceptions = SimpleNamespace(NoSuchKey=_client_error_class("NoSuchKey"))
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, ChecksumSHA256=None, **kwargs):
+        self._call("s3.put_object")
+        body = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        checksum = base64.b64encode(hashlib.sha256(body).digest()).decode("ascii")
+        if ChecksumSHA256 and ChecksumSHA256 != checksum:
+            raise _client_error_class("BadDigest")(
+                {"Error": {"Code": "BadDigest", "Message": Key}}, "PutObject")
+        self.objects[(Bucket, Key)] = (body, dict(Metadata or {}))
+        if ChecksumSHA256:
+            self.checksums[(Bucket, Key)] = checksum
+        else:
+            self.checksums.pop((Bucket, Key), None)
+        return {"ETag": hashlib.md5(body).hexdigest()}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("s3.get_object")
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(
+                {"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        body, metadata = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body), "Metadata": metadata}
+
+    def head_object(self, Bucket, Key, ChecksumMode=None, **kwargs):
+        self._call("s3.head_object")
+        if (Bucket, Key) not in self.objects:
+            raise _client_error_class("ClientError")(
+                {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        body, metadata = self.objects[(Bucket, Key)]
+        response = {"ContentLength": len(body), "Metadata": metadata,
+                    "ETag": hashlib.md5(body).hexdigest()}
+        if ChecksumMode == "ENABLED" and (Bucket, Key) in self.checksums:
+            response["ChecksumSHA256"] = self.checksums[(Bucket, Key)]
+        return response
+
+
+class FakeRekognition(FakeService):
+    aws = True
+
+    LABELS = ["Rock", "Soil", "Sand", "Outdoors", "Nature", "Landscape", "Gravel", "Mountain",
+              "Desert", "Crater", "Slope", "Boulder"]
+
+    def detect_labels(self, Image, **kwargs):
+        self._call("rekognition.detect_labels")
+        data = Image.get("Bytes") or Image["S3Object"]["Name"].encode("utf-8")
+        digest = hashlib.sha256(bytes(data)).digest()
+        return {"Labels": [{"Name": name, "Confidence": 80 + digest[i] % 20}
+                           for i, name in enumerate(self.LABELS)]}
+
+
+class FakeStepFunctions(FakeService):
+    aws = True
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.executions = {}
+        self.initial_status = "SUCCEEDED"  # Set to "RUNNING" to finish executions by hand
+        self.exceptions = SimpleNamespace(
+            ExecutionAlreadyExists=_client_error_class("ExecutionAlreadyExists"))
+
+    def start_execution(self, stateMachineArn, input, name=None):
+        self._call("stepfunctions.start_execution")
+        name = name or f"run-{len(self.executions)}"
+        arn = stateMachineArn.replace(":stateMachine:", ":execution:") + f":{name}"
+        self.executions.setdefault(arn, {"input": input, "status": self.initial_status})
+        return {"executionArn": arn}
+
+    def describe_execution(self, executionArn):
+        self._call("stepfunctions.describe_execution")
+        return {"executionArn": executionArn, **self.executions[executionArn]}
+
+
+class FakeDynamoDBTable(FakeService):
+    """
+    Table supporting the item operations the pipeline uses. Update expressions may only
+    SET attributes, and condition expressions may only combine attribute_exists(a),
+    attribute_not_exists(a), a = :value, a <= :value and a >= :value with AND and OR.
+    Scans return every item.
+    Queries may only compare keys with =, >=, <= and BETWEEN.
+    """
+
+    aws = True
+
+    def __init__(self, stats, name, key_name, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.name = name
+        self.key_name = key_name
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def get_item(self, Key, **kwargs):
+        self._call("dynamodb.read")
+        item = self.items.get(Key[self.key_name])
+        return {"Item": json.loads(json.dumps(item, default=str))} if item else {}
+
+    def scan(self, **kwargs):
+        self._call("dynamodb.scan")
+        with self._lock:
+            items = list(self.items.values())
+        return {"Items": json.loads(json.dumps(items, default=str)), "Count": len(items)}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues,
+              ExpressionAttributeNames=None, Limit=None, ExclusiveStartKey=None, **kwargs):
+        """
+        Query the table or one of its indexes with key = :value, optionally followed by
+        AND key BETWEEN :a AND :b, key >= :a or key <= :a, in order of the table key.
+        """
+        self._call("dynamodb.query")
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues
+        tests = []
+        pattern = r"(\S+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)"
+        for field, low, high in re.findall(pattern, KeyConditionExpression):
+            tests.append((names.get(field, field),
+                          lambda v, low=values[low], high=values[high]: low <= v <= high))
+        for term in re.split(r"\s+AND\s+", re.sub(pattern, "", KeyConditionExpression)):
+            if not term.strip():
+                continue
+            field, op, value = re.fullmatch(r"\s*(\S+)\s*(=|>=|<=)\s*(:\w+)\s*", term).groups()
+            compare = {"=": operator.eq, ">=": operator.ge, "<=": operator.le}[op]
+            tests.append((names.get(field, field),
+                          lambda v, w=values[value], compare=compare: compare(v, w)))
+        with self._lock:
+            items = [item for key, item in sorted(self.items.items())
+                     if all(field in item and test(item[field]) for field, test in tests)]
+        if ExclusiveStartKey:
+            items = [item for item in items
+                     if item[self.key_name] > ExclusiveStartKey[self.key_name]]
+        response = {}
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            response["LastEvaluatedKey"] = {self.key_name: items[-1][self.key_name]}
+        response.update({"Items": json.loads(json.dumps(items, default=str)),
+                         "Count": len(items)})
+        return response
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None,
+                 ExpressionAttributeNames=None, **kwargs):
+        self._call("dynamodb.write")
+        with self._lock:
+            _check_condition(self.items.get(Item[self.key_name]), ConditionExpression,
+                             ExpressionAttributeNames, ExpressionAttributeValues)
+            self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, **kwargs):
+        self._call("dynamodb.write")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        assignments = UpdateExpression.strip()
+        if not assignments.upper().startswith("SET "):
+            raise ValueError(f"Unsupported update expression: {UpdateExpression}")
+        with self._lock:
+            _check_condition(self.items.get(Key[self.key_name]), ConditionExpression,
+                             names, values)
+            item = self.items.setdefault(Key[self.key_name], dict(Key))
+            for assignment in assignments[4:].split(","):
+                field, value = (part.strip() for part in assignment.split("="))
+                item[names.get(field, field)] = values[value]
+        return {}
+
+
+def _check_condition(item, condition, names, values):
+    """
+    Raise ConditionalCheckFailedException unless item (None if missing) meets condition.
+    """
+    if not condition:
+        return
+    item, names, values = item or {}, names or {}, values or {}
+
+    def holds(term):
+        term = term.strip()
+        match = re.fullmatch(r"attribute_(not_)?exists\((.+)\)", term)
+        if match:
+            exists = names.get(match.group(2), match.group(2)) in item
+            return not exists if match.group(1) else exists
+        field, op, value = re.fullmatch(r"([^\s<>=]+)\s*(<=|>=|=)\s*(\S+)", term).groups()
+        stored = item.get(names.get(field, field))
+        if op == "=":
+            return stored == values[value]
+        return stored is not None and (stored <= values[value] if op == "<="
+                                       else stored >= values[value])
+
+    if not any(all(holds(term) for term in re.split(r"\s+AND\s+", clause))
+               for clause in re.split(r"\s+OR\s+", condition)):
+        raise _client_error_class("ConditionalCheckFailedException")(
+            {"Error": {"Code": "ConditionalCheckFailedException",
+                       "Message": "The conditional request failed"}}, "ConditionCheck")
+
+
+class FakeDynamoDBResource:
+    KEYS = {"SimulatedDates": "simulation_id", "RateLimits": "limit_key"}
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        self.kwargs = kwargs
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeDynamoDBTable(self.stats, name,
+                                                  self.KEYS.get(name, "EarthDate"), **self.kwargs)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            if len(request["Keys"]) > 100:
+                raise ValueError("BatchGetItem accepts at most 100 keys.")
+            table = self.Table(name)
+            table._call("dynamodb.batch_read")
+            responses[name] = [table.items[key[table.key_name]] for key in request["Keys"]
+                               if key[table.key_name] in table.items]
+        return {"Responses": json.loads(json.dumps(responses, default=str)),
+                "UnprocessedKeys": {}}
+
+
+# OpenAI
+
+class FakeOpenAI(FakeService):
+    def __init__(self, stats, embedding_dims=1536, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.embedding_dims = embedding_dims
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _chat(self, model, messages, **kwargs):
+        self._call("openai.chat")
+        if len(messages) > 1:
+            # Batched request: one memory per image in the JSON user message
+            images = json.loads(messages[-1]["content"])
+            content = json.dumps({"memories": [
+                {"id": image["id"], "memory": _fake_memory(image["date"], image["sol"],
+                                                           image["url"], image["features"])}
+                for image in images]})
+        else:
+            prompt = messages[0]["content"]
+            fields = dict(re.findall(r"- (Date|Sol|URL|Features):\s*([^\n]*)", prompt)[-4:])
+            content = _fake_memory(fields.get("Date"), fields.get("Sol"), fields.get("URL"),
+                                   fields.get("Features"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def _embed(self, input, model):
+        self._call("openai.embeddings")
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=self.vector(text))
+                                     for i, text in enumerate(input)])
+
+    def vector(self, text):
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        values = [rng.gauss(0, 1) for _ in range(self.embedding_dims)]
+        norm = math.sqrt(sum(v * v for v in values))
+        return [v / norm for v in values]
+
+
+def _fake_memory(earth_date, sol, url, features):
+    return (f"Memory Entry:\n- Data:\n- Date: {earth_date}\n- Sol: {sol}\n- URL: {url}\n"
+            f"- Features: {features}\n- Interpretation:\n- Description: A Martian scene.\n"
+            "- Speculation: Ancient water.\n- Reflection: Onward.")
+
+
+# Pinecone
+
+class FakePineconeIndex(FakeService):
+    """
+    Index holding vectors as float32 arrays, so stored vectors barely show in peak memory.
+    """
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.vectors = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, **kwargs):
+        self._call("pinecone.upsert")
+        with self._lock:
+            for vector in vectors:
+                self.vectors[vector["id"]] = SimpleNamespace(
+                    id=vector["id"], values=array("f", vector["values"]),
+                    metadata=dict(vector.get("metadata") or {}))
+        return {"upserted_count": len(vectors)}
+
+    def update(self, id, set_metadata=None, values=None, **kwargs):
+        self._call("pinecone.update")
+        with self._lock:
+            if values is not None:
+                self.vectors[id].values = array("f", values)
+            self.vectors[id].metadata.update(set_metadata or {})
+        return {}
+
+    def list(self, limit=100, **kwargs):
+        with self._lock:
+            ids = sorted(self.vectors)
+        for start in range(0, len(ids), limit):
+            self._call("pinecone.list")
+            yield ids[start:start + limit]
+
+    def delete(self, ids, **kwargs):
+        self._call("pinecone.delete")
+        with self._lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+        return {}
+
+    def fetch(self, ids, **kwargs):
+        self._call("pinecone.fetch")
+        return SimpleNamespace(vectors={i: self.vectors[i] for i in ids if i in self.vectors})
+
+    def query(self, vector, top_k, filter=None, include_metadata=False, **kwargs):
+        self._call("pinecone.query")
+        matches = []
+        for stored in list(self.vectors.values()):
+            if filter and not _matches_filter(stored.metadata, filter):
+                continue
+            score = sum(a * b for a, b in zip(vector, stored.values))
+            matches.append(SimpleNamespace(id=stored.id, score=score,
+                                           metadata=stored.metadata if include_metadata else None))
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return SimpleNamespace(matches=matches[:top_k])
+
+
+def _matches_filter(metadata, metadata_filter):
+    for field, condition in metadata_filter.items():
+        if field == "$and":
+            if not all(_matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            ok = {
+                "$eq": lambda: value == operand,
+                "$ne": lambda: value != operand,
+                "$in": lambda: value in operand,
+                "$nin": lambda: value not in operand,
+                "$gt": lambda: value is not None and value > operand,
+                "$gte": lambda: value is not None and value >= operand,
+                "$lt": lambda: value is not None and value < operand,
+                "$lte": lambda: value is not None and value <= operand,
+            }[op]()
+            if not ok:
+                return False
+    return True
+
+
+def _client_error_class(code):
+    from botocore.exceptions import ClientError
+    return type(code, (ClientError,), {})
+
+
+# Installation
+
+class FakeBackends(SimpleNamespace):
+    """
+    The installed fakes, plus the shared call statistics.
+    """
+
+
+def install_fakes(latency_scale=0.0, error_rate=0.0, seed=0, mission=None,
+                  image_bytes=64 * 1024, embedding_dims=1536):
+    """
+    Register fakes for every client in utils.clients and return them.
+
+    latency_scale multiplies TYPICAL_LATENCY (0 for no latency, 1 for realistic latency);
+    error_rate is the fraction of calls to each backend that raise FakeServiceError.
+    """
+    stats = CallStats()
+    options = {"latency_scale": latency_scale, "error_rate": error_rate, "seed": seed}
+    mission = mission or FixtureMission()
+    backends = FakeBackends(
+        stats=stats,
+        mission=mission,
+        http_session=FakeHttpSession(stats, mission, image_bytes=image_bytes, **options),
+        s3=FakeS3(stats, **options),
+        rekognition=FakeRekognition(stats, **options),
+        stepfunctions=FakeStepFunctions(stats, **options),
+        dynamodb_resource=FakeDynamoDBResource(stats, **options),
+        openai=FakeOpenAI(stats, embedding_dims=embedding_dims, **options),
+        pinecone_index=FakePineconeIndex(stats, **options),
+    )
+    clients.reset_clients()
+    for name in ["http_session", "s3", "rekognition", "stepfunctions", "dynamodb_resource",
+                 "openai"]:
+        clients.register_client(name, getattr(backends, name))
+    clients.register_client("http_session:no_retries", backends.http_session)
+    clients.register_client("pinecone_index:rover-memories", backends.pinecone_index)
+    return backends
@@ -0,0 +1,114 @@
+from tests.fakes import install_fakes
+from utils import clients, ddb_utility
+from utils.ddb_utility import PipelineLogWriter, update_pipeline_log, wait_for_pipeline_log
+from datetime import datetime
+import json
+import pytest
+
+
+@pytest.fixture
+def backends():
+    backends = install_fakes()
+    yield backends
+    clients.reset_clients()
+
+
+def test_writer_buffers_updates_into_one_write_per_date(backends):
+    writer = PipelineLogWriter()
+    writer.record("2012-08-06", sol=0, lambda_name="Lambda1: FetchImages",
+                  lambda_status="Success", lambda_output=[{"id": 1, "score": 0.5}])
+    writer.record("2012-08-06", lambda_name="Lambda2: GenerateMemories",
+                  lambda_status="Success", lambda_output=[])
+    writer.record("2012-08-07", lambda_name="Lambda1: FetchImages", lambda_status="Error",
+                  lambda_output="Timeout")
+
+    assert backends.stats.counts["dynamodb.write"] == 0
+    assert writer.flush() == []
+
+    assert backends.stats.counts["dynamodb.write"] == 2
+    log = backends.dynamodb_resource.Table("PipelineTransactionLog").items
+    assert log["2012-08-06"]["sol"] == 0
+    assert log["2012-08-06"]["Lambda1__FetchImages"]["output"][0]["score"] == 0.5
+    assert log["2012-08-06"]["last_stage"] == "Lambda2__GenerateMemories"
+    assert log["2012-08-07"]["pipeline_status"] == "FAILED"
+    assert writer.flush() == []
+    assert backends.stats.counts["dynamodb.write"] == 2
+
+
+def test_large_outputs_are_offloaded_to_s3(backends, monkeypatch):
+    monkeypatch.setattr(ddb_utility, "LOG_INLINE_MAX_BYTES", 100)
+    photos = [{"id": i, "img_src": f"https://mars.nasa.gov/{i}.jpg"} for i in range(10)]
+    writer = PipelineLogWriter()
+    writer.record("2012-08-06", lambda_name="Lambda1: FetchImages", lambda_status="Success",
+                  lambda_output=photos)
+    writer.record("2012-08-07", lambda_name="Lambda1: FetchImages", lambda_status="Success",
+                  lambda_output=photos[:1])
+    writer.flush()
+
+    log = backends.dynamodb_resource.Table("PipelineTransactionLog").items
+    pointer = log["2012-08-06"]["Lambda1__FetchImages"]["output"]
+    key = "pipeline-logs/2012-08-06/Lambda1__FetchImages.json"
+    assert pointer["s3_url"] == f"https://curiosity-data-1205.s3.amazonaws.com/{key}"
+    assert pointer["items"] == 10
+    body, _ = backends.s3.objects[("curiosity-data-1205", key)]
+    assert json.loads(body) == photos and pointer["bytes"] == len(body)
+    assert log["2012-08-07"]["Lambda1__FetchImages"]["output"] == photos[:1]
+
+
+def test_update_pipeline_log_writes_in_background_without_raising(backends):
+    update_pipeline_log("2012-08-06", lambda_name="Lambda1: FetchImages",
+                        lambda_status="Success", lambda_output={"at": datetime(2012, 8, 6)})
+    update_pipeline_log("2012-08-06", lambda_name="Lambda2: GenerateMemories",
+                        lambda_status="Success", lambda_output={1, 2})
+
+    assert wait_for_pipeline_log() == []
+    item = backends.dynamodb_resource.Table("PipelineTransactionLog").items["2012-08-06"]
+    assert item["Lambda1__FetchImages"]["output"] == {"at": "2012-08-06 00:00:00"}
+    assert item["Lambda2__GenerateMemories"]["output"] == "{1, 2}"
+    assert wait_for_pipeline_log() == []
+
+
+def test_late_update_from_an_earlier_stage_keeps_the_status(backends):
+    scheduler_writer = PipelineLogWriter()
+    scheduler_writer.record(
+        "2012-08-06", lambda_name="Lambda0: Daily Scheduler", lambda_status="SUCCESS",
+        lambda_output="arn:aws:states:us-east-1:123456789012:execution:Mars:mvp")
+    writer = PipelineLogWriter()
+    for lambda_name in ["Lambda1: FetchImages", "Lambda2: GenerateMemories",
+                        "Lambda3: EmbedToPinecone"]:
+        writer.record("2012-08-06", lambda_name=lambda_name, lambda_status="Success")
+        writer.flush()
+    assert scheduler_writer.flush() == []
+
+    item = backends.dynamodb_resource.Table("PipelineTransactionLog").items["2012-08-06"]
+    assert item["pipeline_status"] == "COMPLETE"
+    assert item["last_stage"] == "Lambda3__EmbedToPinecone"
+    assert item["Lambda0__Daily_Scheduler"]["status"] == "SUCCESS"
+
+    writer.record("2012-08-06", lambda_name="Lambda3: EmbedToPinecone", lambda_status="Failed")
+    writer.flush()
+    assert item["pipeline_status"] == "FAILED"
+
+
+@pytest.mark.parametrize("lambda_name, lambda_status", [
+    ("Lambda1: FetchImages", "Error"),
+    ("Lambda2: GenerateMemories", "Failed"),
+])
+def test_failed_rerun_of_a_complete_date_is_incomplete(backends, lambda_name, lambda_status):
+    writer = PipelineLogWriter()
+    for name in ["Lambda1: FetchImages", "Lambda2: GenerateMemories",
+                 "Lambda3: EmbedToPinecone"]:
+        writer.record("2012-08-06", lambda_name=name, lambda_status="Success")
+        writer.flush()
+    item = backends.dynamodb_resource.Table("PipelineTransactionLog").items["2012-08-06"]
+    assert item["pipeline_status"] == "COMPLETE"
+
+    writer.record("2012-08-06", lambda_name="Lambda1: FetchImages", lambda_status="Success")
+    writer.flush()
+    assert (item["pipeline_status"], item["last_stage"]) == ("IN_PROGRESS",
+                                                             "Lambda1__FetchImages")
+
+    writer.record("2012-08-06", lambda_name=lambda_name, lambda_status=lambda_status)
+    assert writer.flush() == []
+    assert item["pipeline_status"] == "FAILED"
+    assert list(ddb_utility.iter_incomplete_dates("2012-08-01", "2012-08-31")) == ["2012-08-06"]
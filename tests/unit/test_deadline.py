@@ -0,0 +1,53 @@
+import tests.fakes  # noqa: F401 (puts the functions directory on sys.path for utils)
+from utils.deadline import CostModel, WorkBudget
+from types import SimpleNamespace
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def lambda_context(remaining_ms):
+    return SimpleNamespace(get_remaining_time_in_millis=lambda: remaining_ms[0])
+
+
+def test_cost_model_tracks_recent_timings():
+    model = CostModel(initial_ms=20000)
+    model.observe(1000)
+    assert model.predict_ms() == pytest.approx(2000)
+
+    for _ in range(20):
+        model.observe(3000)
+    assert 2900 < model.mean_ms < 3000
+    assert model.predict_ms() < 3500
+
+    restored = CostModel(initial_ms=20000)
+    restored.load(model.state())
+    assert restored.samples == 21 and restored.mean_ms == round(model.mean_ms)
+
+
+def test_budget_stops_starting_work_before_the_deadline():
+    clock, remaining = FakeClock(), [60000]
+    budget = WorkBudget(lambda_context(remaining), CostModel(initial_ms=10000), margin_ms=5000,
+                        clock=clock)
+
+    token = budget.start()
+    clock.now, remaining[0] = 8, 52000
+    budget.finish(token)  # 8 s, so the next photo is predicted to need 16 s
+    assert budget.start() is not None
+    remaining[0] = 20000
+    assert budget.start() is None
+    remaining[0] = 60000
+    assert budget.start() is None  # Deferral is final for the invocation
+    assert budget.deferred == 2
+
+
+def test_budget_without_context_admits_everything():
+    budget = WorkBudget(None, CostModel(initial_ms=10 ** 9))
+
+    assert all(budget.start() is not None for _ in range(5))
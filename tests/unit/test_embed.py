@@ -19,3 +19,99 @@ def test_embed_memories():
 
     assert data["statusCode"] == 200
 
+
+def test_chunk_texts():
+    texts = ["a" * 10, "b" * 10, "c" * 30, "d" * 5]
+
+    chunks = list(app.chunk_texts(texts, batch_size=2, max_chars=25))
+
+    assert chunks == [["a" * 10, "b" * 10], ["c" * 30], ["d" * 5]]
+
+
+def test_embedding_cache_round_trip():
+    from utils.embedding_cache import EmbeddingCache, content_hash
+
+    cache = EmbeddingCache(":memory:")
+    key = content_hash("Memory Entry", app.EMBEDDING_MODEL)
+    cache.put_many({key: [0.5, -0.25]})
+
+    assert cache.get_many([key, "missing"]) == {key: [0.5, -0.25]}
+    assert app.memory_id_for_url("s3://a") == app.memory_id_for_url("s3://a")
+
+
+def test_upsert_memories_adds_missing_date_num():
+    from tests.fakes import install_fakes
+    from utils import clients
+
+    backends = install_fakes(embedding_dims=8)
+    memory = {"id": "memory-1", "text": "Memory Entry", "date": "2012-08-07",
+              "type": "memory", "s3_url": "https://curiosity-data-1205.s3.amazonaws.com/m.txt"}
+    try:
+        app.upsert_memories(backends.openai, backends.pinecone_index, [memory])
+        stored = backends.pinecone_index.vectors["memory-1"].metadata
+        assert stored["date_num"] == 20120807
+        del stored["date_num"]
+
+        upserted = app.upsert_memories(backends.openai, backends.pinecone_index, [memory])
+
+        assert upserted == set()
+        assert stored["date_num"] == 20120807
+        assert backends.stats.counts["openai.embeddings"] == 1
+    finally:
+        clients.reset_clients()
+
+
+def test_load_memories_reads_only_texts_not_inlined():
+    from tests.fakes import install_fakes
+    from utils import clients
+
+    backends = install_fakes()
+    base = "https://curiosity-data-1205.s3.amazonaws.com/memories/2012-08-07"
+    for i in range(3):
+        backends.s3.put_object(Bucket="curiosity-data-1205",
+                               Key=f"memories/2012-08-07/image{i}_memory.txt",
+                               Body=f"Stored\nmemory {i}".encode("utf-8"))
+    backends.stats.reset()
+    try:
+        memories = app.load_memories([
+            {"s3_url": f"{base}/image0_memory.txt", "text": "Inline memory 0"},
+            {"s3_url": f"{base}/image1_memory.txt"},
+            f"{base}/image2_memory.txt",
+        ])
+
+        assert [memory["text"] for memory in memories] == [
+            "Inline memory 0", "Stored memory 1", "Stored memory 2"]
+        assert [memory["type"] for memory in memories] == ["memory"] * 3
+        assert backends.stats.counts["s3.get_object"] == 2
+    finally:
+        clients.reset_clients()
+
+
+def test_migrate_legacy_vectors_moves_random_ids_to_url_ids():
+    from tests.fakes import install_fakes
+    from utils import clients
+
+    backends = install_fakes(embedding_dims=4)
+    index = backends.pinecone_index
+    base = "https://curiosity-data-1205.s3.amazonaws.com/memories/2012-08-07"
+    index.upsert([
+        {"id": "random-1", "values": [1, 0, 0, 0],
+         "metadata": {"date": "2012-08-07", "s3_url": f"{base}/image1_memory.txt"}},
+        {"id": "random-2", "values": [0, 1, 0, 0],
+         "metadata": {"date": "2012-08-07", "s3_url": f"{base}/image2_memory.txt"}},
+        {"id": app.memory_id_for_url(f"{base}/image2_memory.txt"), "values": [0, 0, 1, 0],
+         "metadata": {"date": "2012-08-07", "date_num": 20120807,
+                      "s3_url": f"{base}/image2_memory.txt"}},
+    ])
+    try:
+        assert app.migrate_legacy_vectors(index) == 2
+
+        assert sorted(index.vectors) == sorted(app.memory_id_for_url(f"{base}/image{i}_memory.txt")
+                                               for i in [1, 2])
+        moved = index.vectors[app.memory_id_for_url(f"{base}/image1_memory.txt")]
+        assert list(moved.values) == [1, 0, 0, 0] and moved.metadata["date_num"] == 20120807
+        assert list(index.vectors[app.memory_id_for_url(f"{base}/image2_memory.txt")].values) \
+            == [0, 0, 1, 0]
+        assert app.migrate_legacy_vectors(index) == 0
+    finally:
+        clients.reset_clients()
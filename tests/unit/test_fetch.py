@@ -1,3 +1,6 @@
+from collections import Counter
+import random
+
 from functions.fetch_images_with_metadata import app
 
 
@@ -8,3 +11,69 @@ def test_fetch_images():
 
     assert data["statusCode"] == 200
 
+
+def test_reservoir_sample_is_uniform():
+    rng = random.Random(0)
+    counts = Counter()
+    for _ in range(4000):
+        sample, seen = app.reservoir_sample(iter(range(20)), 5, rng)
+        assert seen == 20 and len(set(sample)) == 5
+        counts.update(sample)
+
+    # Each item should be picked about 4000 * 5 / 20 = 1000 times
+    assert all(850 < counts[item] < 1150 for item in range(20))
+
+
+def test_reservoir_sample_short_population():
+    sample, seen = app.reservoir_sample(iter([1, 2]), 5)
+
+    assert sorted(sample) == [1, 2] and seen == 2
+
+
+def test_mission_manifest_lookups():
+    from utils.mission_manifest import MissionManifest
+
+    manifest = MissionManifest.from_api_response({"photo_manifest": {"photos": [
+        {"sol": 0, "earth_date": "2012-08-06", "total_photos": 3, "cameras": ["FHAZ"]},
+        {"sol": 1, "earth_date": "2012-08-07", "total_photos": 9, "cameras": ["FHAZ", "NAVCAM"]},
+        {"sol": 3, "earth_date": "2012-08-09", "total_photos": 4, "cameras": ["NAVCAM"]},
+    ]}})
+    manifest = MissionManifest.from_bytes(manifest.to_bytes())
+
+    assert manifest.sol_for_earth_date("2012-08-09") == 3
+    assert manifest.has_camera_on("2012-08-06", "NAVCAM") is False
+    assert manifest.has_camera_on("2012-08-08", "NAVCAM") is False
+    assert manifest.has_camera_on("2012-08-10", "NAVCAM") is None
+    assert manifest.dates_with_camera("2012-08-01", "2012-08-31", "NAVCAM") == [
+        "2012-08-07", "2012-08-09"]
+    assert manifest.sols_with_camera(0, 2, "NAVCAM") == [1]
+    assert manifest.photo_count(1) == 9
+
+
+def test_only_full_photo_pages_are_cached_for_good(monkeypatch):
+    from utils.response_cache import ResponseCache
+    from utils.ttl_cache import TTLCache
+
+    pages = {1: app.NASA_PAGE_SIZE, 2: 3}
+    requests = []
+
+    def get_json(url, params=None, **kwargs):
+        requests.append(params["page"])
+        return {"photos": [{"id": i, "img_src": f"https://mars/{params['page']}-{i}.JPG"}
+                           for i in range(pages[params["page"]])]}
+
+    cache = ResponseCache("nasa-photos")
+    monkeypatch.setattr(app, "get_json", get_json)
+    monkeypatch.setattr(app, "get_photo_cache", lambda: cache)
+    monkeypatch.setattr(app, "_short_page_cache", TTLCache())
+
+    assert len(app.fetch_images_by_sol(100, "key")) == app.NASA_PAGE_SIZE + 3
+    assert cache.get("curiosity/sol-100/navcam/page-1") is not None
+    assert cache.get("curiosity/sol-100/navcam/page-2") is None
+    app.fetch_images_by_sol(100, "key")
+    assert requests == [1, 2]  # The short page is still fresh in memory
+
+    monkeypatch.setattr(app, "_short_page_cache", TTLCache())  # As if it had expired
+    pages[2] = 4
+    assert len(app.fetch_images_by_sol(100, "key")) == app.NASA_PAGE_SIZE + 4
+    assert requests == [1, 2, 2]
@@ -1,5 +1,6 @@
 from functions.generate_memories_and_diary import app
 import json
+import pytest
 
 
 def test_generate_memories():
@@ -14,3 +15,65 @@ def test_generate_memories():
     data = app.lambda_handler(input_payload, "")
 
     assert data["statusCode"] == 200
+
+
+def test_parse_batch_memories():
+    photos = [{"id": 2674}, {"id": 2097}]
+    content = json.dumps({"memories": [{"id": 2097, "memory": "Memory Entry: B"},
+                                       {"id": 2674, "memory": "Memory Entry: A"}]})
+
+    assert app.parse_batch_memories(content, photos) == ["Memory Entry: A", "Memory Entry: B"]
+    with pytest.raises(ValueError):
+        app.parse_batch_memories(json.dumps({"memories": [{"id": 2674, "memory": "A"}]}), photos)
+
+
+def test_select_distinct_photos_refills_from_alternates(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from tests.fakes import fake_image
+
+    base = "http://mars.jpl.nasa.gov/msl-raw-images/proj/msl/redops/ods/surface/sol/00001/"
+    photos = [
+        {"id": 1, "img_src": base + "A.JPG"},
+        {"id": 2, "img_src": base + "NLA_397586928EDR_F0010008AUT_04096M_.JPG"},
+        {"id": 3, "img_src": base + "NRA_397586928EDR_F0010008AUT_04096M_.JPG"},
+        {"id": 4, "img_src": base + "A-copy.JPG"},
+        {"id": 5, "img_src": base + "C.JPG", "alternate": True},
+        {"id": 6, "img_src": base + "D.JPG", "alternate": True},
+        {"id": 7, "img_src": base + "E.JPG", "alternate": True},
+    ]
+    downloaded = []
+
+    def download_image(img_src):
+        downloaded.append(img_src)
+        return fake_image(img_src.replace("-copy", ""), 0)
+
+    monkeypatch.setattr(app, "download_image", download_image)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        selected, downloads = app.select_distinct_photos(executor, photos)
+
+    # The stereo partner is never downloaded and the copy of A is replaced by alternates
+    assert [photo["id"] for photo in selected] == [1, 2, 5, 6]
+    assert photos[2]["img_src"] not in downloaded
+    assert all(download.result() for download in downloads)
+
+
+def test_labels_are_cached_with_confidences(tmp_path, monkeypatch):
+    from tests.fakes import fake_image, install_fakes
+    from utils import clients
+
+    monkeypatch.setenv("LABEL_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "_label_cache", None)
+    monkeypatch.setattr(app, "REKOGNITION_S3_IMAGES", True)
+    backends = install_fakes()
+    image = fake_image("rock", 0)
+    try:
+        strict = app.analyze_image(image, photo_id=7)
+        loose = app.analyze_image(image, photo_id=7, min_confidence=85)
+        app.analyze_image(image, photo_id=8)
+
+        assert set(strict.split(",")) < set(loose.split(","))
+        # One Rekognition call per photo id, and the image is stored in S3 once
+        assert backends.stats.counts["rekognition.detect_labels"] == 2
+        assert backends.stats.counts["s3.put_object"] == 1
+    finally:
+        clients.reset_clients()
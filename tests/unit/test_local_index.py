@@ -0,0 +1,66 @@
+from functions.utils.local_index import LocalVectorIndex
+import pytest
+
+
+@pytest.fixture(params=["numpy", "python"])
+def use_numpy(request):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    return request.param == "numpy"
+
+
+def _vector(i, date, memory_type="memory"):
+    values = [0.0] * 4
+    values[i % 4] = 1.0
+    values[(i + 1) % 4] = 0.1 * i
+    return {"id": f"memory-{i}", "values": values,
+            "metadata": {"date": date, "type": memory_type, "s3_url": f"s3://bucket/{i}.txt"}}
+
+
+def test_search_ranks_by_cosine_and_filters(tmp_path, use_numpy):
+    index = LocalVectorIndex(str(tmp_path), use_numpy=use_numpy)
+    index.upsert([_vector(0, "2012-08-07"), _vector(4, "2012-08-08", "diary"),
+                  _vector(1, "2012-08-09"), _vector(8, "2012-08-10")])
+
+    hits = index.search([1.0, 0.0, 0.0, 0.0], top_k=2)
+    assert [hit["id"] for hit in hits] == ["memory-0", "memory-4"]
+    assert abs(hits[0]["score"] - 1.0) < 1e-6
+    assert hits[0]["metadata"] == {"date": "2012-08-07", "type": "memory",
+                                   "s3_url": "s3://bucket/0.txt"}
+
+    hits = index.search([1.0, 0.0, 0.0, 0.0], top_k=5, start_date="2012-08-08",
+                        types=["memory"])
+    assert [hit["id"] for hit in hits] == ["memory-8", "memory-1"]
+
+
+def test_upserts_replace_and_persist(tmp_path, use_numpy):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([_vector(0, "2012-08-07"), _vector(1, "2012-08-08")])
+    index.upsert([{**_vector(1, "2012-08-08"), "values": [1.0, 0.0, 0.0, 0.0]}])
+
+    reopened = LocalVectorIndex(str(tmp_path), use_numpy=use_numpy)
+    assert len(reopened) == 2
+    hits = reopened.search([1.0, 0.0, 0.0, 0.0], top_k=2)
+    assert {hit["id"] for hit in hits} == {"memory-0", "memory-1"}
+    assert all(abs(hit["score"] - 1.0) < 1e-6 for hit in hits)
+
+
+def test_numpy_and_python_searches_agree(tmp_path):
+    import random
+
+    pytest.importorskip("numpy")
+    rng = random.Random(0)
+    LocalVectorIndex(str(tmp_path)).upsert([
+        {"id": f"memory-{i}", "values": [rng.gauss(0, 1) for _ in range(16)],
+         "metadata": {"date": f"2012-08-{i % 28 + 1:02d}",
+                      "type": "diary" if i % 5 == 0 else "memory"}}
+        for i in range(200)])
+    query = [rng.gauss(0, 1) for _ in range(16)]
+    filters = {"start_date": "2012-08-05", "end_date": "2012-08-20", "types": ["memory"]}
+
+    for kwargs in [{}, filters]:
+        numpy_hits, python_hits = (
+            LocalVectorIndex(str(tmp_path), use_numpy=use_numpy).search(query, 10, **kwargs)
+            for use_numpy in [True, False])
+        assert [hit["id"] for hit in numpy_hits] == [hit["id"] for hit in python_hits]
+        assert all(abs(a["score"] - b["score"]) < 1e-5 for a, b in zip(numpy_hits, python_hits))
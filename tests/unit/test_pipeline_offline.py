@@ -0,0 +1,155 @@
+from functions.embed_memories_to_pinecone import app as embed_app
+from functions.fetch_images_with_metadata import app as fetch_app
+from functions.generate_memories_and_diary import app as generate_app
+from runner.pipeline import PipelineRunner
+from tests.fakes import FakeServiceError, FixtureMission, install_fakes
+from utils import clients, deadline, mission_manifest, stage_manifest
+from utils.deadline import DEADLINE_MARGIN_MS, CostModel, WorkBudget
+from botocore.exceptions import ClientError
+from types import SimpleNamespace
+import asyncio
+import json
+import pytest
+
+
+@pytest.fixture
+def backends(tmp_path, monkeypatch):
+    monkeypatch.setenv("NASA_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("PINECONE_API_KEY", "test")
+    monkeypatch.setenv("STAGE_MANIFESTS", "false")
+    monkeypatch.setenv("EMIT_METRICS", "false")
+    monkeypatch.setenv("NASA_CACHE_DIR", str(tmp_path / "nasa_cache"))
+    monkeypatch.setenv("MANIFEST_CACHE_DIR", str(tmp_path / "nasa_cache"))
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    monkeypatch.setattr(fetch_app, "_photo_cache", None)
+    monkeypatch.setenv("LOCAL_INDEX_DIR", str(tmp_path / "local_index"))
+    monkeypatch.setattr(embed_app, "_embedding_cache", None)
+    monkeypatch.setattr(embed_app, "_local_index", None)
+    monkeypatch.setattr(mission_manifest, "_manifest", None)
+    deadline.reset_cost_models()
+    monkeypatch.setenv("LABEL_CACHE_DIR", str(tmp_path / "label_cache"))
+    monkeypatch.setattr(generate_app, "_label_cache", None)
+    yield install_fakes(mission=FixtureMission(max_sol=200), embedding_dims=8)
+    clients.reset_clients()
+
+
+def test_pipeline_runs_offline(backends):
+    earth_date = backends.mission.dates_with_navcam(1, start_sol=100)[0]
+
+    fetched = fetch_app.lambda_handler({"earth_date": earth_date}, None)
+    generated = generate_app.lambda_handler(
+        {"earth_date": earth_date, "fetch_result": fetched}, None)
+    embedded = embed_app.lambda_handler(
+        {"earth_date": earth_date, "process_result": generated}, None)
+
+    photos = [photo for photo in json.loads(fetched["body"]) if not photo.get("alternate")]
+    results = json.loads(embedded["body"])
+    assert 0 < len(photos) <= 5
+    assert len(results) == len(photos)
+    assert all(result["upserted"] for result in results)
+    assert len(backends.pinecone_index.vectors) == len(photos)
+    assert len(embed_app.get_local_index()) == len(photos)
+    assert backends.stats.counts["openai.chat"] == len(photos)
+    log = backends.dynamodb_resource.Table("PipelineTransactionLog").items[earth_date]
+    assert log["Lambda3__EmbedToPinecone"]["status"] == "Success"
+    timings = log["Lambda2__GenerateMemories"]["timings"]
+    assert timings["spans"]["openai.chat"]["count"] == len(photos)
+
+
+def test_generate_retry_resumes_from_checkpoints(backends):
+    earth_date = backends.mission.dates_with_navcam(1, start_sol=100)[0]
+    fetched = fetch_app.lambda_handler({"earth_date": earth_date}, None)
+    event = {"earth_date": earth_date, "fetch_result": fetched}
+    first = json.loads(generate_app.lambda_handler(event, None)["body"])
+    assert len(first) >= 3
+
+    # One memory never got uploaded, another was overwritten without its checksum
+    keys = [record["s3_url"].split(".com/", 1)[1] for record in first]
+    del backends.s3.objects[(generate_app.BUCKET, keys[0])]
+    backends.s3.put_object(Bucket=generate_app.BUCKET, Key=keys[1], Body=b"partial")
+    backends.stats.counts.clear()
+
+    retried = json.loads(generate_app.lambda_handler(event, None)["body"])
+
+    assert [record["s3_url"] for record in retried] == [record["s3_url"] for record in first]
+    assert backends.stats.counts["openai.chat"] == 2
+    assert backends.stats.counts["rekognition.detect_labels"] == 0  # Labels are cached
+    assert "text" not in retried[2] and retried[0]["text"] == first[0]["text"]
+
+
+@pytest.mark.parametrize("manifests", ["false", "true"])
+def test_generate_continues_when_out_of_time(backends, monkeypatch, manifests):
+    monkeypatch.setenv("STAGE_MANIFESTS", manifests)
+    earth_date = backends.mission.dates_with_navcam(1, start_sol=100)[0]
+    fetched = fetch_app.lambda_handler({"earth_date": earth_date}, None)
+    # No time left, so each invocation only starts the photo it always may
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: DEADLINE_MARGIN_MS - 1)
+    event = {"earth_date": earth_date, "fetch_result": fetched}
+
+    invocations = 0
+    while True:
+        result = generate_app.lambda_handler(event, context)
+        invocations += 1
+        if "continuation" not in result:
+            break
+        event["continuation"] = json.loads(json.dumps(result["continuation"]))
+        if manifests == "true":  # Only references to the lists are in the state
+            assert "manifest" in event["continuation"]["photos"]
+            assert "manifest" in event["continuation"]["results"]
+
+    memories = list(stage_manifest.iter_stage_records(result))
+    assert invocations == len(memories) > 1
+    assert backends.stats.counts["openai.chat"] == len(memories)
+    log = backends.dynamodb_resource.Table("PipelineTransactionLog").items[earth_date]
+    assert log["Lambda2__GenerateMemories"]["status"] == "Success"
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_failed_photos_feed_the_cost_model(backends, monkeypatch, batch_size):
+    earth_date = backends.mission.dates_with_navcam(1, start_sol=100)[0]
+    photos = list(stage_manifest.iter_stage_records(
+        fetch_app.lambda_handler({"earth_date": earth_date}, None)))
+
+    def upload_memory(s3_client, photo, text):
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Denied"}}, "PutObject")
+
+    monkeypatch.setattr(generate_app, "upload_memory", upload_memory)
+    budget = WorkBudget(None, CostModel(generate_app.PHOTO_COST_MS))
+
+    results, errors, _ = generate_app.process_photos(
+        photos, backends.openai, backends.rekognition, backends.s3, batch_size=batch_size,
+        budget=budget)
+
+    assert not results and errors
+    assert budget.cost_model.samples == len(errors)
+
+
+def test_runner_streams_photos_through_all_stages(backends):
+    dates = backends.mission.dates_with_navcam(3, start_sol=100)
+    runner = PipelineRunner(queue_size=2, embed_batch_size=4, embed_linger_seconds=0.01)
+
+    summary = asyncio.run(runner.run(dates))
+
+    assert summary["dates"] == 3
+    assert summary["failed"] == 0
+    assert summary["embedded"] == summary["photos"] > 0
+    assert len(backends.pinecone_index.vectors) == summary["photos"]
+    assert len(runner.photo_latencies_ms) == summary["photos"]
+    table = backends.dynamodb_resource.Table("PipelineTransactionLog")
+    for earth_date in dates:
+        log = table.items[earth_date]
+        assert log["Lambda1__FetchImages"]["status"] == "Success"
+        assert log["Lambda2__GenerateMemories"]["status"] == "Success"
+        assert log["Lambda3__EmbedToPinecone"]["status"] == "Success"
+
+
+def test_fakes_inject_errors(backends):
+    backends.s3.error_rate = 1.0
+    backends.openai.error_rate = 1.0
+
+    with pytest.raises(ClientError):
+        backends.s3.put_object(Bucket="b", Key="k", Body=b"x")
+    with pytest.raises(FakeServiceError):
+        backends.openai.embeddings.create(input=["x"], model="m")
+    assert backends.stats.counts["s3.put_object"] == 1
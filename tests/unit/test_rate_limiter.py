@@ -0,0 +1,131 @@
+from tests.fakes import install_fakes
+from utils import clients, rate_limiter
+from utils.rate_limiter import DynamoDBTokenBucket, TokenBucket, rate_limited_call
+from botocore.exceptions import ClientError
+from types import SimpleNamespace
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def throttling_error(headers=None):
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Slow down"},
+                        "ResponseMetadata": {"HTTPStatusCode": 400,
+                                             "HTTPHeaders": headers or {}}},
+                       "DetectLabels")
+
+
+@pytest.fixture(autouse=True)
+def limiters(monkeypatch):
+    monkeypatch.delenv("RATE_LIMIT_TABLE", raising=False)
+    rate_limiter.reset_limiters()
+    yield
+    rate_limiter.reset_limiters()
+
+
+def test_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+
+
+def test_rate_limited_call_retries_throttling(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TEST", "0")
+    delays = []
+    responses = [throttling_error({"retry-after": "2"}), throttling_error(), "labels"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert rate_limited_call("test", call, sleep=delays.append) == "labels"
+    assert delays[0] == 2.0
+    assert 0 <= delays[1] <= 2 * rate_limiter.BACKOFF_BASE_SECONDS
+
+
+def test_rate_limited_call_gives_up(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TEST", "0")
+    rate_limited = SimpleNamespace(calls=0)
+
+    def throttled():
+        rate_limited.calls += 1
+        raise throttling_error()
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ClientError):
+        rate_limited_call("test", throttled, max_retries=2, sleep=lambda _: None)
+    assert rate_limited.calls == 3
+    with pytest.raises(ValueError):
+        rate_limited_call("test", broken, sleep=lambda _: None)
+
+
+def test_rate_limited_call_retries_transient_errors(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TEST", "0")
+    server_error = Exception("bad gateway")
+    server_error.response = SimpleNamespace(status_code=502, headers={})
+    responses = [ConnectionResetError("reset"), server_error, "photos"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert rate_limited_call("test", call, sleep=lambda _: None) == "photos"
+
+
+def test_clients_for_rate_limited_calls_do_not_retry(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("PINECONE_API_KEY", "test")
+    clients.reset_clients()
+    try:
+        assert clients.get_rekognition_client().meta.config.retries["total_max_attempts"] == 1
+        assert clients.get_s3_client().meta.config.retries == {"mode": "standard"}
+        assert clients.get_openai_client().max_retries == 0
+        assert clients.get_pinecone_client().openapi_config.retries == 0
+        adapter = clients.get_http_session(retries=False).get_adapter("https://api.nasa.gov")
+        assert adapter.max_retries.total == 0
+        adapter = clients.get_http_session().get_adapter("https://mars.nasa.gov")
+        assert adapter.max_retries.total == clients.HTTP_MAX_RETRIES
+    finally:
+        clients.reset_clients()
+
+
+def test_retry_after_from_http_errors():
+    response = SimpleNamespace(status_code=429, headers={"Retry-After-Ms": "250"})
+    error = Exception("rate limited")
+    error.response = response
+
+    assert rate_limiter.is_throttled(error)
+    assert rate_limiter.retry_after_seconds(error) == 0.25
+
+
+def test_dynamodb_buckets_share_one_budget():
+    backends = install_fakes()
+    clock = FakeClock()
+    buckets = [DynamoDBTokenBucket("RateLimits", "openai", rate=1, capacity=4, lease=2,
+                                   clock=clock, sleep=clock.sleep) for _ in range(2)]
+
+    # Both processes lease from the same 4 tokens, so the fifth call has to wait
+    assert [buckets[i % 2].acquire() for i in range(4)] == [0, 0, 0, 0]
+    assert buckets[0].acquire() == pytest.approx(1)
+    assert backends.stats.counts["dynamodb.write"] == 3
+    clients.reset_clients()
@@ -0,0 +1,33 @@
+from functions.utils.response_cache import ResponseCache
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ResponseCache("test", disk_dir=str(tmp_path))
+    cache.put("sol-1", [{"id": 1}])
+
+    assert cache.get("sol-1") == [{"id": 1}]
+    assert cache.get("sol-2") is None
+    # A new instance (e.g. the next cold start) reads the entry back from disk
+    assert ResponseCache("test", disk_dir=str(tmp_path)).get("sol-1") == [{"id": 1}]
+
+
+def test_memory_evicts_least_recently_used():
+    cache = ResponseCache("test", memory_max_bytes=50)
+    cache.put("a", "x" * 20)
+    cache.put("b", "y" * 20)
+    cache.get("a")
+    cache.put("c", "z" * 20)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 20
+    assert cache.get("c") == "z" * 20
+
+
+def test_disk_evicts_when_over_budget(tmp_path):
+    cache = ResponseCache("test", disk_dir=str(tmp_path), disk_max_bytes=50)
+    for key in ["a", "b", "c"]:
+        cache.put(key, key * 20)
+
+    on_disk = ResponseCache("test", disk_dir=str(tmp_path))
+    assert on_disk.get("a") is None
+    assert on_disk.get("c") == "c" * 20
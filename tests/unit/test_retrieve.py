@@ -0,0 +1,76 @@
+from functions.retrieve_memories import app
+from tests.fakes import install_fakes
+from utils import clients
+import json
+import pytest
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.delenv("LOCAL_INDEX_DIR", raising=False)
+    monkeypatch.setenv("EMIT_METRICS", "false")
+    monkeypatch.setattr(app, "_query_cache", None)
+    backends = install_fakes(embedding_dims=8)
+    openai = backends.openai
+    for i, (date, memory_type) in enumerate([("2012-08-07", "memory"), ("2012-08-20", "memory"),
+                                             ("2012-08-21", "diary")]):
+        url = f"https://curiosity-data-1205.s3.amazonaws.com/memories/{date}/image{i}_memory.txt"
+        text = f"Memory {i}"
+        backends.s3.put_object(Bucket="curiosity-data-1205", Key=url.split(".com/")[1], Body=text)
+        backends.pinecone_index.upsert([{
+            "id": f"memory-{i}", "values": openai.vector(f"memory {i}"),
+            "metadata": {"date": date, "date_num": int(date.replace("-", "")),
+                         "type": memory_type, "s3_url": url},
+        }])
+    backends.stats.reset()
+    yield backends
+    clients.reset_clients()
+
+
+def test_build_filter():
+    assert app.build_filter() is None
+    assert app.build_filter(types=["diary"]) == {"type": {"$in": ["diary"]}}
+    assert app.build_filter("2012-08-06", "2012-08-31", ["memory"]) == {"$and": [
+        {"date_num": {"$gte": 20120806, "$lte": 20120831}}, {"type": {"$in": ["memory"]}}]}
+
+
+def test_retrieve_filters_caches_and_hydrates(backends):
+    result = app.lambda_handler({"query": "memory 1", "top_k": 3}, None)
+
+    matches = json.loads(result["body"])["matches"]
+    assert matches[0]["id"] == "memory-1"
+    assert matches[0]["text"] == "Memory 1"
+    assert backends.stats.counts["s3.get_object"] == 3
+
+    result = app.lambda_handler({"query": "memory 1", "start_date": "2012-08-01",
+                                 "end_date": "2012-08-15", "types": "memory"}, None)
+
+    assert [m["id"] for m in json.loads(result["body"])["matches"]] == ["memory-0"]
+    assert backends.stats.counts["openai.embeddings"] == 1
+
+
+def test_query_cache_is_keyed_on_the_embedded_text(backends):
+    cache = app.get_query_cache()
+
+    vector = app.embed_query("Rocks near Bradbury", backends.openai, cache)
+    assert app.embed_query("Rocks near Bradbury", backends.openai, cache) == vector
+    other = app.embed_query("rocks near bradbury", backends.openai, cache)
+
+    assert vector == backends.openai.vector("Rocks near Bradbury")
+    assert other == backends.openai.vector("rocks near bradbury")
+    assert backends.stats.counts["openai.embeddings"] == 2
+
+
+def test_ttl_cache_expires_and_evicts():
+    from utils.ttl_cache import TTLCache
+
+    now = [0.0]
+    cache = TTLCache(max_entries=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    now[0] = 11.0
+    assert cache.get("a") is None and cache.get("c") is None
@@ -0,0 +1,186 @@
+from types import SimpleNamespace
+from functions.daily_scheduler import app
+from tests.fakes import install_fakes
+from utils import clients
+from utils.ddb_utility import PipelineLogWriter, query_dates_by_status
+import pytest
+
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:MarsPipeline"
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setenv("SIMULATED_DATES_TABLE", "SimulatedDates")
+    monkeypatch.setenv("STEP_FUNCTION_ARN", STATE_MACHINE_ARN)
+    monkeypatch.setenv("EMIT_METRICS", "false")
+    monkeypatch.delenv("NASA_API_KEY", raising=False)  # Every date counts as having photos
+    backends = install_fakes()
+    table = backends.dynamodb_resource.Table("SimulatedDates")
+    for item in [{"simulation_id": "mvp", "earth_date": "2012-08-06"},
+                 {"simulation_id": "crater", "earth_date": "2013-01-01"},
+                 {"simulation_id": "paused", "earth_date": "2013-01-01", "active": False},
+                 {"simulation_id": "test", "earth_date": "2012-08-07"},
+                 {"simulation_id": "backfill#rebuild", "start_date": "2012-08-06"}]:
+        table.put_item(Item=item)
+    yield backends
+    clients.reset_clients()
+
+
+def test_fan_out_advances_and_starts_active_simulations(backends):
+    result = app.lambda_handler({"simulation_ids": "all"}, None)
+
+    assert result["body"]["started"] == 2
+    names = sorted(arn.rsplit(":", 1)[1] for arn in backends.stepfunctions.executions)
+    assert names == ["crater-2013-01-01", "mvp-2012-08-06"]
+    items = backends.dynamodb_resource.Table("SimulatedDates").items
+    assert items["mvp"]["earth_date"] == "2012-08-07"
+    assert items["crater"]["earth_date"] == "2013-01-02"
+    assert items["paused"]["earth_date"] == "2013-01-01"
+    assert items["test"]["earth_date"] == "2012-08-07"
+
+
+def test_fan_out_reads_listed_simulations_in_batches(backends):
+    result = app.lambda_handler({"simulation_ids": ["mvp", "new", "test"]}, None)
+
+    assert sorted(r["simulation_id"] for r in result["body"]["simulations"]) == ["mvp", "new"]
+    assert backends.stats.counts["dynamodb.batch_read"] == 1
+    assert backends.dynamodb_resource.Table("SimulatedDates").items["new"]["earth_date"] \
+        == "2012-08-07"
+
+
+def test_unprocessed_keys_are_retried_a_bounded_number_of_times(backends, monkeypatch):
+    resource = backends.dynamodb_resource
+    read = resource.batch_get_item
+
+    def throttled(RequestItems):
+        # Only "mvp" is ever read; the other keys stay unprocessed
+        response = read(RequestItems)
+        keys = [key for key in RequestItems["SimulatedDates"]["Keys"]
+                if key["simulation_id"] != "mvp"]
+        response["Responses"]["SimulatedDates"] = [
+            item for item in response["Responses"]["SimulatedDates"]
+            if item["simulation_id"] == "mvp"]
+        response["UnprocessedKeys"] = {"SimulatedDates": {"Keys": keys}} if keys else {}
+        return response
+
+    monkeypatch.setattr(resource, "batch_get_item", throttled)
+    sleeps = []
+    table = resource.Table("SimulatedDates")
+
+    simulations = app.get_simulations(table, ["mvp", "crater", "new"], sleep=sleeps.append)
+
+    assert simulations == {"mvp": "2012-08-06"}
+    assert len(sleeps) == app.MAX_RETRIES
+    assert "new" not in table.items  # Unread, so not created either
+
+
+def test_overlapping_advance_is_rejected(backends):
+    table = backends.dynamodb_resource.Table("SimulatedDates")
+
+    assert app.advance_simulation(table, "mvp", "2012-08-06")
+    assert not app.advance_simulation(table, "mvp", "2012-08-06")
+    assert table.items["mvp"]["earth_date"] == "2012-08-07"
+
+
+def test_backfill_reruns_incomplete_dates_from_status_index(backends):
+    writer = PipelineLogWriter()
+    outcomes = {"2012-08-06": [("Lambda1: FetchImages", "Success"),
+                               ("Lambda2: GenerateMemories", "Success"),
+                               ("Lambda3: EmbedToPinecone", "Success")],
+                "2012-08-07": [("Lambda1: FetchImages", "Error")],
+                "2012-08-08": [("Lambda0: Daily Scheduler", "SKIPPED")],
+                "2012-08-09": [("Lambda1: FetchImages", "Success"),
+                               ("Lambda2: GenerateMemories", "Failed")],
+                "2012-08-10": [("Lambda1: FetchImages", "Success")],
+                "2012-09-01": [("Lambda1: FetchImages", "Error")]}
+    for earth_date, stages in outcomes.items():
+        for lambda_name, status in stages:
+            writer.record(earth_date, lambda_name=lambda_name, lambda_status=status)
+            writer.flush()
+    log = backends.dynamodb_resource.Table("PipelineTransactionLog").items
+    assert {earth_date: item["pipeline_status"] for earth_date, item in log.items()} == {
+        "2012-08-06": "COMPLETE", "2012-08-07": "FAILED", "2012-08-08": "SKIPPED",
+        "2012-08-09": "FAILED", "2012-08-10": "IN_PROGRESS", "2012-09-01": "FAILED"}
+    assert log["2012-08-09"]["last_stage"] == "Lambda2__GenerateMemories"
+
+    items, next_key = query_dates_by_status("FAILED", "2012-08-01", "2012-08-31", page_size=1)
+    assert [item["EarthDate"] for item in items] == ["2012-08-07"] and next_key
+
+    result = app.backfill_handler({"backfill_id": "retry", "start_date": "2012-08-01",
+                                   "end_date": "2012-08-31", "rerun_incomplete": True}, None)
+
+    names = sorted(arn.rsplit(":", 1)[1] for arn in backends.stepfunctions.executions)
+    assert names == ["backfill-retry-2012-08-07", "backfill-retry-2012-08-09",
+                     "backfill-retry-2012-08-10"]
+    assert result["body"]["next_date"] is None
+
+
+def test_single_simulation_execution_is_named_by_date(backends):
+    app.lambda_handler({"simulation_id": "mvp"}, None)
+    backends.dynamodb_resource.Table("SimulatedDates").items["mvp"]["earth_date"] = "2012-08-06"
+    result = app.lambda_handler({"simulation_id": "mvp"}, None)  # A retried invocation
+
+    assert list(backends.stepfunctions.executions) == [result["body"]["step_function_run_id"]]
+    assert result["body"]["step_function_run_id"].endswith(":mvp-2012-08-06")
+
+
+def test_backfill_runs_bounded_waves_and_resumes(backends):
+    stepfunctions = backends.stepfunctions
+    stepfunctions.initial_status = "RUNNING"
+    sleeps = []
+
+    def finish_running(seconds):
+        sleeps.append(seconds)
+        if seconds == app.BACKFILL_POLL_SECONDS:
+            for arn, execution in stepfunctions.executions.items():
+                failed = arn.endswith("2012-08-07")
+                execution["status"] = "FAILED" if failed else "SUCCEEDED"
+
+    # Time for one poll: it stops after the second wave, with the last date running
+    remaining = iter([60000, 40000])
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: next(remaining))
+    result = app.backfill_handler({"backfill_id": "range", "start_date": "2012-08-06",
+                                   "end_date": "2012-08-08", "max_concurrency": 2},
+                                  context, sleep=finish_running)
+
+    assert result["body"]["status"] == "RUNNING"
+    assert [execution["date"] for execution in result["body"]["running"]] == ["2012-08-08"]
+    assert result["body"]["succeeded"] == 1 and result["body"]["failed"] == ["2012-08-07"]
+    assert sleeps.count(app.BACKFILL_POLL_SECONDS) == 1
+    assert sleeps.count(1 / app.BACKFILL_STARTS_PER_SECOND) == 3
+    table = backends.dynamodb_resource.Table("SimulatedDates")
+    assert table.items["backfill#range"]["version"] == 2
+
+    stepfunctions.initial_status = "SUCCEEDED"
+    stepfunctions.executions[_arn("backfill-range-2012-08-08")]["status"] = "SUCCEEDED"
+    result = app.backfill_handler({"backfill_id": "range"}, None, sleep=finish_running)
+
+    assert result["body"]["status"] == "COMPLETE"
+    assert result["body"]["succeeded"] == 2 and result["body"]["running"] == []
+    assert table.items["backfill#range"]["version"] == 3
+    assert len(stepfunctions.executions) == 3
+
+
+def test_backfill_execution_names_are_sanitised(backends):
+    backfill_id = "rebuild 2012/08 " + "x" * 80
+    app.backfill_handler({"backfill_id": backfill_id, "start_date": "2012-08-06",
+                          "end_date": "2012-08-06"}, None, sleep=lambda _: None)
+
+    name = next(iter(backends.stepfunctions.executions)).rsplit(":", 1)[1]
+    assert name == app.execution_name(f"backfill-{backfill_id}", "2012-08-06")
+    assert len(name) == 80 and name.endswith("-2012-08-06") and " " not in name
+
+
+def test_backfill_rejects_a_different_range_for_an_existing_id(backends):
+    event = {"backfill_id": "range", "start_date": "2012-08-06", "end_date": "2012-08-07"}
+    app.backfill_handler(event, None, sleep=lambda _: None)
+
+    with pytest.raises(ValueError, match="end_date"):
+        app.backfill_handler({**event, "end_date": "2012-09-01"}, None)
+    with pytest.raises(ValueError, match="rerun_incomplete"):
+        app.backfill_handler({**event, "rerun_incomplete": True}, None)
+    assert app.backfill_handler(event, None)["body"]["status"] == "COMPLETE"  # Same range
+
+
+def _arn(name):
+    return STATE_MACHINE_ARN.replace(":stateMachine:", ":execution:") + ":" + name
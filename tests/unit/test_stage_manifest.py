@@ -0,0 +1,44 @@
+from tests.fakes import install_fakes
+from utils import clients
+from utils.stage_manifest import iter_manifest, iter_stage_records, stage_result, write_manifest
+import pytest
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setenv("STAGE_MANIFESTS", "true")
+    backends = install_fakes()
+    yield backends
+    clients.reset_clients()
+
+
+def test_manifest_round_trip(backends):
+    records = [{"id": i, "img_src": f"https://mars.nasa.gov/{i}.jpg"} for i in range(5)]
+
+    result = stage_result(records, "2012-08-06", "fetch")
+
+    ref = result["manifest"]
+    assert ref["count"] == 5 and ref["key"].startswith("manifests/2012-08-06/fetch-")
+    assert list(iter_stage_records(result)) == records
+    plain = write_manifest(records, "2012-08-06", "fetch", compress=False)
+    assert list(iter_manifest(plain)) == records
+
+
+def test_manifests_of_the_same_date_do_not_overwrite_each_other(backends):
+    first = write_manifest([{"id": 1}], "2012-08-06", "fetch")
+    second = write_manifest([{"id": 2}], "2012-08-06", "fetch")  # e.g. another simulation
+    again = write_manifest([{"id": 1}], "2012-08-06", "fetch")  # e.g. a rerun
+
+    assert first["key"] != second["key"] and again == first
+    assert list(iter_manifest(first)) == [{"id": 1}]
+    assert list(iter_manifest(second)) == [{"id": 2}]
+
+
+def test_tampered_manifest_fails_its_checksum(backends):
+    ref = write_manifest([{"id": 1}, {"id": 2}], "2012-08-06", "fetch", compress=False)
+    backends.s3.put_object(Bucket=ref["bucket"], Key=ref["key"],
+                           Body=b'{"id":1}\n{"id":3}\n')
+
+    # Caught before the first record, which is intact, is handed out
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        next(iter_manifest(ref))
@@ -0,0 +1,29 @@
+from functions.utils import tracing
+import json
+import pytest
+
+
+def test_trace_records_spans_and_metrics(capsys, monkeypatch):
+    monkeypatch.setenv("EMIT_METRICS", "true")
+    tracing.start_trace("generate")
+    with tracing.span("openai.chat"):
+        pass
+    with pytest.raises(ValueError):
+        with tracing.span("openai.chat"):
+            raise ValueError("boom")
+
+    summary = tracing.finish_trace("2012-08-07")
+
+    assert summary["spans"]["openai.chat"]["count"] == 2
+    assert summary["spans"]["openai.chat"]["errors"] == 1
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records[0]["Stage"] == "generate" and "StageDuration" in records[0]
+    assert records[1]["Span"] == "openai.chat" and records[1]["Calls"] == 2
+    assert records[1]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Stage", "Span"]]
+
+
+def test_span_without_trace_is_not_recorded():
+    with tracing.span("s3.get_memory"):
+        pass
+
+    assert tracing.finish_trace() is None